@@ -4,11 +4,12 @@ import numpy as np
 import os
 import io
 from datetime import datetime
-import time
+from survey_cache import file_digest, load_cached_survey
+from survey_schema import survey_schema
 
 # 安全导入分析模块
 try:
-    from cross_analysis import process_crosstab
+    from cross_analysis import process_crosstab, SurveyIndex
     CROSS_ANALYSIS_AVAILABLE = True
 except ImportError:
     CROSS_ANALYSIS_AVAILABLE = False
@@ -16,9 +17,10 @@ except ImportError:
 
 try:
     from text_analysis import (
-        clean_text, manual_tagging, generate_wordcloud, 
-        text_clustering, export_results
+        clean_text, tag_texts, generate_wordcloud, 
+        text_clustering, export_results, preload_tokenizer
     )
+    from instrumentation import Instrumentation, TEXT_STAGES
     TEXT_ANALYSIS_AVAILABLE = True
 except ImportError:
     TEXT_ANALYSIS_AVAILABLE = False
@@ -212,40 +214,14 @@ st.markdown("<br>", unsafe_allow_html=True)
 
 # 多选题识别函数
 def identify_multi_choice_questions(columns):
-    """识别多选题并返回优化后的选项列表"""
-    import re
-    from collections import defaultdict
-    
+    """识别多选题并返回优化后的选项列表（表头结构按列名缓存，与分析引擎共用）"""
     try:
-        # 识别多选题根题
-        multi_choice_dict = defaultdict(list)
-        single_questions = []
-        
-        for col in columns:
-            try:
-                col_clean = str(col).strip()
-                # 匹配多选题格式 Q数字.
-                match = re.match(r'^(Q\d+\.)', col_clean)
-                if match:
-                    root = match.group(1)
-                    multi_choice_dict[root].append(col)
-                else:
-                    single_questions.append(col)
-            except:
-                single_questions.append(col)
-        
-        # 过滤出真正的多选题（有多个子选项的）
-        genuine_multi_choice = {}
-        for root, subcols in multi_choice_dict.items():
-            if len(subcols) > 1:
-                # 简化处理，直接使用root作为主题干
-                main_question = f"{root} [多选题]"
-                genuine_multi_choice[main_question] = subcols
-            else:
-                # 不是多选题，加入单选题列表
-                single_questions.extend(subcols)
-        
-        return genuine_multi_choice, single_questions
+        schema = survey_schema(columns)
+        genuine_multi_choice = {
+            f"{root} [多选题]": list(subcols)  # 简化处理，直接使用root作为主题干
+            for root, subcols in schema.multi_choice.items()
+        }
+        return genuine_multi_choice, list(schema.single_columns)
     
     except Exception as e:
         # 如果出错，返回原始列表
@@ -282,20 +258,55 @@ def get_optimized_question_list(columns):
         return display_options, option_mapping
 
 # 性能优化：缓存数据读取函数
-@st.cache_data(show_spinner=False)
-def load_data(file, file_type):
-    """缓存文件读取，避免重复加载"""
+def parse_data(file, file_type):
+    """解析上传文件"""
     if file_type == 'csv':
         try:
             return pd.read_csv(file, encoding='utf-8')
         except UnicodeDecodeError:
             try:
+                file.seek(0)
                 return pd.read_csv(file, encoding='gbk')
             except UnicodeDecodeError:
+                file.seek(0)
                 return pd.read_csv(file, encoding='latin-1')
     else:
         return pd.read_excel(file)
 
+@st.cache_data(show_spinner=False)
+def load_data(file, file_type):
+    """缓存文件读取，避免重复加载（跨会话按文件内容缓存为列式格式）"""
+    return load_cached_survey(file, lambda f: parse_data(f, file_type), kind=f"upload-{file_type}")
+
+# 性能优化：每个数据集只构建一次题目索引，切换行/列变量时复用
+def get_survey_index(df, file_key):
+    """按上传文件内容的哈希缓存SurveyIndex（保存在会话状态中），同名同大小的不同文件不会误用旧索引"""
+    cached = st.session_state.get("survey_index")
+    if cached is None or cached[0] != file_key:
+        st.session_state["survey_index"] = (file_key, SurveyIndex(df))
+    return st.session_state["survey_index"][1]
+
+def streamlit_progress(progress_bar, status_text):
+    """把分析函数报告的阶段（见 instrumentation.py）显示到进度条和状态文字"""
+    def callback(event):
+        if event['progress'] is not None:
+            progress_bar.progress(int(event['progress'] * 100))
+        if event['status'] == 'start':
+            status_text.text(f"⚙️ 正在{event['label']}...")
+        elif event['status'] == 'end':
+            status_text.text(f"✅ {event['label']}完成（{event['elapsed']:.2f}秒）")
+        if event.get('plan') is not None:
+            st.caption(f"🧮 {event['plan'].describe()}")
+    return callback
+
+# 共享部署时的交叉分析内存预算（MB），超出时自动改用稀疏或分块计算
+MEMORY_BUDGET = (int(os.environ["SURVEY_MEMORY_BUDGET_MB"]) * 2 ** 20
+                 if os.environ.get("SURVEY_MEMORY_BUDGET_MB") else None)
+
+# 启动时在后台预热分词器，首次文本分析无需等待词典加载（SURVEY_PRELOAD_TOKENIZER=0 关闭）
+if TEXT_ANALYSIS_AVAILABLE and os.environ.get("SURVEY_PRELOAD_TOKENIZER", "1") != "0":
+    preload_tokenizer()
+
 # 性能优化：缓存交叉分析结果
 @st.cache_data(show_spinner=False)
 def cached_crosstab(df_hash, row_questions, col_questions, sig_level, percent_format, data_column_width):
@@ -334,7 +345,6 @@ if uploaded_file is not None:
         # 显示加载动画
         with st.spinner('🔄 正在加载数据...'):
             df = load_data(uploaded_file, file_extension)
-            time.sleep(0.5)  # 给用户一个视觉反馈
         
         # 成功提示带动画
         success_placeholder = st.sidebar.empty()
@@ -467,52 +477,23 @@ if uploaded_file is not None:
                 status_text = st.empty()
                 
                 try:
-                    # 分步执行，显示进度
-                    status_text.text("📊 正在准备数据...")
-                    progress_bar.progress(20)
-                    
-                    # 验证变量有效性
-                    if not row_questions or not col_questions:
-                        st.error("请选择行变量和列变量")
-                        return
-                    
-                    status_text.text("⚙️ 正在执行交叉分析...")
-                    progress_bar.progress(40)
-                    
-                    # 使用内存中的DataFrame，避免文件I/O
-                    import tempfile
-                    import uuid
+                    # 使用内存中的数据集索引，报告直接写入内存，避免临时文件读写
+                    report_buffer = io.BytesIO()
+                    survey_index = get_survey_index(df, file_digest(uploaded_file))
                     
-                    # 创建唯一的临时文件名
-                    session_id = str(uuid.uuid4())[:8]
-                    temp_input = f"temp_input_{session_id}.xlsx"
-                    temp_output = f"temp_output_{session_id}.xlsx"
-                    
-                    # 快速保存到临时文件
-                    df.to_excel(temp_input, index=False, engine='openpyxl')
-                    
-                    progress_bar.progress(60)
-                    
-                    # 执行分析
+                    # 执行分析，进度条按实际完成的阶段更新
                     crosstab_df, sig_df = process_crosstab(
-                        input_file=temp_input,
-                        output_file=temp_output,
+                        input_file=survey_index,
+                        output_file=report_buffer,
                         row_questions=row_questions,
                         col_questions=col_questions,
                         sig_levels=[sig_level],
                         percent_format=percent_format,
-                        data_column_width=data_column_width
+                        data_column_width=data_column_width,
+                        progress_callback=streamlit_progress(progress_bar, status_text),
+                        memory_budget=MEMORY_BUDGET
                     )
                     
-                    status_text.text("📈 正在生成结果...")
-                    progress_bar.progress(90)
-                    time.sleep(0.5)
-                    
-                    # 完成进度条
-                    status_text.text("✅ 分析完成！")
-                    progress_bar.progress(100)
-                    time.sleep(1)
-                    
                     # 清除进度条
                     progress_bar.empty()
                     status_text.empty()
@@ -527,23 +508,13 @@ if uploaded_file is not None:
                         st.dataframe(crosstab_df.head(50), use_container_width=True)
                     
                     # 下载按钮（美化）
-                    with open(temp_output, 'rb') as f:
-                        st.download_button(
-                            label="📥 下载完整结果",
-                            data=f.read(),
-                            file_name=f"交叉分析结果_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            use_container_width=True
-                        )
-                    
-                    # 清理临时文件
-                    try:
-                        if os.path.exists(temp_input):
-                            os.remove(temp_input)
-                        if os.path.exists(temp_output):
-                            os.remove(temp_output)
-                    except Exception as cleanup_error:
-                        st.warning(f"临时文件清理失败: {cleanup_error}")
+                    st.download_button(
+                        label="📥 下载完整结果",
+                        data=report_buffer.getvalue(),
+                        file_name=f"交叉分析结果_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True
+                    )
                         
                 except Exception as e:
                     # 清理进度条
@@ -553,15 +524,6 @@ if uploaded_file is not None:
                     except:
                         pass
                     
-                    # 清理临时文件
-                    try:
-                        if 'temp_input' in locals() and os.path.exists(temp_input):
-                            os.remove(temp_input)
-                        if 'temp_output' in locals() and os.path.exists(temp_output):
-                            os.remove(temp_output)
-                    except:
-                        pass
-                    
                     st.error(f"❌ 分析出错: {str(e)}")
                     
                     # 显示调试信息（开发模式）
@@ -649,6 +611,9 @@ if uploaded_file is not None:
         
         # 执行分析
         if st.button("🚀 开始文本分析", type="primary", use_container_width=True):
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            tracker = Instrumentation(streamlit_progress(progress_bar, status_text), TEXT_STAGES)
             with st.spinner("正在执行文本分析..."):
                 try:
                     # 数据准备
@@ -656,15 +621,17 @@ if uploaded_file is not None:
                     
                     # 文本清洗
                     invalid_words = ['无', ' ', '没有', '不知道']
-                    clean_df = clean_text(text_df, text_column, invalid_words)
+                    with tracker.stage('clean', rows=len(text_df)):
+                        clean_df = clean_text(text_df, text_column, invalid_words)
                     
                     st.info(f"清洗后数据量: {len(clean_df)} 条")
                     
                     # 标签匹配
-                    if tag_keywords:
-                        clean_df[["匹配标签", "匹配关键词"]] = clean_df[text_column].apply(
-                            lambda x: pd.Series(manual_tagging(x, tag_keywords))
-                        )
+                    with tracker.stage('tagging', rows=len(clean_df)):
+                        if tag_keywords:
+                            clean_df["匹配标签"], clean_df["匹配关键词"] = tag_texts(
+                                clean_df[text_column], tag_keywords
+                            )
                     
                     # 生成词云
                     st.subheader("词云图")
@@ -672,7 +639,8 @@ if uploaded_file is not None:
                     generate_wordcloud(
                         texts=clean_df[text_column],
                         stopwords=stopwords,
-                        save_path=wordcloud_path
+                        save_path=wordcloud_path,
+                        progress_callback=tracker
                     )
                     
                     # 显示词云
@@ -694,7 +662,8 @@ if uploaded_file is not None:
                     cluster_df, cluster_labels = text_clustering(
                         clean_df[text_column],
                         n_clusters=n_clusters,
-                        max_samples=max_samples
+                        max_samples=max_samples,
+                        progress_callback=tracker
                     )
                     clean_df["聚类标签"] = cluster_labels
                     
@@ -703,7 +672,10 @@ if uploaded_file is not None:
                     
                     # 导出结果
                     output_path = "temp_text_analysis.xlsx"
-                    export_results(clean_df, cluster_df, output_path)
+                    with tracker.stage('export', rows=len(clean_df)):
+                        export_results(clean_df, cluster_df, output_path)
+                    progress_bar.empty()
+                    status_text.empty()
                     
                     # 下载按钮
                     with open(output_path, 'rb') as f:
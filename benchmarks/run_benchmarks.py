@@ -0,0 +1,261 @@
+"""
+性能基准：交叉分析各阶段与文本分析函数，在不同样本量下计时
+结果逐条追加到 JSONL 历史文件，并与同一环境下上一次的记录对比，变慢超过阈值时标出
+
+用法：
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10000 200000 --repeat 5 --only crosstab
+    python benchmarks/run_benchmarks.py --only startup
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from synthetic_survey import make_survey, survey_questions  # noqa: E402
+
+DEFAULT_HISTORY = os.path.join(BENCH_DIR, "history.jsonl")
+
+
+# === 运行环境 ===
+def _git_revision():
+    """当前提交与工作区是否有未提交修改"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def environment():
+    commit, dirty = _git_revision()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": f"{platform.system()}-{platform.machine()}-{os.cpu_count()}cpu",
+    }
+
+
+# === 计时 ===
+class StageTimer:
+    """多次运行同一流程，按阶段记录耗时"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def measure(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        return {stage: (min(times), statistics.median(times)) for stage, times in self.timings.items()}
+
+
+def bench_crosstab(n_rows, repeat, **_):
+    """process_crosstab 各阶段：建索引、解析题目、结构、指示矩阵、计数、显著性检验、写出Excel"""
+    import cross_analysis as ca
+
+    df = make_survey(n_rows)
+    singles, roots = survey_questions(df)
+    row_questions = singles[2:] + roots[1:]
+    col_questions = ["性别", "平台", singles[0], roots[0]]
+
+    # 预热：首次调用时的模块导入与缓存初始化不计入
+    ca.process_crosstab(make_survey(500), io.BytesIO(), row_questions, col_questions)
+
+    timer = StageTimer()
+    for _ in range(repeat):
+        survey_index = timer.measure("index", ca.SurveyIndex, df)
+        valid_rows, col_specs = timer.measure(
+            "resolve", ca.resolve_crosstab_questions, survey_index, row_questions, col_questions
+        )
+        layout = timer.measure("layout", ca.build_crosstab_layout, survey_index, valid_rows, col_specs)
+        row_matrix = timer.measure("row_matrix", layout.row_matrix, survey_index)
+        col_matrix = timer.measure("col_matrix", layout.col_matrix, survey_index)
+        counts = ca.CrosstabCounts(len(layout.row_labels), len(layout.col_labels))
+        timer.measure("count", counts.add, row_matrix, col_matrix)
+        tables = timer.measure("tables", ca.build_crosstab_tables, layout, counts)
+        timer.measure("write", ca.write_crosstab_report, io.BytesIO(), tables)
+        timer.measure("total", ca.process_crosstab, df, io.BytesIO(), row_questions, col_questions)
+        timer.measure("weighted_total", ca.process_crosstab, df, io.BytesIO(), row_questions, col_questions,
+                      weight_column="权重")
+        timer.measure("book", ca.process_crosstab_book, df, io.BytesIO(),
+                      banner=col_questions, stubs=row_questions)
+
+    cells = len(layout.row_labels) * len(layout.col_labels)
+    return {f"crosstab.{stage}": (best, median, {"cells": cells})
+            for stage, (best, median) in timer.summary().items()}
+
+
+def _wordcloud_font():
+    """词云字体：优先使用界面默认的 simhei.ttf，不存在时使用matplotlib自带字体（中文显示为方框，不影响计时）"""
+    if os.path.exists("simhei.ttf"):
+        return "simhei.ttf"
+    import matplotlib
+    return os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf")
+
+
+def bench_text(n_rows, repeat, font_path=None):
+    """文本分析：清洗、标签匹配（逐条与批量）、词云、聚类（与界面中的调用方式一致）"""
+    import text_analysis as ta
+
+    df = make_survey(n_rows, n_single=0, n_multi=0)[["开放题"]]
+    clean_df = ta.clean_text(df.copy(), "开放题", ["无", " ", "没有", "不知道"])
+    texts = clean_df["开放题"]
+    stopwords = {"希望", "还是", "有点", "太"}
+
+    ta.manual_tagging(texts.iloc[0], ta.DEFAULT_TAG_KEYWORDS)  # 预热
+    ta.get_tokenizer()
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(repeat):
+            timer.measure("clean", ta.clean_text, df.copy(), "开放题", ["无", " ", "没有", "不知道"])
+            timer.measure("manual_tagging", lambda: [
+                ta.manual_tagging(text, ta.DEFAULT_TAG_KEYWORDS, ta.DEFAULT_NEGATION_WORDS) for text in texts
+            ])
+            timer.measure("tag_texts", ta.tag_texts, texts, ta.DEFAULT_TAG_KEYWORDS, ta.DEFAULT_NEGATION_WORDS)
+            timer.measure("wordcloud", ta.generate_wordcloud, texts, stopwords,
+                          save_path=os.path.join(tmp, "wordcloud.png"), font_path=font_path or _wordcloud_font())
+            timer.measure("clustering", ta.text_clustering, texts, n_clusters=10)
+
+    return {f"text.{stage}": (best, median, {"texts": len(texts)})
+            for stage, (best, median) in timer.summary().items()}
+
+
+# 启动耗时：在全新的解释器中导入各入口模块，并记录顺带加载了哪些重型依赖
+STARTUP_MODULES = ["cross_analysis", "text_analysis", "run_jobs"]
+HEAVY_MODULES = ["scipy.stats", "openpyxl", "sklearn", "matplotlib", "jieba", "wordcloud", "streamlit"]
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def bench_startup(_size, repeat, **_):
+    """各入口模块的导入耗时（不含解释器本身的启动），每次在新进程中测量"""
+    results = {}
+    for module in STARTUP_MODULES:
+        script = STARTUP_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+        times, loaded = [], []
+        for _ in range(repeat + 1):  # 第一次用于预热磁盘缓存与 .pyc，不计入
+            output = subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR, capture_output=True,
+                                    text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            times.append(result["seconds"])
+            loaded = result["loaded"]
+        times = times[1:]
+        results[f"startup.{module}"] = (min(times), statistics.median(times), {"loaded": loaded})
+    return results
+
+
+BENCHMARKS = {"crosstab": bench_crosstab, "text": bench_text, "startup": bench_startup}
+
+
+# === 历史记录 ===
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path, records):
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def previous_record(history, record):
+    """同一环境、同一基准与样本量的上一条记录"""
+    for old in reversed(history):
+        if (old["benchmark"], old["size"], old["machine"]) == (record["benchmark"], record["size"], record["machine"]):
+            return old
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="交叉分析与文本分析性能基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="交叉分析样本量")
+    parser.add_argument("--text-sizes", type=int, nargs="+", default=[1000, 5000], help="文本分析样本量")
+    parser.add_argument("--repeat", type=int, default=3, help="每个样本量重复次数（取最小值与中位数）")
+    parser.add_argument("--only", choices=sorted(BENCHMARKS), nargs="+", default=sorted(BENCHMARKS))
+    parser.add_argument("--import-time-limit", type=float, default=1.0,
+                        help="入口模块导入耗时超过该秒数时标出（不论历史记录）")
+    parser.add_argument("--font-path", help="词云字体文件（默认 simhei.ttf，不存在时用matplotlib自带字体）")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="历史记录文件（JSONL）")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="最小耗时超过上次记录的倍数时标为变慢")
+    parser.add_argument("--min-time", type=float, default=0.01, help="耗时低于该秒数的阶段不标变慢（计时噪声大）")
+    parser.add_argument("--no-save", action="store_true", help="只打印结果，不写入历史记录")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    env = environment()
+    history = load_history(args.history)
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    records, slower, slow_imports = [], [], []
+
+    print(f"提交 {env['commit']}{' (有未提交修改)' if env['dirty'] else ''}  {env['machine']}  "
+          f"python {env['python']}  numpy {env['numpy']}  pandas {env['pandas']}")
+    print(f"{'基准':<28}{'样本量':>10}{'最小(s)':>10}{'中位数(s)':>11}{'对比上次':>10}")
+    for name in args.only:
+        sizes = {"text": args.text_sizes, "startup": [0]}.get(name, args.sizes)
+        for size in sizes:
+            results = BENCHMARKS[name](size, args.repeat, font_path=args.font_path)
+            for benchmark, (best, median, extra) in results.items():
+                record = dict(env, time=timestamp, benchmark=benchmark, size=size, repeat=args.repeat,
+                              min=round(best, 6), median=round(median, 6), **extra)
+                old = previous_record(history, record)
+                # 用最小值对比，受机器负载波动的影响较小
+                ratio = best / old["min"] if old and old["min"] > 0 else None
+                flag = ""
+                if ratio is not None and ratio > args.tolerance and best >= args.min_time:
+                    flag = "  ← 变慢"
+                    slower.append((benchmark, size, ratio, old["commit"]))
+                if name == "startup" and best > args.import_time_limit:
+                    flag += f"  ← 导入超过 {args.import_time_limit}s"
+                    slow_imports.append((benchmark, best, extra["loaded"]))
+                ratio_text = f"{ratio:.2f}x" if ratio is not None else "-"
+                print(f"{benchmark:<28}{size:>10}{best:>10.4f}{median:>11.4f}{ratio_text:>10}{flag}")
+                if extra.get("loaded"):
+                    print(f"    导入时加载了重型依赖：{', '.join(extra['loaded'])}")
+                records.append(record)
+
+    if not args.no_save:
+        append_history(args.history, records)
+        print(f"已追加 {len(records)} 条记录到 {args.history}")
+    for benchmark, size, ratio, commit in slower:
+        print(f"变慢：{benchmark}（{size}）为上次记录（提交 {commit}）的 {ratio:.2f} 倍")
+    for benchmark, seconds, loaded in slow_imports:
+        print(f"导入过慢：{benchmark} 耗时 {seconds:.2f}s" + (f"，加载了 {', '.join(loaded)}" if loaded else ""))
+    return 1 if slower or slow_imports else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
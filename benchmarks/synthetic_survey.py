@@ -0,0 +1,86 @@
+"""
+可复现的模拟问卷数据（用于性能基准）
+- K 道单选题：选项带编号（如 "3.一般"），选项占比不均匀，少量缺失
+- M 道多选题：子列 "Q{n}.{j}.题干:选项"，选中为1、未选中为空，选中率按选项递减（少数热门选项+长尾）
+- 一列中文开放题：由关键词片段拼接，含否定句、无效回答与空值
+同一组参数与随机种子生成完全相同的数据
+"""
+import numpy as np
+import pandas as pd
+
+SINGLE_OPTIONS = ["非常不满意", "不满意", "一般", "满意", "非常满意", "说不清", "其他", "不适用"]
+
+TEXT_FRAGMENTS = [
+    "生存模式很好玩", "喜欢和好友联机", "服务器经常掉线", "加载慢", "希望多出一些模组",
+    "光影效果很棒", "皮肤太贵了", "建筑玩法有意思", "手机发热严重", "起床战争很刺激",
+    "红石电路太难", "更新速度还可以", "考古系统挺新鲜", "充值活动太多", "组队语音不好用",
+    "画面很精致", "操作有点别扭", "希望优化触控", "村民交易很有趣", "没有遇到卡顿",
+    "不需要更多付费内容", "其实探索地图也不错", "材质包种类少", "小游戏很多", "玩家素质参差不齐",
+]
+TEXT_PUNCTUATION = ["，", "。", "！", "；", ","]
+INVALID_ANSWERS = ["无", "没有", "不知道", " "]
+
+
+def _skewed_probabilities(rng, n_options):
+    """选项占比：Dirichlet抽样后按大小排序，少数选项占大头"""
+    return np.sort(rng.dirichlet(np.full(n_options, 0.8)))[::-1]
+
+
+def _open_text(rng, n_rows, max_fragments=4, invalid_share=0.1, missing_share=0.05):
+    counts = rng.integers(1, max_fragments + 1, n_rows)
+    fragments = rng.integers(0, len(TEXT_FRAGMENTS), counts.sum())
+    punctuation = rng.integers(0, len(TEXT_PUNCTUATION), counts.sum())
+    texts, start = [], 0
+    for count in counts:
+        parts = [TEXT_FRAGMENTS[f] + TEXT_PUNCTUATION[p]
+                 for f, p in zip(fragments[start:start + count], punctuation[start:start + count])]
+        texts.append("".join(parts))
+        start += count
+    texts = np.array(texts, dtype=object)
+    kind = rng.random(n_rows)
+    invalid = kind < invalid_share
+    texts[invalid] = np.array(INVALID_ANSWERS, dtype=object)[rng.integers(0, len(INVALID_ANSWERS), invalid.sum())]
+    texts[(kind >= invalid_share) & (kind < invalid_share + missing_share)] = None
+    return texts
+
+
+def make_survey(n_respondents, n_single=8, n_multi=4, n_options=5, n_multi_options=8,
+                multi_density=0.2, missing_share=0.02, seed=0):
+    """
+    生成模拟问卷 DataFrame
+    - n_single / n_options: 单选题数量与每题选项数（不超过8）
+    - n_multi / n_multi_options: 多选题数量与每题子列数
+    - multi_density: 多选题平均选中率（各选项选中率按热度递减，均值约为该值）
+    """
+    rng = np.random.default_rng(seed)
+    n_options = min(n_options, len(SINGLE_OPTIONS))
+    data = {
+        "性别": np.where(rng.random(n_respondents) < 0.55, "1.男", "2.女"),
+        "平台": np.array(["1.Android", "2.iOS", "3.PC"], dtype=object)[
+            rng.choice(3, n_respondents, p=[0.6, 0.3, 0.1])
+        ],
+    }
+    for k in range(1, n_single + 1):
+        labels = np.array([f"{i}.{SINGLE_OPTIONS[i - 1]}" for i in range(1, n_options + 1)], dtype=object)
+        values = labels[rng.choice(n_options, n_respondents, p=_skewed_probabilities(rng, n_options))]
+        values[rng.random(n_respondents) < missing_share] = None
+        data[f"单选{k}"] = values
+
+    for m in range(1, n_multi + 1):
+        root = f"Q{100 + m}."
+        popularity = _skewed_probabilities(rng, n_multi_options)
+        rates = np.clip(popularity * n_multi_options * multi_density, 0.001, 0.95)
+        for j in range(1, n_multi_options + 1):
+            ticked = rng.random(n_respondents) < rates[j - 1]
+            data[f"{root}{j}.多选题{m}:选项{j}"] = np.where(ticked, 1.0, np.nan)
+
+    data["权重"] = rng.uniform(0.5, 2.0, n_respondents).round(4)
+    data["开放题"] = _open_text(rng, n_respondents)
+    return pd.DataFrame(data)
+
+
+def survey_questions(df):
+    """模拟问卷中的单选题与多选题根"""
+    singles = [col for col in df.columns if col.startswith("单选")]
+    roots = list(dict.fromkeys(col.split(".")[0] + "." for col in df.columns if col.startswith("Q")))
+    return singles, roots
@@ -1,27 +1,39 @@
 import pandas as pd
+import io
 import re
 import os
 import warnings
 import numpy as np
+import codecs
+import copy
+import pickle
+import tempfile
 from collections import defaultdict
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment, Font, PatternFill, Border, Side
-from openpyxl.formatting.rule import DataBarRule
-from openpyxl.chart import BarChart, Reference
-from scipy.stats import chi2_contingency, fisher_exact
-
-def extract_subcol_number(subcol, prefix):
-    suffix = subcol.split(prefix)[1].strip()
-    match = re.search(r'^(\d+)', suffix)
-    return int(match.group(1)) if match else 0
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from functools import lru_cache, partial
+try:
+    import xlsxwriter
+except ImportError:  # 未安装时退回openpyxl写出
+    xlsxwriter = None
+from scipy import sparse
+from scipy.special import chdtrc, ndtri
+# scipy.stats 与 openpyxl 导入较慢，在首次用到的函数内导入
+from survey_cache import load_cached_survey
+from survey_schema import survey_schema
+from survey_store import SurveyStore, option_sort_order, popcount, unpack_bits
+from recode import load_recode_rules, apply_recode, evaluate_expression, expression_columns
+from instrumentation import CROSSTAB_STAGES, BOOK_STAGES, instrumentation
 
 def perform_significance_test(observed):
     """执行统计检验并返回p值"""
+    from scipy.stats import chi2_contingency, fisher_exact
     try:
         # 尝试卡方检验
         chi2, p, dof, expected = chi2_contingency(observed)
         # 检查期望频数假设（超过20%的单元格期望频数小于5时使用费舍尔精确检验）
-        if (expected < 5).sum() / expected.size > 0.2:
+        # 总数为0时期望频数为NaN（部分scipy版本直接抛出异常），同样改用费舍尔精确检验
+        if (~(expected >= 5)).sum() / expected.size > 0.2:
             _, p = fisher_exact(observed)
     except:
         # 当出现计算错误时使用费舍尔精确检验
@@ -31,73 +43,592 @@ def perform_significance_test(observed):
             p = np.nan
     return p
 
-def process_crosstab(
-    input_file, 
-    output_file, 
-    row_questions, 
-    col_questions,
-    # 新增显著性检验参数
-    sig_levels=[0.05, 0.01, 0.001],
-    sig_symbols=['*', '**', '***'],
-    # 样式配置
-    header_height=55,
-    header_fill_color="4F81BD",
-    header_font_color="FFFFFF",
-    header_font_name="微软雅黑",
-    header_font_size=12,
-    # 数据条配置
-    freq_data_bar_color="638EC6",
-    percent_data_bar_color="C00000",
-    data_bar_min_length=15,
-    data_bar_max_length=100,
-    # 格式配置
-    percent_format="0.00%",
-    data_column_width=20,  # C列及之后的固定宽度（None表示自动调整）
-    max_column_width=40 #【可调整最大列宽】
-):
-    
-    # === 数据准备 ===
+@lru_cache(maxsize=65536)
+def _fisher_exact_p(a, b, c, d):
+    """费舍尔精确检验（按四格计数缓存，相同列联表只计算一次）"""
+    from scipy.stats import fisher_exact
     try:
-        df = pd.read_excel(input_file)
-        df.columns = [str(col).strip() for col in df.columns]  # 统一清理列名
-        
-        # ===== 新增：变量重新编码功能 =====
-        def recode_variable(df, source_col, new_col, rules):
-            """
-            重新编码变量
-            参数：
-            - df: 原始DataFrame
-            - source_col: 原始列名
-            - new_col: 新列名
-            - rules: 编码规则字典
-            """
-            if source_col not in df.columns:
-                warnings.warn(f"原始列 {source_col} 不存在，跳过重新编码")
-                return df
-            
-            if rules['method'] == 'map':
-                df[new_col] = df[source_col].map(rules['config']['mapping'])
-            elif rules['method'] == 'cut':
-                df[new_col] = pd.cut(
-                    df[source_col], 
-                    bins=rules['config']['bins'],
-                    labels=rules['config']['labels'],
-                    ordered=False
+        _, p = fisher_exact([[a, b], [c, d]])
+    except Exception:
+        p = np.nan
+    return p
+
+def batch_significance_test(a, b, c, d):
+    """
+    批量执行2×2列联表检验，返回与输入同形状的p值数组
+    判定规则与 perform_significance_test 一致：
+    - 默认使用带Yates连续性校正的卡方检验（向量化计算）
+    - 任一单元格期望频数小于5时改用费舍尔精确检验
+    """
+    a, b, c, d = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (a, b, c, d)))
+    shape = a.shape
+    observed = np.stack([a.ravel(), b.ravel(), c.ravel(), d.ravel()], axis=1)
+    n = observed.sum(axis=1, keepdims=True)
+    row_sums = np.repeat(observed[:, [0, 2]] + observed[:, [1, 3]], 2, axis=1)
+    col_sums = np.tile(observed[:, [0, 1]] + observed[:, [2, 3]], 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = row_sums * col_sums / n
+        # Yates校正：观测值向期望值方向移动，最多0.5
+        diff = expected - observed
+        corrected = observed + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+        stat = ((corrected - expected) ** 2 / expected).sum(axis=1)
+    p_values = chdtrc(1, stat)  # 自由度为1的卡方分布上尾概率（即 scipy.stats.chi2.sf）
+
+    # 期望频数不足或无法计算（总数为0时期望频数为NaN）的列联表改用费舍尔精确检验
+    use_fisher = ~(expected >= 5).all(axis=1)
+    if use_fisher.any():
+        tables = np.rint(observed[use_fisher]).astype(np.int64)
+        unique_tables, inverse = np.unique(tables, axis=0, return_inverse=True)
+        fisher_p = np.array([_fisher_exact_p(*map(int, t)) for t in unique_tables])
+        p_values[use_fisher] = fisher_p[inverse.ravel()]
+
+    return p_values.reshape(shape)
+
+def format_significance_stars(p_values, sig_levels, sig_symbols):
+    """将p值数组批量转换为“星号(p值)”格式的字符串，缺失值返回空字符串"""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    stars = np.full(p_values.shape, '')
+    for level, symbol in zip(sig_levels, sig_symbols):
+        stars = np.char.add(stars, np.where(p_values <= level, symbol, ''))
+    formatted = np.char.add(np.char.add(stars, '('), np.char.add(np.char.mod('%.3f', p_values), ')'))
+    return np.where(np.isnan(p_values), '', formatted).astype(object)
+
+def column_letters(count):
+    """生成列比较字母：A, B, ..., Z, AA, AB, ..."""
+    letters = []
+    for i in range(count):
+        label = ''
+        i += 1
+        while i:
+            i, rem = divmod(i - 1, 26)
+            label = chr(65 + rem) + label
+        letters.append(label)
+    return letters
+
+def column_proportion_tests(freq, col_totals, col_groups, sig_level=0.05):
+    """
+    列间比较（A/B/C字母标记）：同一列问题内的各列两两做比例z检验
+    参数：
+    - freq: (行条件数, 列条件数) 频数矩阵
+    - col_totals: 各列基数
+    - col_groups: 各列所属列问题，总计列为None（不参与比较）
+    - sig_level: 显著性水平
+    返回：(字母标记矩阵, 各列字母)，某单元格中的字母表示该列比例显著高于对应字母的列
+    """
+    freq = np.asarray(freq, dtype=np.float64)
+    col_totals = np.asarray(col_totals, dtype=np.float64)
+    marks = np.full(freq.shape, '', dtype=object)
+    col_letters = [''] * len(col_groups)
+    z_critical = -ndtri(sig_level / 2)  # 即 scipy.stats.norm.isf
+
+    group_positions = defaultdict(list)
+    for j, group in enumerate(col_groups):
+        if group is not None:
+            group_positions[group].append(j)
+
+    for positions in group_positions.values():
+        letters = column_letters(len(positions))
+        for j, letter in zip(positions, letters):
+            col_letters[j] = letter
+        if len(positions) < 2:
+            continue
+
+        # 组内两两比较：(行, 列i, 列j) 三维数组一次算完
+        counts = freq[:, positions]
+        bases = col_totals[positions]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            props = counts / bases
+            pooled = (counts[:, :, None] + counts[:, None, :]) / (bases[:, None] + bases[None, :])
+            se = np.sqrt(pooled * (1 - pooled) * (1 / bases[:, None] + 1 / bases[None, :]))
+            z = (props[:, :, None] - props[:, None, :]) / se
+        higher = z > z_critical
+
+        group_marks = np.full(counts.shape, '')
+        for k, letter in enumerate(letters):
+            group_marks = np.char.add(group_marks, np.where(higher[:, :, k], letter, ''))
+        marks[:, positions] = group_marks
+    return marks, col_letters
+
+def rake_weights(df, margins, base_weights=None, max_iter=100, tol=1e-6):
+    """
+    迭代比例拟合（IPF/Raking）计算样本权重
+    参数：
+    - df: 原始DataFrame，或 SurveyIndex（直接使用其缓存的选项编码，不再逐题编码字符串）
+    - margins: 目标边际分布 {题目: {选项: 目标占比或目标人数}}，每个题目内部按占比归一化
+    - base_weights: 初始权重（默认全为1）
+    - max_iter: 最大迭代次数
+    - tol: 收敛阈值（各边际加权占比与目标占比的最大绝对差）
+    返回：与df行数相同的权重数组；未出现在目标中的选项及缺失值不参与对应题目的调整
+    每轮迭代对每个边际做一次 bincount 与一次按编码取系数的乘法，耗时与样本量×边际数成正比；
+    所需轮数取决于目标与样本分布的差距（差距大、选项稀少时可能接近 max_iter）
+    """
+    n_rows = df.n_rows if isinstance(df, SurveyIndex) else len(df)
+    weights = (np.ones(n_rows) if base_weights is None
+               else np.asarray(base_weights, dtype=np.float64).copy())
+
+    # 每个边际题目只编码一次：codes为样本所属目标选项下标，不参与调整的样本编码为选项数（系数固定为1）
+    encoded = []
+    for question, targets in margins.items():
+        if question not in df.columns:
+            raise ValueError(f"加权变量 {question} 不存在")
+        options = list(targets.keys())
+        target = np.asarray([targets[o] for o in options], dtype=np.float64)
+        if isinstance(df, SurveyIndex):
+            lookup = {option: i for i, option in enumerate(options)}
+            remap = np.array([lookup.get(option, -1) for option in df.options(question)] + [-1], dtype=np.int64)
+            codes = remap[df.option_codes(question)]  # 缺失编码-1对应remap最后一项
+        else:
+            codes = pd.Index(options).get_indexer(df[question]).astype(np.int64)  # 不在目标中的取值为-1
+        counts = np.bincount(codes[codes >= 0], minlength=len(options))
+        missing = [o for o, n in zip(options, counts) if n == 0]
+        if missing:
+            warnings.warn(f"加权变量 {question} 的选项在数据中不存在，无法达到目标：{missing}")
+        codes[codes < 0] = len(options)
+        encoded.append((codes, target / target.sum()))
+
+    for _ in range(max_iter):
+        max_gap = 0.0
+        for codes, target_share in encoded:
+            totals = np.bincount(codes, weights=weights, minlength=len(target_share) + 1)[:-1]
+            covered = totals.sum()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                factors = np.append(np.where(totals > 0, target_share * covered / totals, 1.0), 1.0)
+            weights *= factors[codes]
+            max_gap = max(max_gap, np.abs(totals / covered - target_share)[totals > 0].max(initial=0))
+        if max_gap < tol:
+            break
+    else:
+        warnings.warn(f"加权迭代未在{max_iter}次内收敛（最大偏差 {max_gap:.2e}）")
+    return weights
+
+def weighting_summary(unweighted_bases, weighted_bases, effective_bases):
+    """加权信息：未加权基数、加权基数、有效基数与设计效应（deff = 未加权基数 / 有效基数）"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deff = np.asarray(unweighted_bases, dtype=np.float64) / effective_bases
+    return pd.DataFrame({
+        '未加权基数': unweighted_bases,
+        '加权基数': np.round(weighted_bases, 2),
+        '有效基数': np.round(effective_bases, 2),
+        '设计效应': np.round(deff, 3),
+    })
+
+class SurveyIndex:
+    """
+    数据集级别的题目索引，同一份数据多次交叉分析时复用
+    - 每个题目的有序选项只计算一次
+    - 每个题目的指示矩阵块（样本数 × (选项数+1)，最后一列为总计）首次使用时构建并缓存
+    - df 也可以是 SurveyStore：选项与编码直接取自紧凑编码，不再比较字符串
+    """
+
+    def __init__(self, df, sparse_threshold=0.05, options=None):
+        self.store = None
+        if isinstance(df, SurveyStore):
+            self.store = df
+            self.df = df.extra  # 未编码的其余列（如权重）
+            self.n_rows = df.n_rows
+        else:
+            self.df = df.rename(columns=lambda col: str(col).strip())  # 统一清理列名
+            self.n_rows = len(self.df)
+        # 多选题选中率低于该阈值时使用稀疏矩阵块（0表示禁用稀疏存储）
+        self.sparse_threshold = sparse_threshold
+        # 预先给定的单选题有序选项（分块读取时各数据块共用同一套选项）
+        self._options = dict(options or {})
+        self._codes = {}
+        self._multi_choice_columns = {}
+        self._blocks = {}
+        self._weights = {}
+        self._masks = {}  # 筛选表达式 -> 样本布尔掩码
+        self._derived = {}  # 派生变量名 -> 重新编码规则
+        self._resolving = set()  # 正在计算的派生变量（检测循环引用）
+
+    @property
+    def columns(self):
+        columns = self.df.columns if self.store is None else self.store.columns
+        if self._derived:
+            columns = columns.append(pd.Index([q for q in self._derived if q not in columns]))
+        return columns
+
+    @property
+    def schema(self):
+        """表头结构索引（按表头签名缓存，见 survey_schema）"""
+        return survey_schema(self.columns)
+
+    def column(self, name):
+        """取一列原始数据（SurveyStore中的单选题及派生变量解码为Categorical）"""
+        if name in self._derived:
+            return pd.Series(pd.Categorical.from_codes(
+                self.option_codes(name), categories=pd.Index(self.options(name), dtype=object)
+            ), name=name)
+        return self.df[name] if self.store is None else self.store.column(name)
+
+    def define_recodes(self, rules):
+        """
+        登记派生变量（规则见 recode.py），实际计算推迟到首次使用
+        规则变化时清除该变量及依赖它的缓存；首次登记时保留预先给定的选项（如增量更新），
+        新样本的编码按给定选项对齐（见 option_codes）
+        """
+        for rule in load_recode_rules(rules):
+            name = rule['new_col']
+            if self._derived.get(name) == rule:
+                continue
+            if name in self._derived:
+                for derived in [name] + [q for q, r in self._derived.items() if r.get('source_col') == name]:
+                    self._options.pop(derived, None)
+                    self._codes.pop(derived, None)
+                    self._blocks.pop(('single', derived), None)
+            self._masks.clear()  # 筛选条件可能引用派生变量
+            self._derived[name] = rule
+
+    def multi_choice_columns(self, root):
+        """返回多选题根对应的子列（按选项编号排序），少于2个子列时返回空列表"""
+        if root not in self._multi_choice_columns:
+            self._multi_choice_columns[root] = self.schema.subcolumns(root)
+        return self._multi_choice_columns[root]
+
+    def weights(self, weight_column=None, rake_margins=None):
+        """返回样本权重（不加权时返回None），按权重列与目标边际缓存"""
+        if weight_column is None and not rake_margins:
+            return None
+        key = (weight_column, repr(rake_margins))
+        if key not in self._weights:
+            weights = None
+            if weight_column is not None:
+                if weight_column not in self.columns:
+                    raise ValueError(f"权重列 {weight_column} 不存在")
+                weights = pd.to_numeric(self.column(weight_column), errors='coerce').to_numpy(dtype=np.float64)
+                if np.isnan(weights).any():
+                    warnings.warn(f"权重列 {weight_column} 存在缺失或非数值，按权重0处理")
+                    weights = np.nan_to_num(weights, nan=0.0)
+                if (weights < 0).any():
+                    raise ValueError(f"权重列 {weight_column} 存在负数")
+            if rake_margins:
+                weights = rake_weights(self, rake_margins, base_weights=weights)
+            self._weights[key] = weights
+        return self._weights[key]
+
+    def mask(self, filter_expr):
+        """
+        筛选条件对应的样本布尔掩码（不筛选时返回None），按表达式缓存
+        - filter_expr: 表达式（语法见 recode.evaluate_expression），多个表达式（列表）取交集
+        同一子群体反复出表时只计算一次，计数时与指示矩阵相乘，不复制数据
+        """
+        if filter_expr is None:
+            return None
+        if not isinstance(filter_expr, str):
+            masks = [self.mask(expr) for expr in filter_expr]
+            return np.logical_and.reduce(masks) if masks else None
+        if filter_expr not in self._masks:
+            mask = evaluate_expression(self, filter_expr)
+            if not mask.any():
+                warnings.warn(f"筛选条件 {filter_expr} 没有匹配任何样本")
+            self._masks[filter_expr] = mask
+        return self._masks[filter_expr]
+
+    def _apply_recode(self, question):
+        """计算派生变量，派生变量之间循环引用时报错（而不是无限递归）"""
+        if question in self._resolving:
+            raise ValueError(f"派生变量 {question} 循环引用了自身")
+        self._resolving.add(question)
+        try:
+            return apply_recode(self, self._derived[question])
+        finally:
+            self._resolving.discard(question)
+
+    def options(self, question):
+        """单选题的有序选项：按首次出现顺序去重，再按选项编号排序"""
+        if question not in self._options and question in self._derived:
+            self._codes[question], self._options[question] = self._apply_recode(question)
+        if question not in self._options and self.store is not None and question in self.store.singles:
+            self._options[question] = self.store.options(question)
+            self._codes[question] = self.store.codes(question)
+        if question not in self._options:
+            codes, uniques = pd.factorize(self.column(question))
+            order = option_sort_order(uniques)
+            # 原始编码 -> 排序后选项位置
+            position = np.empty(len(order), dtype=np.int64)
+            position[order] = np.arange(len(order))
+            self._options[question] = [uniques[i] for i in order]
+            self._codes[question] = np.where(codes >= 0, position[codes], -1)
+        return self._options[question]
+
+    def option_codes(self, question):
+        """每个样本所选选项在有序选项中的下标（缺失为-1）"""
+        options = self.options(question)
+        if question not in self._codes:
+            if question in self._derived:
+                # 选项已预先给定（如增量更新）时，派生变量按给定选项重新对齐编码
+                codes, labels = self._apply_recode(question)
+                column = pd.Series(pd.Categorical.from_codes(codes, categories=pd.Index(labels, dtype=object)))
+            else:
+                column = self.column(question)
+            codes = pd.Index(options).get_indexer(column).astype(np.int64)
+            unknown = (codes < 0) & column.notna().to_numpy()
+            if unknown.any():
+                raise ValueError(f"题目 {question} 出现未知选项：{column[unknown].unique()[:5].tolist()}")
+            self._codes[question] = codes
+        return self._codes[question]
+
+    def single_choice_block(self, question):
+        """单选题：返回 (有序选项, 指示矩阵块)"""
+        key = ('single', question)
+        if key not in self._blocks:
+            self._blocks[key] = (self.options(question), self.block_rows(key, None, None))
+        return self._blocks[key]
+
+    def _ticked(self, root, start=None, stop=None):
+        """多选题各子列是否选中，(样本数 × 子列数) 布尔矩阵，可只取 [start, stop) 行"""
+        subcols = self.multi_choice_columns(root)
+        if self.store is not None and self.store.multis.get(root, (None, None))[1] == subcols:
+            return unpack_bits(self.store.multis[root][0][start:stop], len(subcols))
+        return np.column_stack([
+            (self.column(subcol).iloc[start:stop] == 1).to_numpy() for subcol in subcols
+        ]).reshape(-1, len(subcols))
+
+    def multi_choice_block(self, root, sparse_threshold=None):
+        """
+        多选题：返回 (有序子列, 指示矩阵块)，子列取值为1视为选中
+        选中率低于 sparse_threshold 时返回CSC稀疏矩阵，内存与计数开销只与选中数量相关
+        （sparse_threshold 默认取索引的设置，另行指定时单独缓存）
+        """
+        subcols = self.multi_choice_columns(root)
+        if sparse_threshold is None or sparse_threshold == self.sparse_threshold:
+            sparse_threshold, key = self.sparse_threshold, ('multi', root)
+        else:
+            key = ('multi', root, sparse_threshold)
+        if key not in self._blocks:
+            bits = self._ticked(root)
+            ticked = [np.flatnonzero(bits[:, j]) for j in range(len(subcols))]
+            del bits
+            answered = np.zeros(self.n_rows, dtype=bool)
+            for rows in ticked:
+                answered[rows] = True
+            ticked.append(np.flatnonzero(answered))
+
+            n_ticked = sum(len(rows) for rows in ticked[:-1])
+            density = n_ticked / max(self.n_rows * len(subcols), 1)
+            if density < sparse_threshold:
+                indptr = np.concatenate([[0], np.cumsum([len(rows) for rows in ticked])])
+                indices = np.concatenate(ticked)
+                block = sparse.csc_matrix(
+                    (np.ones(len(indices), dtype=np.float32), indices, indptr),
+                    shape=(self.n_rows, len(ticked))
                 )
             else:
-                raise ValueError("不支持的编码方式")
-            
-            return df
-        
-        # ===== 编码规则配置 =====
-        recode_rules = []
-        
-        # 应用所有编码规则
-        for rule in recode_rules:
-            df = recode_variable(df, **rule)
-    
-    except Exception as e:
-        raise Exception(f"输入文件读取失败: {str(e)}")
+                block = np.zeros((self.n_rows, len(ticked)), dtype=bool)
+                for j, rows in enumerate(ticked):
+                    block[rows, j] = True
+            self._blocks[key] = (subcols, block)
+        return self._blocks[key]
+
+    def block(self, key, sparse_threshold=None):
+        """按 ('single', 题目) 或 ('multi', 多选题根) 返回指示矩阵块"""
+        kind, question = key
+        if kind == 'multi':
+            return self.multi_choice_block(question, sparse_threshold)[1]
+        return self.single_choice_block(question)[1]
+
+    def block_rows(self, key, start, stop):
+        """构建 [start, stop) 行的稠密指示矩阵块（不缓存，分块计数时逐块调用）"""
+        kind, question = key
+        if kind == 'multi':
+            ticked = self._ticked(question, start, stop)
+            return np.column_stack([ticked, ticked.any(axis=1)])
+        codes = self.option_codes(question)[start:stop]
+        answered = codes >= 0
+        block = np.zeros((len(codes), len(self.options(question)) + 1), dtype=bool)
+        block[np.flatnonzero(answered), codes[answered]] = True
+        block[:, -1] = answered
+        return block
+
+class IndicatorMatrix:
+    """
+    (样本数 × 条件数) 的0/1指示矩阵，由各题目的指示矩阵块横向拼接而成
+    稠密块与稀疏块分开存放：稠密部分走BLAS矩阵乘法，稀疏部分走scipy.sparse
+    """
+
+    def __init__(self, blocks, n_rows):
+        # 样本量不超过 2^24 时 float32 可精确表示计数，且能走BLAS矩阵乘法
+        dtype = np.float32 if n_rows < 2 ** 24 else np.float64
+        self.n_rows = n_rows
+        self.n_cols = sum(block.shape[1] for block in blocks)
+        dense_blocks, sparse_blocks = [], []
+        dense_cols, sparse_cols = [], []
+        start = 0
+        for block in blocks:
+            cols = range(start, start + block.shape[1])
+            if sparse.issparse(block):
+                sparse_blocks.append(block)
+                sparse_cols.extend(cols)
+            else:
+                dense_blocks.append(block)
+                dense_cols.extend(cols)
+            start += block.shape[1]
+
+        self.dense_cols = np.array(dense_cols, dtype=np.int64)
+        self.sparse_cols = np.array(sparse_cols, dtype=np.int64)
+        self.dense = np.zeros((n_rows, len(dense_cols)), dtype=dtype)
+        start = 0
+        for block in dense_blocks:
+            self.dense[:, start:start + block.shape[1]] = block
+            start += block.shape[1]
+        self.sparse = (
+            sparse.hstack(sparse_blocks, format='csc', dtype=dtype) if sparse_blocks else None
+        )
+
+    def column_sums(self, weights=None):
+        """各条件的样本数（提供weights时为加权样本数）"""
+        sums = np.zeros(self.n_cols, dtype=np.float64)
+        if weights is None:
+            sums[self.dense_cols] = self.dense.sum(axis=0, dtype=np.float64)
+            if self.sparse is not None:
+                sums[self.sparse_cols] = np.asarray(self.sparse.sum(axis=0), dtype=np.float64).ravel()
+        else:
+            sums[self.dense_cols] = weights @ self.dense
+            if self.sparse is not None:
+                sums[self.sparse_cols] = self.sparse.T @ weights
+        return sums
+
+    def cross(self, other, weights=None):
+        """交叉计数矩阵 self.T @ diag(weights) @ other，形状 (self条件数, other条件数)"""
+        other_dense, other_sparse = other.dense, other.sparse
+        if weights is not None:
+            other_dense = other_dense * weights[:, None]
+            if other_sparse is not None:
+                other_sparse = sparse.diags(weights) @ other_sparse
+
+        result = np.zeros((self.n_cols, other.n_cols), dtype=np.float64)
+        rows_d, rows_s = self.dense_cols, self.sparse_cols
+        cols_d, cols_s = other.dense_cols, other.sparse_cols
+        result[np.ix_(rows_d, cols_d)] = self.dense.T @ other_dense
+        if self.sparse is not None:
+            result[np.ix_(rows_s, cols_d)] = self.sparse.T @ other_dense
+        if other_sparse is not None:
+            result[np.ix_(rows_d, cols_s)] = (other_sparse.T @ self.dense).T
+        if self.sparse is not None and other_sparse is not None:
+            result[np.ix_(rows_s, cols_s)] = (self.sparse.T @ other_sparse).toarray()
+        return result
+
+def build_indicator_matrix(blocks, n_rows):
+    """将各题目的指示矩阵块（稠密数组或稀疏矩阵）横向拼接为指示矩阵"""
+    return IndicatorMatrix(blocks, n_rows)
+
+class CrosstabCounts:
+    """
+    交叉表计数状态，可按数据块逐块累加：
+    - freq: (行条件数, 列条件数) 交叉频数（加权时为加权频数）
+    - row_counts / col_counts: 各行/列条件的样本数
+    - n_total: 总样本数
+    加权时另记录未加权列基数与权重平方和，用于计算有效基数
+    """
+
+    def __init__(self, n_row_conditions, n_col_conditions, weighted=False):
+        self.weighted = weighted
+        self.freq = np.zeros((n_row_conditions, n_col_conditions), dtype=np.float64)
+        self.row_counts = np.zeros(n_row_conditions, dtype=np.float64)
+        self.col_counts = np.zeros(n_col_conditions, dtype=np.float64)
+        self.n_total = 0.0
+        self.n_rows = 0
+        self.col_unweighted = np.zeros(n_col_conditions, dtype=np.float64)
+        self.col_weight_sq = np.zeros(n_col_conditions, dtype=np.float64)
+        self.weight_sq_total = 0.0
+
+    def add(self, row_matrix, col_matrix, weights=None, mask=None):
+        """
+        累加一个数据块（行/列指示矩阵需对应同一批样本）
+        mask 为样本筛选掩码（见 SurveyIndex.mask），未选中的样本按权重0计入矩阵乘法
+        """
+        if self.weighted != (weights is not None):
+            raise ValueError("加权状态与计数状态不一致")
+        selected = None if mask is None else mask.astype(np.float64)
+        if selected is None:
+            effective = weights
+            n_rows = row_matrix.n_rows
+        else:
+            effective = selected if weights is None else weights * selected
+            n_rows = int(np.count_nonzero(mask))
+        self.n_rows += n_rows
+        self.freq += row_matrix.cross(col_matrix, effective)
+        self.row_counts += row_matrix.column_sums(effective)
+        self.col_counts += col_matrix.column_sums(effective)
+        if weights is None:
+            self.n_total += n_rows
+        else:
+            self.n_total += effective.sum()
+            self.col_unweighted += col_matrix.column_sums(selected)
+            self.col_weight_sq += col_matrix.column_sums(effective ** 2)
+            self.weight_sq_total += (effective ** 2).sum()
+        return self
+
+    def merge(self, other):
+        """合并另一份同结构的计数状态"""
+        for name in ('freq', 'row_counts', 'col_counts', 'col_unweighted', 'col_weight_sq'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.n_total += other.n_total
+        self.n_rows += other.n_rows
+        self.weight_sq_total += other.weight_sq_total
+        return self
+
+    def cells(self):
+        """
+        每个单元格2×2列联表的四格计数 (a, b, c, d)，形状均为 (行条件数, 列条件数)
+        - a: 行条件且列条件
+        - b: 行条件且非列条件
+        - c: 非行条件且列条件
+        - d: 既非行条件也非列条件
+        未加权时为整数计数
+        """
+        a, row_counts, col_counts, n_total = self.freq, self.row_counts, self.col_counts, self.n_total
+        if not self.weighted:
+            a = np.rint(a).astype(np.int64)
+            row_counts = np.rint(row_counts).astype(np.int64)
+            col_counts = np.rint(col_counts).astype(np.int64)
+            n_total = int(round(n_total))
+        b = row_counts[:, None] - a
+        c = col_counts[None, :] - a
+        d = n_total - a - b - c
+        return a, b, c, d
+
+    def unweighted_bases(self):
+        """各列未加权基数"""
+        bases = self.col_unweighted if self.weighted else self.col_counts
+        return np.rint(bases).astype(np.int64)
+
+    def effective_bases(self):
+        """各列Kish有效基数（未加权时等于列基数）"""
+        if not self.weighted:
+            return self.col_counts.copy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.col_counts ** 2 / self.col_weight_sq
+
+    def select_rows(self, row_indices):
+        """取部分行条件的计数状态（列统计不变）"""
+        subset = copy.copy(self)
+        subset.freq = self.freq[row_indices]
+        subset.row_counts = self.row_counts[row_indices]
+        return subset
+
+    def kish_scale(self):
+        """全体样本有效样本量与加权总数之比（未加权时为1）"""
+        if not self.weighted or self.weight_sq_total == 0:
+            return 1.0
+        return self.n_total / self.weight_sq_total
+
+def compute_crosstab_counts(row_matrix, col_matrix, weights=None):
+    """
+    一次矩阵乘法得到全部交叉频数，并推出每个单元格2×2列联表的四格计数
+    返回：(a, b, c, d)，含义见 CrosstabCounts.cells
+    提供weights时返回加权计数（浮点数）
+    """
+    counts = CrosstabCounts(row_matrix.n_cols, col_matrix.n_cols, weighted=weights is not None)
+    return counts.add(row_matrix, col_matrix, weights).cells()
+
+def resolve_crosstab_questions(survey_index, row_questions, col_questions):
+    """
+    根据表头解析行/列问题（不读取数据本身）
+    返回：(有效行问题 [(类型, 题目)], 列问题 [(类型, 题目或多选题根, 出现序号)])
+    """
+    columns = survey_index.columns
 
     # === 识别用户配置的多选题根 ===
     user_multi_roots = set()
@@ -107,18 +638,11 @@ def process_crosstab(
             user_multi_roots.add(q_clean)
     
     # === 构建多选题字典 ===
-    multi_choice_dict = defaultdict(list)
-    for col in df.columns:
-        col_clean = str(col).strip()
-        for root in user_multi_roots:
-            if col_clean.startswith(root):
-                multi_choice_dict[root].append(col)
-    
-    # 排序并过滤有效多选题
-    multi_choice_dict = {
-        k: sorted(v, key=lambda x: extract_subcol_number(x, k))
-        for k, v in multi_choice_dict.items() if len(v) > 1
-    }
+    multi_choice_dict = {}
+    for root in user_multi_roots:
+        subcols = survey_index.multi_choice_columns(root)
+        if subcols:
+            multi_choice_dict[root] = subcols
     
     # === 验证问题有效性 ===
     def validate_questions(questions):
@@ -127,7 +651,7 @@ def process_crosstab(
         for q in questions:
             q_clean = str(q).strip()
 
-            if q_clean in df.columns:
+            if q_clean in columns:
                 valid.append(('single', q_clean))
 
             elif q_clean in multi_choice_dict:
@@ -155,176 +679,890 @@ def process_crosstab(
             if root in multi_choice_dict:
                 valid_rows.append(('multi', root))
                 found = True
-        if not found and q in df.columns:
+        if not found and q in columns:
             valid_rows.append(('single', q))
             found = True
         if not found:
             invalid_questions.append(q)
 
-    # === 列条件生成 ===
-    col_conditions = []
-    col_totals = {}
+    # === 列问题（保留原始顺序，不跳过重复项） ===
+    col_specs = []
     seen_cols = defaultdict(int)  # 记录列问题出现次数
-    
-    for q in col_questions:  # 保留原始顺序，不跳过重复项
+    for q in col_questions:
         q_clean = str(q).strip()
         seen_cols[q_clean] += 1
         instance_id = seen_cols[q_clean]
-    
-        # === 处理多选题 ===
         if re.match(r'^Q\d+\.', q_clean):
             root = re.match(r'^(Q\d+\.)', q_clean).group(1)
             if root in multi_choice_dict:
-                subcols = sorted(multi_choice_dict[root], key=lambda x: extract_subcol_number(x, root))
-                example_subcol = subcols[0]
-                rest_part = example_subcol.split(root)[1].strip()
-                if ':' in rest_part:
-                    question_text, _ = rest_part.split(':', 1)
-                    question_text = question_text.strip()
-                else:
-                    question_text = rest_part
-                full_question = f"{root}{question_text} #{instance_id}"  # 唯一标识
-    
-                for subcol in subcols:
-                    rest_subcol = subcol.split(root)[1].strip()
-                    if ':' in rest_subcol:
-                        _, option_text = rest_subcol.split(':', 1)
-                        option_text = option_text.strip()
-                    else:
-                        option_text = rest_subcol
-                    label = f"{full_question}\n{option_text}"
-                    cond = df[subcol] == 1
-                    col_conditions.append((label, cond))
-                    col_totals[label] = cond.sum()
-    
-                total_label = f"{full_question}\n总计"
-                total_cond = (df[subcols] == 1).any(axis=1)
-                col_conditions.append((total_label, total_cond))
-                col_totals[total_label] = total_cond.sum()
+                col_specs.append(('multi', root, instance_id))
                 continue
-    
-        # === 处理单选题 ===
-        if q_clean in df.columns:
-            values = df[q_clean].dropna().unique()
-            try:
-                sorted_values = sorted(values, key=lambda x: int(re.match(r'^(\d+)', str(x)).group(1)))
-            except:
-                sorted_values = values
-            unique_question = f"{q_clean} #{instance_id}"  # 唯一标识
-            for value in sorted_values:
-                label = f"{unique_question}\n{value}"
-                cond = df[q_clean] == value
-                col_conditions.append((label, cond))
-                col_totals[label] = cond.sum()
-            total_label = f"{unique_question}\n总计"
-            total_cond = df[q_clean].notna()
-            col_conditions.append((total_label, total_cond))
-            col_totals[total_label] = total_cond.sum()
+        if q_clean in columns:
+            col_specs.append(('single', q_clean, instance_id))
         else:
             warnings.warn(f"无效问题被跳过：{q}")
 
+    return valid_rows, col_specs
+
+class CrosstabLayout:
+    """交叉表结构：行/列标签、列分组，以及构成行/列指示矩阵的题目块"""
+
+    def __init__(self):
+        self.row_labels = []  # (问题, 选项)
+        self.row_keys = []
+        self.col_labels = []
+        self.col_groups = []  # 各列所属列问题（用于列间比较，总计列为None）
+        self.col_keys = []
+        self.filter = None  # 样本筛选条件（表达式或表达式元组）
+
+    def row_matrix(self, survey_index, sparse_threshold=None):
+        return build_indicator_matrix(
+            [survey_index.block(k, sparse_threshold) for k in self.row_keys], survey_index.n_rows
+        )
+
+    def col_matrix(self, survey_index, sparse_threshold=None):
+        return build_indicator_matrix(
+            [survey_index.block(k, sparse_threshold) for k in self.col_keys], survey_index.n_rows
+        )
+
+    def questions(self):
+        """涉及的单选题与多选题根"""
+        return list(dict.fromkeys(self.row_keys + self.col_keys))
+
+def build_crosstab_layout(survey_index, valid_rows, col_specs):
+    """按解析后的行/列问题生成交叉表结构（只用到各题目的选项，不构建指示矩阵）"""
+    layout = CrosstabLayout()
+    schema = survey_index.schema
+
+    # === 列条件生成 ===
+    for q_type, q, instance_id in col_specs:
+        # === 处理多选题 ===
+        if q_type == 'multi':
+            root = q
+            full_question = f"{root}{schema.question_text(root)} #{instance_id}"  # 唯一标识
+
+            for subcol in survey_index.multi_choice_columns(root):
+                layout.col_labels.append(f"{full_question}\n{schema.option_text(subcol)}")
+                layout.col_groups.append(full_question)
+
+            layout.col_labels.append(f"{full_question}\n总计")
+            layout.col_groups.append(None)
+            layout.col_keys.append(('multi', root))
+            continue
+
+        # === 处理单选题 ===
+        unique_question = f"{q} #{instance_id}"  # 唯一标识
+        for value in survey_index.options(q):
+            layout.col_labels.append(f"{unique_question}\n{value}")
+            layout.col_groups.append(unique_question)
+        layout.col_labels.append(f"{unique_question}\n总计")
+        layout.col_groups.append(None)
+        layout.col_keys.append(('single', q))
+
     # === 行维度条件生成 ===
-    row_conditions = []
     for q_type, q in valid_rows:
         if q_type == 'multi':
-            root = re.match(r'^(Q\d+\.)', q).group(1)
-            subcols = sorted(multi_choice_dict[root],
-                           key=lambda x: extract_subcol_number(x, root))
-            for subcol in subcols:
-                option = subcol.split(root)[1].strip()
-                cond = df[subcol] == 1
-                row_conditions.append(((q, option), cond))  # 元组格式
-            total_cond = (df[subcols] == 1).any(axis=1)
-            row_conditions.append(((q, '总计'), total_cond))
+            root = q
+            for subcol in survey_index.multi_choice_columns(root):
+                layout.row_labels.append((q, schema.row_option(subcol)))  # 元组格式
+            layout.row_keys.append(('multi', root))
         else:
             # 处理单选题
-            values = df[q].dropna().unique()
+            for value in survey_index.options(q):
+                layout.row_labels.append((q, str(value)))  # 元组形式 (问题, 值)
+            layout.row_keys.append(('single', q))
+        # 生成总计行
+        layout.row_labels.append((q, '总计'))
+
+    return layout
+
+# ================== 内存规划 ==================
+
+PLAN_STRATEGIES = ('dense', 'sparse', 'chunked')
+MIN_CHUNK_ROWS = 1000
+# 读入DataFrame后的内存约为文件大小的倍数（粗略估计，xlsx为压缩格式）
+FILE_MEMORY_FACTOR = {'.csv': 4, '.xlsx': 20, '.xls': 10}
+
+class CrosstabPlan:
+    """
+    交叉表执行计划
+    - strategy: 'dense'（指示矩阵整体放在内存，选中率低于 sparse_threshold 的多选题仍为稀疏块）、
+      'sparse'（多选题全部使用稀疏块）或 'chunked'（按行分块构建指示矩阵并累加计数）
+    - estimates: 各策略的内存峰值估计（字节）
+    - chunk_rows: 分块计数时每块的行数
+    """
+
+    def __init__(self, strategy, estimates, chunk_rows=None, memory_budget=None):
+        self.strategy = strategy
+        self.estimates = estimates
+        self.chunk_rows = chunk_rows
+        self.memory_budget = memory_budget
+
+    @property
+    def estimated_bytes(self):
+        return self.estimates[self.strategy]
+
+    def describe(self):
+        """计划说明（中文），用于界面展示与日志"""
+        text = f"执行策略：{self.strategy}"
+        if self.strategy == 'chunked':
+            text += f"（每块 {self.chunk_rows} 行）"
+        text += "；内存估计：" + "、".join(
+            f"{name} {_format_bytes(size)}" for name, size in self.estimates.items()
+        )
+        if self.memory_budget is not None:
+            text += f"；内存预算 {_format_bytes(self.memory_budget)}"
+        return text
+
+    def __repr__(self):
+        return f"CrosstabPlan({self.describe()})"
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+
+def _multi_choice_density(survey_index, root, sample_rows=10000):
+    """多选题选中率：SurveyStore按位计数，其余按等距抽样估计"""
+    subcols = survey_index.multi_choice_columns(root)
+    store = survey_index.store
+    if store is not None and store.multis.get(root, (None, None))[1] == subcols:
+        return popcount(store.multis[root][0]).sum() / max(survey_index.n_rows * len(subcols), 1)
+    sample = np.unique(np.linspace(0, survey_index.n_rows - 1, min(survey_index.n_rows, sample_rows)).astype(np.int64))
+    ticked = sum(int((survey_index.column(col).to_numpy()[sample] == 1).sum()) for col in subcols)
+    return ticked / max(len(sample) * len(subcols), 1)
+
+def estimate_crosstab_memory(survey_index, layout, weighted=False, chunk_rows=50000):
+    """
+    按样本量、各题条件数与多选题选中率估计各执行策略的内存峰值（字节）
+    包括：单选题编码、缓存的指示矩阵块、拼接后的指示矩阵（float32），
+    加权（或筛选）时另计列矩阵乘权重后的副本与行矩阵参与float64乘法时的副本
+    """
+    n = survey_index.n_rows
+    itemsize = 4 if n < 2 ** 24 else 8
+    keys = [(key, False) for key in layout.row_keys] + [(key, True) for key in layout.col_keys]
+    shapes = {}
+    for (kind, q), _ in keys:
+        if kind == 'multi':
+            n_conditions = len(survey_index.multi_choice_columns(q)) + 1
+            shapes[(kind, q)] = (n_conditions, _multi_choice_density(survey_index, q))
+        else:
+            shapes[(kind, q)] = (len(survey_index.options(q)) + 1, None)
+    n_singles = len({q for (kind, q), _ in keys if kind == 'single'})
+    fixed = 8 * n * n_singles + 8 * len(layout.row_labels) * len(layout.col_labels) * 4
+
+    def in_memory(threshold):
+        total = fixed
+        for key, is_col in keys:
+            n_conditions, density = shapes[key]
+            if density is not None and density < threshold:
+                # 稀疏块：每个选中项一个下标与一个值（拼接时再复制一次）
+                nnz = n * min(n_conditions, density * (n_conditions - 1) + 1)
+                total += nnz * 8 + nnz * (itemsize + 4)
+                if weighted and is_col:
+                    total += nnz * 12
+            else:
+                total += n * n_conditions * (1 + itemsize)
+                if weighted:
+                    total += n * n_conditions * 8
+        return total
+
+    n_row_conditions = sum(shapes[key][0] for key, is_col in keys if not is_col)
+    n_col_conditions = sum(shapes[key][0] for key, is_col in keys if is_col)
+    per_row = (n_row_conditions + n_col_conditions) * (1 + itemsize + (8 if weighted else 0))
+    return {
+        'dense': in_memory(survey_index.sparse_threshold),
+        'sparse': in_memory(1.0),
+        'chunked': fixed + min(chunk_rows, n) * per_row,
+        'per_row': per_row,
+    }
+
+def plan_crosstab(survey_index, layout, memory_budget=None, strategy='auto', weighted=False, chunk_rows=50000):
+    """
+    选择交叉表执行策略（weighted 表示计数时带权重或筛选掩码）
+    - strategy='auto'：在内存预算内优先 dense（最快），其次 sparse，都超出时分块计数，
+      块大小按预算扣除固定开销后换算（不少于 MIN_CHUNK_ROWS 行）
+    - memory_budget: 字节数，None表示不限制
+    """
+    if strategy != 'auto' and strategy not in PLAN_STRATEGIES:
+        raise ValueError(f"不支持的执行策略：{strategy}")
+    estimates = estimate_crosstab_memory(survey_index, layout, weighted, chunk_rows)
+    per_row = estimates.pop('per_row')
+    fixed = estimates['chunked'] - min(chunk_rows, survey_index.n_rows) * per_row
+
+    if memory_budget is not None and strategy in ('auto', 'chunked'):
+        chunk_rows = int(max((memory_budget - fixed) // max(per_row, 1), MIN_CHUNK_ROWS))
+        chunk_rows = min(chunk_rows, max(survey_index.n_rows, 1))
+        estimates['chunked'] = fixed + chunk_rows * per_row
+    if strategy == 'auto':
+        strategy = 'dense'
+        if memory_budget is not None and estimates['dense'] > memory_budget:
+            strategy = 'sparse' if estimates['sparse'] <= memory_budget else 'chunked'
+    plan = CrosstabPlan(strategy, estimates, chunk_rows if strategy == 'chunked' else None, memory_budget)
+    if memory_budget is not None and plan.estimated_bytes > memory_budget:
+        warnings.warn(f"交叉表的内存估计超出预算：{plan.describe()}")
+    return plan
+
+def plan_file_chunks(input_file, memory_budget, strategy='auto', encoding=None):
+    """
+    尚未读入的文件：按文件大小粗略估计整体读入的内存，超出预算（或指定 chunked）时返回分块行数，否则返回None
+    分块读取时每块为原始取值的DataFrame，按每个单元格约64字节换算块大小
+    """
+    extension = os.path.splitext(str(input_file))[1].lower()
+    full_load = os.path.getsize(input_file) * FILE_MEMORY_FACTOR.get(extension, 10)
+    if strategy != 'chunked' and full_load <= memory_budget:
+        return None, full_load
+    n_columns = max(len(read_survey_header(input_file, encoding)), 1)
+    chunk_rows = int(min(max(memory_budget // (n_columns * 64), MIN_CHUNK_ROWS), 200000))
+    return chunk_rows, full_load
+
+def count_crosstab(survey_index, layout, weights=None, mask=None, plan=None):
+    """按执行计划计算交叉表计数状态（plan为None时按 dense 执行）"""
+    counts = CrosstabCounts(len(layout.row_labels), len(layout.col_labels), weighted=weights is not None)
+    strategy = 'dense' if plan is None else plan.strategy
+    if strategy != 'chunked':
+        threshold = 1.0 if strategy == 'sparse' else None
+        return counts.add(layout.row_matrix(survey_index, threshold), layout.col_matrix(survey_index, threshold),
+                          weights, mask)
+
+    # 分块：每块只构建该块行的指示矩阵，计数逐块累加
+    for start in range(0, survey_index.n_rows, plan.chunk_rows):
+        stop = min(start + plan.chunk_rows, survey_index.n_rows)
+        counts.add(
+            build_indicator_matrix([survey_index.block_rows(k, start, stop) for k in layout.row_keys], stop - start),
+            build_indicator_matrix([survey_index.block_rows(k, start, stop) for k in layout.col_keys], stop - start),
+            None if weights is None else weights[start:stop],
+            None if mask is None else mask[start:stop]
+        )
+    return counts
+
+# ================== 数据读取 ==================
+
+CSV_ENCODINGS = ('utf-8', 'gbk')  # 未指定编码时依次尝试
+
+def detect_csv_encoding(input_file, encoding=None, block_size=1 << 20):
+    """
+    分块读取时使用的csv编码：指定时直接使用，否则按 CSV_ENCODINGS 依次尝试（与 read_survey_file 一致）
+    逐块增量解码检查，不把整个文件读入内存；不是csv文件时返回 encoding
+    """
+    if encoding or not str(input_file).lower().endswith('.csv'):
+        return encoding
+    for candidate in CSV_ENCODINGS[:-1]:
+        decoder = codecs.getincrementaldecoder(candidate)()
+        try:
+            with open(input_file, 'rb') as f:
+                for block in iter(lambda: f.read(block_size), b''):
+                    decoder.decode(block)
+            decoder.decode(b'', final=True)
+            return candidate
+        except UnicodeDecodeError:
+            continue
+    return CSV_ENCODINGS[-1]
+
+def _parse_survey_file(input_file, encoding=None):
+    """解析问卷文件（.csv按utf-8/gbk依次尝试，其余按Excel读取）"""
+    if str(input_file).lower().endswith('.csv'):
+        encodings = [encoding] if encoding else list(CSV_ENCODINGS)
+        for i, enc in enumerate(encodings):
             try:
-                sorted_values = sorted(values, key=lambda x: int(re.match(r'^(\d+)', str(x)).group(1)))
-            except:
-                sorted_values = values
-            for value in sorted_values:
-                cond = df[q] == value
-                row_conditions.append(((q, str(value)), cond))  # 元组形式 (问题, 值)
-            # 生成总计行
-            total_cond = df[q].notna()
-            row_conditions.append(((q, '总计'), total_cond))
+                return pd.read_csv(input_file, encoding=enc)
+            except UnicodeDecodeError:
+                if i == len(encodings) - 1:
+                    raise
+    return pd.read_excel(input_file)
 
-    # === 交叉统计计算 ===
-    freq_results = []
-    for (r_question, r_option), r_cond in row_conditions:
-        row_data = {}
-        for c_label, c_cond in col_conditions:
-            count = (r_cond & c_cond).sum()
-            row_data[c_label] = count
-        freq_results.append(row_data)
+def read_survey_file(input_file, encoding=None, use_cache=True):
+    """
+    读取问卷文件为DataFrame，列名已清理
+    use_cache=True 时按文件内容哈希缓存为列式格式，同一文件再次读取时无需重新解析
+    """
+    if use_cache:
+        kind = f"csv-{encoding or 'auto'}" if str(input_file).lower().endswith('.csv') else 'excel'
+        df = load_cached_survey(input_file, partial(_parse_survey_file, encoding=encoding), kind=kind)
+    else:
+        df = _parse_survey_file(input_file, encoding)
+    df.columns = [str(col).strip() for col in df.columns]  # 统一清理列名
+    return df
+
+
+def _clean_header(values):
+    return [f"Unnamed: {i}" if v is None else str(v).strip() for i, v in enumerate(values)]
+
+def iter_survey_chunks(input_file, chunk_size=50000, usecols=None, encoding=None):
+    """
+    按行分块读取问卷文件，逐块产出原始取值的DataFrame（列名已清理）
+    - .csv 使用pandas分块读取（统一按字符串读入，未指定编码时按 utf-8/gbk 检测）
+    - 其余按Excel处理，使用openpyxl只读模式逐行读取第一个工作表
+    """
+    wanted = None if usecols is None else set(usecols)
+    if str(input_file).lower().endswith('.csv'):
+        reader = pd.read_csv(
+            input_file, dtype=str, chunksize=chunk_size, encoding=detect_csv_encoding(input_file, encoding),
+            usecols=None if wanted is None else (lambda col: str(col).strip() in wanted)
+        )
+        for chunk in reader:
+            chunk.columns = _clean_header(chunk.columns)
+            yield chunk
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(input_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = _clean_header(next(rows, ()))
+        keep = [i for i, col in enumerate(header) if wanted is None or col in wanted]
+        names = [header[i] for i in keep]
+        buffer = []
+        for row in rows:
+            values = []
+            for i in keep:
+                value = row[i] if i < len(row) else None
+                # 与pd.read_excel一致：整数值的浮点数转为整数，空字符串视为缺失
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                elif value == '':
+                    value = None
+                values.append(value)
+            buffer.append(values)
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=names, dtype=object)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=names, dtype=object)
+    finally:
+        workbook.close()
+
+def read_survey_header(input_file, encoding=None):
+    """只读取表头（清理后的列名）"""
+    if str(input_file).lower().endswith('.csv'):
+        encoding = detect_csv_encoding(input_file, encoding)
+        return _clean_header(pd.read_csv(input_file, nrows=0, encoding=encoding).columns)
+    from openpyxl import load_workbook
+    workbook = load_workbook(input_file, read_only=True)
+    try:
+        return _clean_header(next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ()))
+    finally:
+        workbook.close()
+
+def _convert_column(values, kind):
+    """按整列推断的类型转换一个数据块中的列"""
+    if kind == 'object':
+        return values
+    numeric = pd.to_numeric(values, errors='coerce')
+    return numeric.astype(np.int64) if kind == 'int' else numeric.astype(np.float64)
+
+def scan_survey_columns(input_file, columns, single_questions, chunk_size=50000, encoding=None):
+    """
+    第一遍扫描：推断各列的整列类型（与一次性读取时一致），并收集单选题选项
+    返回：(列类型 {列名: 'int'/'float'/'object'}, 单选题有序选项 {题目: 选项列表}, 总行数)
+    """
+    profile = {col: {'numeric': True, 'missing': False, 'fraction': False} for col in columns}
+    raw_values = {q: {} for q in single_questions}
+    n_rows = 0
+    for chunk in iter_survey_chunks(input_file, chunk_size, columns, encoding):
+        n_rows += len(chunk)
+        for col in columns:
+            values = chunk[col]
+            present = values.notna()
+            state = profile[col]
+            state['missing'] |= not present.all()
+            if state['numeric']:
+                numeric = pd.to_numeric(values[present], errors='coerce')
+                if numeric.isna().any():
+                    state['numeric'] = False
+                else:
+                    state['fraction'] |= bool((numeric % 1 != 0).any())
+            if col in raw_values:
+                for value in values[present].unique():
+                    raw_values[col].setdefault(value, None)
+
+    kinds = {}
+    for col, state in profile.items():
+        if not state['numeric']:
+            kinds[col] = 'object'
+        elif state['missing'] or state['fraction']:
+            kinds[col] = 'float'
+        else:
+            kinds[col] = 'int'
+
+    options = {}
+    for q, values in raw_values.items():
+        converted = _convert_column(pd.Series(list(values), dtype=object), kinds[q])
+        uniques = list(dict.fromkeys(converted.tolist()))
+        options[q] = [uniques[i] for i in option_sort_order(uniques)]
+    return kinds, options, n_rows
+
+def stream_crosstab_counts(input_file, survey_index, layout, kinds, options, chunk_size=50000,
+                           weight_column=None, encoding=None, filter_expr=None):
+    """
+    第二遍扫描：逐块构建指示矩阵并累加计数，内存峰值只与分块大小有关
+    survey_index 为仅含表头的索引（用于确定多选题子列）
+    """
+    counts = CrosstabCounts(len(layout.row_labels), len(layout.col_labels), weighted=weight_column is not None)
+    for chunk in iter_survey_chunks(input_file, chunk_size, list(kinds), encoding):
+        for col, kind in kinds.items():
+            chunk[col] = _convert_column(chunk[col], kind)
+        chunk_index = SurveyIndex(chunk, sparse_threshold=survey_index.sparse_threshold, options=options)
+        chunk_index._multi_choice_columns = survey_index._multi_choice_columns
+        counts.add(
+            layout.row_matrix(chunk_index),
+            layout.col_matrix(chunk_index),
+            chunk_index.weights(weight_column),
+            chunk_index.mask(filter_expr)
+        )
+    return counts
+
+def _required_columns(survey_index, layout, weight_column=None, filter_expr=None):
+    """交叉表用到的原始列（单选题列、多选题子列、权重列、筛选条件引用的列）"""
+    columns = []
+    for kind, question in layout.questions():
+        if kind == 'multi':
+            columns.extend(survey_index.multi_choice_columns(question))
+        else:
+            columns.append(question)
+    if weight_column is not None:
+        columns.append(weight_column)
+    for expr in _filter_key(filter_expr) or ():
+        columns.extend(expression_columns(survey_index, expr))
+    return list(dict.fromkeys(columns))
+
+def _filter_key(filter_expr):
+    """筛选条件统一为表达式元组（不筛选时为None），用作缓存与分组的键"""
+    if filter_expr is None:
+        return None
+    if isinstance(filter_expr, str):
+        return (filter_expr,)
+    return tuple(filter_expr) or None
+
+def build_crosstab_tables(layout, counts, sig_levels=[0.05, 0.01, 0.001], sig_symbols=['*', '**', '***'],
+                          col_test_level=0.05):
+    """
+    由计数状态生成输出表格
+    返回字典：combined（频数+百分比）、sig（p值）、formatted_sig（带星号）、
+    letters（列间比较）、weighting（加权信息，未加权时为None）
+    """
+    row_labels, col_labels, col_groups = layout.row_labels, layout.col_labels, layout.col_groups
+    cell_a, cell_b, cell_c, cell_d = counts.cells()
+    unweighted_bases = counts.unweighted_bases()
+    col_totals = dict(zip(col_labels, unweighted_bases if not counts.weighted else counts.col_counts))
 
     # === 创建多级索引 ===
     index = pd.MultiIndex.from_tuples(
-        [(rl[0], rl[1]) for rl, _ in row_conditions],  # 提取问题和选项
+        row_labels,  # (问题, 选项)
         names=['问题', '选项']
     )
 
     freq_df = pd.DataFrame(
-        freq_results,
+        cell_a,
         index=index,
-        columns=[cl for cl, _ in col_conditions]
+        columns=col_labels
     )
     
     # === 百分比计算 ===
-    percent_df = freq_df.copy()
-    for col in percent_df.columns:
-        total = col_totals[col]
-        percent_df[col] = (freq_df[col] / total).round(3)
+    percent_df = (freq_df / pd.Series(col_totals)[freq_df.columns]).round(3)
 
     # === 构建最终表格 ===
+    if counts.weighted:
+        freq_df = freq_df.round(2)  # 加权频数保留两位小数
     freq_df = freq_df.add_suffix("（频数）")
     percent_df = percent_df.add_suffix("（百分比）")
 
     columns_order = []
-    for orig_col in [cl for cl, _ in col_conditions]:
+    for orig_col in col_labels:
         columns_order.append(f"{orig_col}（频数）")
         columns_order.append(f"{orig_col}（百分比）")
 
     combined_df = pd.concat([freq_df, percent_df], axis=1)[columns_order]
 
     # === 新增：显著性检验计算 ===
-    sig_results = []
-    for r_label, r_cond in row_conditions:
-        row_sig = {}
-        for c_label, c_cond in col_conditions:
-            # 构建列联表
-            a = (r_cond & c_cond).sum()
-            b = (r_cond & ~c_cond).sum()
-            c = (~r_cond & c_cond).sum()
-            d = (~r_cond & ~c_cond).sum()
-            observed = np.array([[a, b], [c, d]])
-            
-            # 执行检验
-            p_value = perform_significance_test(observed)
-            row_sig[c_label] = p_value
-        sig_results.append(row_sig)
-    
-    sig_df = pd.DataFrame(sig_results, 
-                        index=[rl for rl, _ in row_conditions],
-                        columns=[cl for cl, _ in col_conditions])
+    # 加权后按Kish有效样本量缩放四格表，避免权重放大检验功效
+    kish_scale = counts.kish_scale()
+    test_cells = (cell_a, cell_b, cell_c, cell_d)
+    if counts.weighted:
+        test_cells = tuple(x * kish_scale for x in test_cells)
+    sig_df = pd.DataFrame(
+        batch_significance_test(*test_cells),
+        index=row_labels,
+        columns=col_labels
+    )
 
     # === 新增：生成带星号标记的显著性结果 ===
-    formatted_sig_df = sig_df.copy()
-    for col in formatted_sig_df.columns:
-        formatted_sig_df[col] = formatted_sig_df[col].apply(
-            lambda p: ''.join([s for l, s in zip(sig_levels, sig_symbols) if p <= l]) + 
-                f"({p:.3f})" if not pd.isna(p) else ""
+    formatted_sig_df = pd.DataFrame(
+        format_significance_stars(sig_df.to_numpy(), sig_levels, sig_symbols),
+        index=sig_df.index,
+        columns=sig_df.columns
+    )
+
+    # === 列间比较（A/B/C字母标记） ===
+    if not counts.weighted:
+        letter_marks, col_letters = column_proportion_tests(
+            cell_a, unweighted_bases, col_groups, col_test_level
         )
-    
-    # === 处理已有文件 ===
-    if os.path.exists(output_file):
+    else:
+        # 加权时比例不变，标准误按各列有效基数计算
+        effective_bases = counts.effective_bases()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            effective_counts = cell_a * (effective_bases / counts.col_counts)
+        letter_marks, col_letters = column_proportion_tests(
+            np.nan_to_num(effective_counts), effective_bases, col_groups, col_test_level
+        )
+    tested_cols = [j for j, group in enumerate(col_groups) if group is not None]
+    letters_df = pd.DataFrame(
+        letter_marks[:, tested_cols],
+        index=freq_df.index,
+        columns=[f"{col_labels[j]} ({col_letters[j]})" for j in tested_cols]
+    )
+
+    # === 加权信息 ===
+    weight_df = None
+    if counts.weighted:
+        overall_effective = counts.n_total * kish_scale
+        weight_df = weighting_summary(
+            np.append(unweighted_bases, counts.n_rows),
+            np.append(counts.col_counts, counts.n_total),
+            np.append(counts.effective_bases(), overall_effective)
+        )
+        weight_df.index = col_labels + ['全体样本']
+
+    return {
+        'combined': combined_df,
+        'sig': sig_df,
+        'formatted_sig': formatted_sig_df,
+        'letters': letters_df,
+        'weighting': weight_df,
+    }
+
+def write_crosstab_report(
+    output_file,
+    tables,
+    # 样式配置
+    header_height=55,
+    header_fill_color="4F81BD",
+    header_font_color="FFFFFF",
+    header_font_name="微软雅黑",
+    header_font_size=12,
+    # 数据条配置
+    freq_data_bar_color="638EC6",
+    percent_data_bar_color="C00000",
+    data_bar_min_length=15,
+    data_bar_max_length=100,
+    # 格式配置
+    percent_format="0.00%",
+    data_column_width=20,  # C列及之后的固定宽度（None表示自动调整）
+    max_column_width=40, #【可调整最大列宽】
+    # 写出配置
+    engine='auto',  # 'xlsxwriter'、'openpyxl'或'auto'（已安装xlsxwriter时优先使用）
+    constant_memory=False  # xlsxwriter逐行写出、不在内存中保留整张表（此模式下问题列不合并单元格）
+):
+    """
+    将 build_crosstab_tables 的结果写出为带格式的Excel报告
+    - output_file: 文件路径或可写的二进制流（如BytesIO）；为None时写入内存并返回xlsx字节
+    - 表格超过Excel列数上限时自动拆分为多个sheet（如 交叉分析、交叉分析_2），每个sheet重复索引列
+    """
+    return _write_workbook(output_file, [('', tables)], None, engine, constant_memory, style=dict(
+        header_height=header_height,
+        header_fill_color=header_fill_color,
+        header_font_color=header_font_color,
+        header_font_name=header_font_name,
+        header_font_size=header_font_size,
+        freq_data_bar_color=freq_data_bar_color,
+        percent_data_bar_color=percent_data_bar_color,
+        data_bar_min_length=data_bar_min_length,
+        data_bar_max_length=data_bar_max_length,
+        percent_format=percent_format,
+        data_column_width=data_column_width,
+        max_column_width=max_column_width,
+    ))
+
+def _report_style(header_height=55, header_fill_color="4F81BD", header_font_color="FFFFFF",
+                  header_font_name="微软雅黑", header_font_size=12, freq_data_bar_color="638EC6",
+                  percent_data_bar_color="C00000", data_bar_min_length=15, data_bar_max_length=100,
+                  percent_format="0.00%", data_column_width=20, max_column_width=40):
+    """报告样式参数（默认值同 write_crosstab_report）"""
+    return dict(locals())
+
+def write_crosstab_book(output_file, reports, engine='auto', constant_memory=False, **style):
+    """
+    将多张交叉表写入同一个工作簿，并生成带超链接的目录sheet
+    - reports: [{'name': 表名, 'rows': 行问题, 'cols': 列问题, 'tables': build_crosstab_tables结果}]
+    - 各表的sheet按 T01_交叉分析、T01_显著性检验 … 命名
+    - style: 样式参数，同 write_crosstab_report
+    """
+    width = max(2, len(str(len(reports))))
+    prefixes = [f"T{i:0{width}d}" for i in range(1, len(reports) + 1)]
+    contents = pd.DataFrame({
+        '表名': [report['name'] for report in reports],
+        '行问题': ['、'.join(map(str, report['rows'])) for report in reports],
+        '列问题': ['、'.join(map(str, report['cols'])) for report in reports],
+        '交叉分析': [_report_sheet_name(prefix, '交叉分析') for prefix in prefixes],
+        '显著性检验': [_report_sheet_name(prefix, '显著性检验') for prefix in prefixes],
+    }, index=pd.Index(prefixes, name='序号'))
+    if any(report.get('filter') for report in reports):
+        contents.insert(3, '筛选条件', [' 且 '.join(report.get('filter') or ()) for report in reports])
+    reports = [(prefix, report['tables']) for prefix, report in zip(prefixes, reports)]
+    return _write_workbook(output_file, reports, contents, engine, constant_memory, _report_style(**style))
+
+def _write_workbook(output_file, reports, contents, engine, constant_memory, style):
+    """选择写出引擎并处理输出目标（路径 / 可写流 / None返回字节）"""
+    if engine == 'auto':
+        engine = 'xlsxwriter' if xlsxwriter is not None else 'openpyxl'
+    if engine == 'xlsxwriter' and xlsxwriter is None:
+        raise ValueError("未安装xlsxwriter，请安装后重试或使用 engine='openpyxl'")
+    if engine not in ('xlsxwriter', 'openpyxl'):
+        raise ValueError(f"不支持的写出引擎：{engine}")
+
+    # === 处理已有文件（仅文件路径） ===
+    buffer = None
+    if output_file is None:
+        output_file = buffer = io.BytesIO()
+    elif isinstance(output_file, (str, os.PathLike)) and os.path.exists(output_file):
         try:
             os.remove(output_file)
         except PermissionError:
             raise PermissionError(f"请关闭正在使用的文件：{output_file}")
 
+    if engine == 'xlsxwriter':
+        _write_report_xlsxwriter(output_file, reports, contents, constant_memory=constant_memory, **style)
+    else:
+        _write_report_openpyxl(output_file, reports, contents, **style)
+    if buffer is not None:
+        return buffer.getvalue()
+
+
+EXCEL_MAX_COLUMNS = 16384
+CONTENTS_LINK_COLUMNS = ('交叉分析', '显著性检验')  # 目录中链接到对应sheet的列
+
+def split_wide_frame(sheet_name, df, step=1):
+    """
+    按Excel列数上限拆分宽表，返回 [(sheet名, 子表)]
+    每个子表保留全部索引列；step 保证成对的列（如频数/百分比）不被拆开
+    """
+    width = (EXCEL_MAX_COLUMNS - df.index.nlevels) // step * step
+    if df.shape[1] <= width:
+        return [(sheet_name, df)]
+    return [
+        (sheet_name if part == 0 else f"{sheet_name}_{part + 1}", df.iloc[:, start:start + width])
+        for part, start in enumerate(range(0, df.shape[1], width))
+    ]
+
+def _report_sheet_name(prefix, name):
+    return f"{prefix}_{name}" if prefix else name
+
+def _report_main_sheets(reports):
+    """各报告的交叉分析sheet：[(sheet名, 表格)]"""
+    return [
+        part for prefix, tables in reports
+        for part in split_wide_frame(_report_sheet_name(prefix, '交叉分析'), tables['combined'], step=2)
+    ]
+
+def _report_extra_sheets(reports):
+    """各报告的显著性检验等附加sheet：[(sheet名, 表格, 是否为p值表)]，宽表同样拆分"""
+    sheets = []
+    for prefix, tables in reports:
+        extra = [('显著性检验', tables['sig']), ('带星号显著性', tables['formatted_sig']),
+                 ('列间比较', tables['letters'])]
+        if tables['weighting'] is not None:
+            extra.append(('加权信息', tables['weighting']))
+        for name, df in extra:
+            for sheet_name, part_df in split_wide_frame(_report_sheet_name(prefix, name), df):
+                sheets.append((sheet_name, part_df, name == '显著性检验'))
+    return sheets
+
+def _excel_frame_layout(df):
+    """
+    按 DataFrame.to_excel(merge_cells=True) 的布局展开表格
+    返回 (表头行, 索引列值, 合并区域)；索引列中被合并的重复值置为None，合并区域为 (列号, 起始行, 结束行)
+    """
+    if isinstance(df.index, pd.MultiIndex):
+        header = list(df.index.names)
+        index_values = [list(df.index.get_level_values(level)) for level in range(df.index.nlevels)]
+    else:
+        header = [df.index.name]
+        index_values = [list(df.index)]
+    header += list(df.columns)
+
+    # 外层索引的连续相同值合并（最内层不合并）
+    merges = []
+    n_rows = len(df)
+    for level in range(len(index_values) - 1):
+        keys = list(zip(*index_values[:level + 1]))
+        start = 0
+        for i in range(1, n_rows + 1):
+            if i == n_rows or keys[i] != keys[start]:
+                if i - start > 1:
+                    merges.append((level, start, i - 1))
+                start = i
+    for level, start, end in merges:
+        for i in range(start + 1, end + 1):
+            index_values[level][i] = None
+    return header, index_values, merges
+
+def _write_excel_value(worksheet, row, col, value, cell_format=None):
+    if value is None or (isinstance(value, float) and value != value):
+        worksheet.write_blank(row, col, None, cell_format)
+    elif isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)):
+        worksheet.write_number(row, col, value, cell_format)
+    else:
+        worksheet.write_string(row, col, value if isinstance(value, str) else str(value), cell_format)
+
+def _write_frame_xlsxwriter(worksheet, df, header_format, index_formats, column_formats,
+                            merge_index=True, row_height=None, link_columns=()):
+    """
+    按行写出DataFrame（兼容constant_memory模式）
+    index_formats / column_formats 为每个索引列 / 数据列的格式
+    link_columns 中的数据列写为指向同名sheet的内部链接（与所在行一起写出，constant_memory模式下不会丢失）
+    返回 _excel_frame_layout 的结果
+    """
+    header, index_values, merges = _excel_frame_layout(df)
+    n_index = len(index_values)
+    merge_starts, merged = {}, set()
+    if merge_index:
+        for level, start, end in merges:
+            merge_starts[(level, start)] = end
+            merged.update((level, i) for i in range(start + 1, end + 1))
+
+    for col, value in enumerate(header):
+        _write_excel_value(worksheet, 0, col, value, header_format)
+
+    data = df.to_numpy(dtype=object)
+    for i in range(len(df)):
+        row = i + 1
+        if row_height is not None:
+            worksheet.set_row(row, row_height)
+        for level in range(n_index):
+            value, cell_format = index_values[level][i], index_formats[level]
+            if (level, i) in merge_starts:
+                worksheet.merge_range(row, level, merge_starts[(level, i)] + 1, level, value, cell_format)
+            elif (level, i) not in merged:  # 合并区域内的其余单元格由merge_range填充
+                _write_excel_value(worksheet, row, level, value, cell_format)
+        for j, value in enumerate(data[i]):
+            if j in link_columns:
+                worksheet.write_url(row, n_index + j, f"internal:'{value}'!A1", column_formats[j],
+                                    string=str(value))
+            else:
+                _write_excel_value(worksheet, row, n_index + j, value, column_formats[j])
+    return header, index_values, merges
+
+def _excel_color(color):
+    return color if color.startswith('#') else f"#{color}"
+
+def _write_report_xlsxwriter(output_file, reports, contents, header_height, header_fill_color, header_font_color,
+                             header_font_name, header_font_size, freq_data_bar_color, percent_data_bar_color,
+                             data_bar_min_length, data_bar_max_length, percent_format, data_column_width,
+                             max_column_width, constant_memory=False):
+    """
+    xlsxwriter写出：格式按列/区域预先定义，每个单元格只写一次
+    reports 为 [(sheet名前缀, 表格字典)]；contents 不为None时在最前面写出目录sheet
+    """
+    workbook = xlsxwriter.Workbook(output_file, {'constant_memory': constant_memory,
+                                                 'nan_inf_to_errors': True})
+    try:
+        # === 提前定义样式 ===
+        cell_style = {'font_name': "微软雅黑", 'border': 1, 'text_wrap': True,
+                      'valign': 'top', 'align': 'left'}
+        cell_format = workbook.add_format(cell_style)
+        percent_cell_format = workbook.add_format(dict(cell_style, num_format=percent_format))
+        sig_header_format = workbook.add_format({
+            'bg_color': _excel_color(header_fill_color), 'pattern': 1,
+            'font_name': header_font_name, 'font_size': header_font_size, 'bold': True,
+            'font_color': _excel_color(header_font_color), 'border': 1,
+            'align': 'center', 'valign': 'top', 'text_wrap': True
+        })
+        sig_index_format = workbook.add_format({'align': 'center', 'valign': 'top', 'text_wrap': True})
+        center_format = workbook.add_format({'align': 'center'})
+        p_value_format = workbook.add_format({'align': 'center', 'num_format': '0.000'})
+
+        # === 目录sheet ===
+        if contents is not None:
+            worksheet = workbook.add_worksheet('目录')
+            worksheet.set_column(0, 0, 8)
+            worksheet.set_column(1, contents.shape[1], 30)
+            link_format = workbook.add_format({'font_color': 'blue', 'underline': 1})
+            link_columns = {j for j, col in enumerate(contents.columns) if col in CONTENTS_LINK_COLUMNS}
+            _write_frame_xlsxwriter(worksheet, contents, sig_header_format, [None],
+                                    [link_format if j in link_columns else None for j in range(contents.shape[1])],
+                                    link_columns=link_columns)
+
+        # === 交叉分析sheet ===
+        for sheet_name, part_df in _report_main_sheets(reports):
+            worksheet = workbook.add_worksheet(sheet_name)
+            column_kinds = ['百分比' if str(col).endswith('（百分比）') else
+                            '频数' if str(col).endswith('（频数）') else None
+                            for col in part_df.columns]
+            column_formats = [percent_cell_format if kind == '百分比' else cell_format
+                              for kind in column_kinds]
+
+            # 列宽和行高需在写入数据前设置
+            worksheet.set_column(0, 1, 25)  # 问题列、选项列
+            for j, col in enumerate(part_df.columns):
+                if data_column_width:
+                    width = data_column_width
+                else:
+                    # 自动调整：取表头（多行取最长行）与数据文本长度的最大值
+                    values = part_df.iloc[:, j].dropna()
+                    max_length = max(len(line) for line in str(col).split('\n'))
+                    if len(values):
+                        max_length = max(max_length, int(values.astype(str).str.len().max()))
+                    width = min(max_length + 2, max_column_width)
+                worksheet.set_column(j + 2, j + 2, width)
+            worksheet.set_row(0, header_height)
+
+            _, index_values, _ = _write_frame_xlsxwriter(
+                worksheet, part_df, cell_format, [cell_format, cell_format], column_formats,
+                merge_index=not constant_memory, row_height=20
+            )
+
+            # === 数据条设置（跳过总计行） ===
+            valid_rows = [
+                i + 1 for i, label in enumerate(index_values[0])
+                if not any(keyword in str(label or "").replace('\n', '').replace(' ', '')
+                           for keyword in ["总计", "Total", "合计"])
+            ]
+            if valid_rows:
+                first_row, last_row = min(valid_rows), max(valid_rows)
+                for j, kind in enumerate(column_kinds):
+                    if kind is None:
+                        continue
+                    worksheet.conditional_format(first_row, j + 2, last_row, j + 2, {
+                        'type': 'data_bar',
+                        'bar_color': _excel_color(
+                            freq_data_bar_color if kind == '频数' else percent_data_bar_color
+                        ),
+                        'min_type': 'num', 'min_value': 0,
+                        'max_type': 'max',
+                        'min_length': data_bar_min_length,
+                        'max_length': data_bar_max_length,
+                    })
+
+            # === 冻结前两列和第一行 ===
+            worksheet.freeze_panes(1, 2)
+            worksheet.hide_gridlines(2)   # 隐藏网格线
+
+        # === 显著性检验等sheet ===
+        for sheet_name, part_df, is_p_value in _report_extra_sheets(reports):
+            worksheet = workbook.add_worksheet(sheet_name)
+            data_format = p_value_format if is_p_value else center_format
+            n_index = part_df.index.nlevels
+            _write_frame_xlsxwriter(
+                worksheet, part_df, sig_header_format,
+                [sig_index_format] * n_index, [data_format] * part_df.shape[1],
+                merge_index=not constant_memory
+            )
+    finally:
+        workbook.close()
+
+def _write_report_openpyxl(output_file, reports, contents, header_height, header_fill_color, header_font_color,
+                           header_font_name, header_font_size, freq_data_bar_color, percent_data_bar_color,
+                           data_bar_min_length, data_bar_max_length, percent_format, data_column_width,
+                           max_column_width):
+    """openpyxl写出：逐单元格设置格式，适合小表（参数含义同 _write_report_xlsxwriter）"""
+
     # =========================================================== Excel输出 ============================================================
+    from openpyxl.utils import get_column_letter
+    from openpyxl.styles import Alignment, Font, PatternFill, Border, Side
+    from openpyxl.formatting.rule import DataBarRule
+
     with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
         # === 提前定义样式 ===
         header_fill = PatternFill(
@@ -344,164 +1582,752 @@ def process_crosstab(
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
+        # 标题行与索引列显式设置对齐方式（与xlsxwriter一致，不依赖pandas版本的默认表头样式）
+        header_alignment = Alignment(horizontal='center', vertical='top', wrap_text=True)
 
-        # === 交叉分析sheet ===
-        combined_df.to_excel(writer, sheet_name='交叉分析', merge_cells=True)
-        worksheet = writer.sheets['交叉分析']
+        # === 目录sheet ===
+        if contents is not None:
+            contents.to_excel(writer, sheet_name='目录')
+            sheet = writer.sheets['目录']
+            for cell in sheet[1]:
+                cell.fill = header_fill
+                cell.font = header_font
+                cell.border = thin_border
+                cell.alignment = header_alignment
+            for col_idx, col in enumerate(contents.columns, start=2):
+                if col not in CONTENTS_LINK_COLUMNS:
+                    continue
+                for row_idx in range(2, sheet.max_row + 1):
+                    cell = sheet.cell(row=row_idx, column=col_idx)
+                    cell.hyperlink = f"#'{cell.value}'!A1"
+                    cell.font = Font(color="0000FF", underline="single")
+            sheet.column_dimensions['A'].width = 8
+            for col_idx in range(2, sheet.max_column + 1):
+                sheet.column_dimensions[get_column_letter(col_idx)].width = 30
+
+        # === 交叉分析sheet（超过Excel列数上限时拆分为多个sheet） ===
+        for sheet_name, part_df in _report_main_sheets(reports):
+            part_df.to_excel(writer, sheet_name=sheet_name, merge_cells=True)
+            worksheet = writer.sheets[sheet_name]
         
-        # === 设置百分比格式 ===
-        for col_idx in range(1, worksheet.max_column + 1):
-            cell_value = worksheet.cell(row=1, column=col_idx).value
-            if cell_value and "百分比" in cell_value:
-                col_letter = get_column_letter(col_idx)
-                for row in worksheet.iter_rows(
-                    min_row=2, 
-                    max_row=worksheet.max_row,
-                    min_col=col_idx,
-                    max_col=col_idx
-                ):
-                    for cell in row:
-                        cell.number_format = percent_format
+            # === 设置百分比格式 ===
+            for col_idx in range(1, worksheet.max_column + 1):
+                cell_value = worksheet.cell(row=1, column=col_idx).value
+                if cell_value and "百分比" in cell_value:
+                    col_letter = get_column_letter(col_idx)
+                    for row in worksheet.iter_rows(
+                        min_row=2, 
+                        max_row=worksheet.max_row,
+                        min_col=col_idx,
+                        max_col=col_idx
+                    ):
+                        for cell in row:
+                            cell.number_format = percent_format
        
-        # 标题样式
-        worksheet.row_dimensions[1].height = header_height
-
-        # 设置其他行行高（例如设置为20）
-        for row_idx in range(2, worksheet.max_row + 1):
-            worksheet.row_dimensions[row_idx].height = 20
-        for cell in worksheet[1]:
-            cell.font = Font(
-                name=header_font_name,
-                size=header_font_size,
-                bold=True,
-                color=header_font_color
-            )
+            # 标题样式
+            worksheet.row_dimensions[1].height = header_height
 
-        # === 数据条设置===
-        freq_rule = DataBarRule(
-            start_type='num', 
-            start_value=0,
-            end_type='max', 
-            color=freq_data_bar_color,
-            showValue="None",
-            minLength=data_bar_min_length,
-            maxLength=data_bar_max_length
-        )
-        percent_rule = DataBarRule(
-            start_type='num', 
-            start_value=0,
-            end_type='max', 
-            color=percent_data_bar_color,
-            showValue="None",
-            minLength=data_bar_min_length,
-            maxLength=data_bar_max_length
-        )
+            # 设置其他行行高（例如设置为20）
+            for row_idx in range(2, worksheet.max_row + 1):
+                worksheet.row_dimensions[row_idx].height = 20
+            for cell in worksheet[1]:
+                cell.font = Font(
+                    name=header_font_name,
+                    size=header_font_size,
+                    bold=True,
+                    color=header_font_color
+                )
 
-        # 预先生成有效行列表
-        valid_rows = []
-        for row_idx in range(2, worksheet.max_row + 1):
-            row_label = worksheet.cell(row=row_idx, column=1).value or ""
-            # 清理标签中的换行符和空格
-            clean_label = row_label.replace('\n', '').replace(' ', '')
-            # 判断是否为总计行（支持多种格式）
-            if any(keyword in clean_label for keyword in ["总计", "Total", "合计"]):
-                continue
-            valid_rows.append(row_idx)
+            # === 数据条设置===
+            freq_rule = DataBarRule(
+                start_type='num', 
+                start_value=0,
+                end_type='max', 
+                color=freq_data_bar_color,
+                showValue="None",
+                minLength=data_bar_min_length,
+                maxLength=data_bar_max_length
+            )
+            percent_rule = DataBarRule(
+                start_type='num', 
+                start_value=0,
+                end_type='max', 
+                color=percent_data_bar_color,
+                showValue="None",
+                minLength=data_bar_min_length,
+                maxLength=data_bar_max_length
+            )
 
-        # 应用数据条到所有有效列
-        for col_idx in range(1, worksheet.max_column + 1):
-            header_cell = worksheet.cell(row=1, column=col_idx)
-            header_value = header_cell.value or ""
+            # 预先生成有效行列表
+            valid_rows = []
+            for row_idx in range(2, worksheet.max_row + 1):
+                row_label = worksheet.cell(row=row_idx, column=1).value or ""
+                # 清理标签中的换行符和空格
+                clean_label = row_label.replace('\n', '').replace(' ', '')
+                # 判断是否为总计行（支持多种格式）
+                if any(keyword in clean_label for keyword in ["总计", "Total", "合计"]):
+                    continue
+                valid_rows.append(row_idx)
+
+            # 应用数据条到所有有效列
+            for col_idx in range(1, worksheet.max_column + 1):
+                header_cell = worksheet.cell(row=1, column=col_idx)
+                header_value = header_cell.value or ""
             
-            # 确定规则类型
-            if "频数" in header_value:
-                rule = freq_rule
-            elif "百分比" in header_value:
-                rule = percent_rule
-            else:
-                continue
+                # 确定规则类型
+                if "频数" in header_value:
+                    rule = freq_rule
+                elif "百分比" in header_value:
+                    rule = percent_rule
+                else:
+                    continue
 
-            # 仅当存在有效数据行时应用
-            if valid_rows:
-                col_letter = get_column_letter(col_idx)
-                data_range = f"{col_letter}{min(valid_rows)}:{col_letter}{max(valid_rows)}"
-                worksheet.conditional_formatting.add(data_range, rule)
-
-        # === 格式优化 ===
-        # 设置列宽
-        worksheet.column_dimensions['A'].width = 25  # 问题列宽
-        worksheet.column_dimensions['B'].width = 25  # 选项列宽
+                # 仅当存在有效数据行时应用
+                if valid_rows:
+                    col_letter = get_column_letter(col_idx)
+                    data_range = f"{col_letter}{min(valid_rows)}:{col_letter}{max(valid_rows)}"
+                    worksheet.conditional_formatting.add(data_range, rule)
+
+            # === 格式优化 ===
+            # 设置列宽
+            worksheet.column_dimensions['A'].width = 25  # 问题列宽
+            worksheet.column_dimensions['B'].width = 25  # 选项列宽
         
-        # 设置C列及之后的宽度
-        for col in worksheet.columns:
-            col_letter = get_column_letter(col[0].column)
+            # 设置C列及之后的宽度
+            for col in worksheet.columns:
+                col_letter = get_column_letter(col[0].column)
             
-            # 跳过已设置的A、B列
-            if col_letter in ['A', 'B']: 
-                continue
+                # 跳过已设置的A、B列
+                if col_letter in ['A', 'B']: 
+                    continue
                 
-            # 计算最大列宽
-            max_length = 0
-            for cell in col:
-                try:
-                    # 处理换行文本：取最长行的长度
-                    if cell.value and '\n' in str(cell.value):
-                        line_lengths = [len(line) for line in str(cell.value).split('\n')]
-                        cell_length = max(line_lengths)
-                    else:
-                        cell_length = len(str(cell.value))
-                    max_length = max(max_length, cell_length)
-                except:
-                    pass
+                # 计算最大列宽
+                max_length = 0
+                for cell in col:
+                    try:
+                        # 处理换行文本：取最长行的长度
+                        if cell.value and '\n' in str(cell.value):
+                            line_lengths = [len(line) for line in str(cell.value).split('\n')]
+                            cell_length = max(line_lengths)
+                        else:
+                            cell_length = len(str(cell.value))
+                        max_length = max(max_length, cell_length)
+                    except:
+                        pass
             
-            # 设置列宽（使用自定义宽度或自动调整）
-            if data_column_width:  # 如果设置了固定宽度
-                worksheet.column_dimensions[col_letter].width = data_column_width
-            else:  # 否则自动调整宽度
-                adjusted_width = min(max_length + 2, max_column_width)
-                worksheet.column_dimensions[col_letter].width = adjusted_width
-
-        # 设置边框
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        for row in worksheet.iter_rows():
-            for cell in row:
-                cell.border = thin_border
-                cell.alignment = Alignment(
-                    wrap_text=True, 
-                    vertical='top',
-                    horizontal='left'
-                )
+                # 设置列宽（使用自定义宽度或自动调整）
+                if data_column_width:  # 如果设置了固定宽度
+                    worksheet.column_dimensions[col_letter].width = data_column_width
+                else:  # 否则自动调整宽度
+                    adjusted_width = min(max_length + 2, max_column_width)
+                    worksheet.column_dimensions[col_letter].width = adjusted_width
+
+            # 设置边框
+            thin_border = Border(
+                left=Side(style='thin'),
+                right=Side(style='thin'),
+                top=Side(style='thin'),
+                bottom=Side(style='thin')
+            )
+            for row in worksheet.iter_rows():
+                for cell in row:
+                    cell.border = thin_border
+                    cell.alignment = Alignment(
+                        wrap_text=True, 
+                        vertical='top',
+                        horizontal='left'
+                    )
 
-        # === 设置全局字体 ===
-        for row in worksheet.iter_rows():
-            for cell in row:
-                cell.font = Font(name="微软雅黑")  # 保留原有其他属性
+            # === 设置全局字体 ===
+            for row in worksheet.iter_rows():
+                for cell in row:
+                    cell.font = Font(name="微软雅黑")  # 保留原有其他属性
 
-        # === 冻结前两列和第一行 ===
-        worksheet.freeze_panes = "C2"
-        worksheet.sheet_view.showGridLines = False   # 隐藏网格线
+            # === 冻结前两列和第一行 ===
+            worksheet.freeze_panes = "C2"
+            worksheet.sheet_view.showGridLines = False   # 隐藏网格线
 
         # 新增显著性检验sheet
-        sig_df.to_excel(writer, sheet_name='显著性检验')
-        formatted_sig_df.to_excel(writer, sheet_name='带星号显著性')
+        sig_sheets = []
+        for sheet_name, part_df, is_p_value in _report_extra_sheets(reports):
+            part_df.to_excel(writer, sheet_name=sheet_name)
+            sig_sheets.append((sheet_name, is_p_value, part_df.index.nlevels))
 
         # 设置显著性sheet样式（复用已定义的样式变量）
-        for sheet_name in ['显著性检验', '带星号显著性']:
+        for sheet_name, is_p_value, n_index in sig_sheets:
             sheet = writer.sheets[sheet_name]
             for cell in sheet[1]:  # 设置标题行样式
                 cell.fill = header_fill
                 cell.font = header_font
                 cell.border = thin_border
+                cell.alignment = header_alignment
             # 设置数字格式
             for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
-                for cell in row[1:]:
-                    if sheet_name == '显著性检验':
+                for cell in row[:n_index]:
+                    cell.alignment = header_alignment
+                for cell in row[n_index:]:
+                    if is_p_value:
                         cell.number_format = '0.000'
                     cell.alignment = Alignment(horizontal='center')
 
-    return combined_df, sig_df
\ No newline at end of file
+
+def process_crosstab(
+    input_file,  # 文件路径、DataFrame、SurveyStore或SurveyIndex
+    output_file,  # 文件路径或可写的二进制流（如BytesIO）；None时只计算、不生成Excel
+    row_questions, 
+    col_questions,
+    # 新增显著性检验参数
+    sig_levels=[0.05, 0.01, 0.001],
+    sig_symbols=['*', '**', '***'],
+    col_test_level=0.05,  # 列间比较（A/B/C字母）显著性水平
+    # 样式配置
+    header_height=55,
+    header_fill_color="4F81BD",
+    header_font_color="FFFFFF",
+    header_font_name="微软雅黑",
+    header_font_size=12,
+    # 数据条配置
+    freq_data_bar_color="638EC6",
+    percent_data_bar_color="C00000",
+    data_bar_min_length=15,
+    data_bar_max_length=100,
+    # 格式配置
+    percent_format="0.00%",
+    data_column_width=20,  # C列及之后的固定宽度（None表示自动调整）
+    max_column_width=40, #【可调整最大列宽】
+    # 写出配置
+    engine='auto',  # Excel写出引擎：'xlsxwriter'、'openpyxl'或'auto'
+    constant_memory=False,  # xlsxwriter逐行写出，适合超大表（问题列不合并单元格）
+    # 加权配置
+    weight_column=None,  # 权重列名
+    rake_margins=None,  # 目标边际 {题目: {选项: 目标占比}}，提供时按IPF迭代加权
+    survey_index=None,  # 复用已构建的SurveyIndex（提供时不再读取input_file）
+    chunk_size=None,  # 分块读取的行数（提供时按块流式统计，内存占用与文件大小无关）
+    recode_rules=None,  # 重新编码规则（规则列表或JSON文件路径，见 recode.py）
+    filter_expr=None,  # 样本筛选条件，如 "平台 == 'Android'"（多个条件用列表，取交集）
+    progress_callback=None,  # 阶段进度回调（见 instrumentation.py），也可传入 Instrumentation 汇总记录
+    memory_budget=None,  # 内存预算（字节），提供时按 plan_crosstab 选择执行策略
+    strategy='auto',  # 执行策略：'auto'、'dense'、'sparse'或'chunked'（见 CrosstabPlan）
+    encoding=None  # csv文件编码（None时按 utf-8/gbk 自动检测）
+):
+    style = dict(
+        header_height=header_height,
+        header_fill_color=header_fill_color,
+        header_font_color=header_font_color,
+        header_font_name=header_font_name,
+        header_font_size=header_font_size,
+        freq_data_bar_color=freq_data_bar_color,
+        percent_data_bar_color=percent_data_bar_color,
+        data_bar_min_length=data_bar_min_length,
+        data_bar_max_length=data_bar_max_length,
+        percent_format=percent_format,
+        data_column_width=data_column_width,
+        max_column_width=max_column_width,
+    )
+    if isinstance(input_file, SurveyStore):
+        input_file = SurveyIndex(input_file)
+    if isinstance(input_file, SurveyIndex):
+        survey_index = input_file
+    file_plan = None
+    if (memory_budget is not None and chunk_size is None and survey_index is None
+            and isinstance(input_file, (str, os.PathLike)) and strategy in ('auto', 'chunked')
+            and not rake_margins and not recode_rules):
+        # 文件整体读入可能超出预算时改为分块读取（编码只检测一次，各遍读取共用）
+        encoding = detect_csv_encoding(input_file, encoding)
+        chunk_size, full_load = plan_file_chunks(input_file, memory_budget, strategy, encoding)
+        if chunk_size is not None:
+            file_plan = CrosstabPlan('chunked', {'full_load': full_load}, chunk_size, memory_budget)
+    streaming = (chunk_size is not None and survey_index is None
+                 and not isinstance(input_file, pd.DataFrame))
+    if streaming and rake_margins:
+        raise ValueError("分块读取模式不支持目标边际加权，请提供权重列")
+    if streaming and recode_rules:
+        raise ValueError("分块读取模式不支持重新编码，请先读入数据或使用SurveyStore")
+    if streaming:
+        encoding = detect_csv_encoding(input_file, encoding)
+    
+    tracker = instrumentation(progress_callback, CROSSTAB_STAGES)
+
+    # === 数据准备 ===
+    with tracker.stage('load') as info:
+        try:
+            if survey_index is not None:
+                df = survey_index.df
+            elif isinstance(input_file, pd.DataFrame):
+                # 直接使用内存中的DataFrame，不经过文件读写
+                df = input_file.rename(columns=lambda col: str(col).strip())
+            elif streaming:
+                # 只读表头，数据在统计阶段分块读取
+                df = pd.DataFrame(columns=read_survey_header(input_file, encoding))
+            else:
+                df = read_survey_file(input_file, encoding)
+
+            if survey_index is None:
+                survey_index = SurveyIndex(df)
+
+        except Exception as e:
+            raise Exception(f"输入文件读取失败: {str(e)}")
+
+        # === 变量重新编码（派生变量在交叉表用到时才计算） ===
+        if recode_rules:
+            survey_index.define_recodes(recode_rules)
+        info['rows'] = None if streaming else survey_index.n_rows
+
+    with tracker.stage('schema'):
+        valid_rows, col_specs = resolve_crosstab_questions(survey_index, row_questions, col_questions)
+
+    # === 交叉统计计算 ===
+    # 行/列条件各堆叠为一个指示矩阵，一次矩阵乘法得到频数表及2×2四格计数
+    with tracker.stage('conditions') as info:
+        if streaming:
+            # 第一遍扫描确定列类型与选项
+            layout_questions = [q for kind, q in valid_rows if kind == 'single']
+            layout_questions += [q for kind, q, _ in col_specs if kind == 'single']
+            header_layout = CrosstabLayout()
+            header_layout.row_keys = [(kind, q) for kind, q in valid_rows]
+            header_layout.col_keys = [(kind, q) for kind, q, _ in col_specs]
+            columns = _required_columns(survey_index, header_layout, weight_column, filter_expr)
+            kinds, options, info['rows'] = scan_survey_columns(
+                input_file, columns, list(dict.fromkeys(layout_questions)), chunk_size, encoding
+            )
+            survey_index._options.update(options)
+        layout = build_crosstab_layout(survey_index, valid_rows, col_specs)
+        info['cells'] = len(layout.row_labels) * len(layout.col_labels)
+
+    with tracker.stage('counting', cells=len(layout.row_labels) * len(layout.col_labels)) as info:
+        if streaming:
+            counts = stream_crosstab_counts(
+                input_file, survey_index, layout, kinds, options, chunk_size, weight_column,
+                filter_expr=_filter_key(filter_expr), encoding=encoding
+            )
+            info['plan'] = file_plan
+        else:
+            weights = survey_index.weights(weight_column, rake_margins)
+            plan = None
+            if memory_budget is not None or strategy != 'auto':
+                plan = plan_crosstab(survey_index, layout, memory_budget, strategy,
+                                     weighted=weights is not None or filter_expr is not None)
+                info['plan'] = plan
+            counts = count_crosstab(survey_index, layout, weights, survey_index.mask(_filter_key(filter_expr)), plan)
+        info['rows'] = counts.n_rows
+
+    with tracker.stage('significance', cells=len(layout.row_labels) * len(layout.col_labels)):
+        tables = build_crosstab_tables(layout, counts, sig_levels, sig_symbols, col_test_level)
+
+    if output_file is not None:
+        with tracker.stage('write', cells=tables['combined'].size):
+            write_crosstab_report(output_file, tables, engine=engine, constant_memory=constant_memory, **style)
+
+    return tables['combined'], tables['sig']
+
+
+def _normalize_table_specs(tables=None, banner=None, stubs=None, filter_expr=None):
+    """
+    将表格配置统一为 [{'name', 'rows', 'cols', 'filter'}]
+    filter_expr 为全部表共用的筛选条件，与各表自己的 filter 取交集
+    """
+    specs = []
+    for spec in tables or []:
+        if isinstance(spec, dict):
+            rows, cols, name = list(spec['rows']), list(spec['cols']), spec.get('name')
+            table_filter = _filter_key(spec.get('filter')) or ()
+        else:
+            rows, cols = spec
+            rows, cols, name, table_filter = list(rows), list(cols), None, ()
+        specs.append({'name': name, 'rows': rows, 'cols': cols, 'filter': table_filter})
+    if stubs is not None:
+        if not banner:
+            raise ValueError("提供stubs时必须同时提供banner（列问题）")
+        for stub in stubs:
+            rows = [stub] if isinstance(stub, str) else list(stub)
+            specs.append({'name': None, 'rows': rows, 'cols': list(banner), 'filter': ()})
+    for spec in specs:
+        if not spec['name']:
+            spec['name'] = f"{'、'.join(map(str, spec['rows']))} × {'、'.join(map(str, spec['cols']))}"
+        spec['filter'] = _filter_key((_filter_key(filter_expr) or ()) + spec['filter'])
+    return specs
+
+def build_book_layouts(survey_index, specs):
+    """按表格配置生成各表的交叉表结构，无有效行/列问题的表为None"""
+    layouts = []
+    for spec in specs:
+        valid_rows, col_specs = resolve_crosstab_questions(survey_index, spec['rows'], spec['cols'])
+        if not valid_rows or not col_specs:
+            warnings.warn(f"表格 {spec['name']} 没有有效的行或列问题，已跳过")
+            layouts.append(None)
+            continue
+        layout = build_crosstab_layout(survey_index, valid_rows, col_specs)
+        layout.filter = spec.get('filter')
+        layouts.append(layout)
+    return layouts
+
+def _group_by_columns(layouts):
+    """按列结构与筛选条件分组：{(列题目, 筛选条件): [表序号]}"""
+    groups = defaultdict(list)
+    for i, layout in enumerate(layouts):
+        if layout is not None:
+            groups[(tuple(layout.col_keys), layout.filter)].append(i)
+    return groups
+
+def compute_crosstab_book(survey_index, layouts, weights=None):
+    """
+    批量计算多张交叉表的计数状态，返回与layouts对应的 CrosstabCounts 列表（layout为None时为None）
+    列结构与筛选条件相同的表共享同一个列指示矩阵，行题目去重后一次矩阵乘法得到全部频数
+    """
+    results = [None] * len(layouts)
+    for (col_keys, filter_expr), members in _group_by_columns(layouts).items():
+        row_keys = list(dict.fromkeys(key for i in members for key in layouts[i].row_keys))
+        blocks = [survey_index.block(key) for key in row_keys]
+        row_matrix = build_indicator_matrix(blocks, survey_index.n_rows)
+        col_matrix = layouts[members[0]].col_matrix(survey_index)
+        counts = CrosstabCounts(row_matrix.n_cols, col_matrix.n_cols, weighted=weights is not None)
+        counts.add(row_matrix, col_matrix, weights, survey_index.mask(filter_expr))
+
+        # 各行题目在合并矩阵中的位置
+        positions, start = {}, 0
+        for key, block in zip(row_keys, blocks):
+            positions[key] = np.arange(start, start + block.shape[1])
+            start += block.shape[1]
+        for i in members:
+            rows = np.concatenate([positions[key] for key in layouts[i].row_keys])
+            results[i] = counts.select_rows(rows)
+    return results
+
+# ================== 多进程并行 ==================
+
+class SharedArrays:
+    """把若干numpy数组放入同一块共享内存，子进程按名称挂载后零拷贝读取"""
+
+    def __init__(self, arrays):
+        self.spec = {}
+        offset = 0
+        for name, array in arrays.items():
+            self.spec[name] = (offset, array.shape, array.dtype.str)
+            offset += -(-array.nbytes // 64) * 64  # 按64字节对齐
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, array in arrays.items():
+            self.attach_array(self.shm, self.spec[name])[...] = array
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @staticmethod
+    def attach_array(shm, spec):
+        offset, shape, dtype = spec
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def attach(cls, name, spec):
+        """挂载已有共享内存，返回 (SharedMemory, {名称: 数组})"""
+        shm = shared_memory.SharedMemory(name=name)
+        return shm, {key: cls.attach_array(shm, item) for key, item in spec.items()}
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def _encode_survey_index(survey_index, keys, weights=None, filters=()):
+    """
+    将用到的题目编码为紧凑数组（每行一个题目，便于按题目连续读取）：
+    - codes: 单选题选项下标（int32，缺失为-1）
+    - ticked: 多选题各子列是否选中（uint8）
+    - masks: 各筛选表达式的样本掩码（uint8）
+    返回 (数组字典, 单选题选项, 多选题子列)
+    """
+    singles = [q for kind, q in keys if kind == 'single']
+    roots = [q for kind, q in keys if kind == 'multi']
+    options = {q: survey_index.options(q) for q in singles}
+    multi_columns = {root: survey_index.multi_choice_columns(root) for root in roots}
+    subcols = list(dict.fromkeys(col for root in roots for col in multi_columns[root]))
+
+    arrays = {}
+    codes = np.empty((len(singles), survey_index.n_rows), dtype=np.int32)
+    for j, q in enumerate(singles):
+        codes[j] = survey_index.option_codes(q)
+    arrays['codes'] = codes
+    ticked = np.empty((len(subcols), survey_index.n_rows), dtype=np.uint8)
+    for j, col in enumerate(subcols):
+        ticked[j] = (survey_index.column(col) == 1).to_numpy()
+    arrays['ticked'] = ticked
+    if weights is not None:
+        arrays['weights'] = np.asarray(weights, dtype=np.float64)
+    masks = np.empty((len(filters), survey_index.n_rows), dtype=np.uint8)
+    for j, expr in enumerate(filters):
+        masks[j] = survey_index.mask(expr)
+    arrays['masks'] = masks
+    return arrays, options, multi_columns, subcols
+
+_book_worker = {}
+
+def _init_book_worker(shm_name, spec, options, multi_columns, subcols, sparse_threshold, filters=()):
+    """子进程初始化：挂载共享内存并构建只读的题目索引"""
+    shm, arrays = SharedArrays.attach(shm_name, spec)
+    codes, ticked = arrays['codes'], arrays['ticked']
+    # ticked 转置后为列优先数组，DataFrame直接引用共享内存，不复制数据
+    df = pd.DataFrame(ticked.T, columns=subcols, copy=False)
+    survey_index = SurveyIndex(df, sparse_threshold=sparse_threshold, options=options)
+    survey_index.n_rows = codes.shape[1]
+    survey_index._codes.update({q: codes[j] for j, q in enumerate(options)})
+    survey_index._multi_choice_columns.update(multi_columns)
+    survey_index._masks.update({expr: arrays['masks'][j].view(bool) for j, expr in enumerate(filters)})
+    _book_worker.update(shm=shm, survey_index=survey_index, weights=arrays.get('weights'))
+
+def _book_worker_task(layouts, sig_levels, sig_symbols, col_test_level):
+    survey_index, weights = _book_worker['survey_index'], _book_worker['weights']
+    return [
+        build_crosstab_tables(layout, counts, sig_levels, sig_symbols, col_test_level)
+        for layout, counts in zip(layouts, compute_crosstab_book(survey_index, layouts, weights))
+    ]
+
+def parallel_crosstab_book(survey_index, layouts, weights=None, workers=None,
+                           sig_levels=[0.05, 0.01, 0.001], sig_symbols=['*', '**', '***'],
+                           col_test_level=0.05):
+    """
+    多进程批量计算交叉表（计数与显著性检验），返回与layouts对应的表格字典列表
+    - 编码后的题目数据只写入共享内存一次，各子进程挂载读取，不逐任务复制
+    - 同一列结构的表按行题目切块分给各进程，结果按原顺序汇总
+    Windows/macOS 下调用方需放在 if __name__ == '__main__': 之内
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = []
+    for members in _group_by_columns(layouts).values():
+        size = -(-len(members) // workers)
+        tasks.extend(members[start:start + size] for start in range(0, len(members), size))
+
+    keys = list(dict.fromkeys(
+        key for layout in layouts if layout is not None for key in layout.questions()
+    ))
+    filters = list(dict.fromkeys(
+        expr for layout in layouts if layout is not None for expr in layout.filter or ()
+    ))
+    arrays, options, multi_columns, subcols = _encode_survey_index(survey_index, keys, weights, filters)
+    shared = SharedArrays(arrays)
+    del arrays
+
+    results = [None] * len(layouts)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, max(len(tasks), 1)),
+            initializer=_init_book_worker,
+            initargs=(shared.name, shared.spec, options, multi_columns, subcols,
+                      survey_index.sparse_threshold, filters)
+        ) as executor:
+            task = partial(_book_worker_task, sig_levels=sig_levels, sig_symbols=sig_symbols,
+                           col_test_level=col_test_level)
+            outputs = executor.map(task, [[layouts[i] for i in members] for members in tasks])
+            for members, tables_list in zip(tasks, outputs):
+                for i, tables in zip(members, tables_list):
+                    results[i] = tables
+    finally:
+        shared.close()
+    return results
+
+def process_crosstab_book(
+    input_file,  # 文件路径、DataFrame、SurveyStore或SurveyIndex
+    output_file,  # 文件路径或可写的二进制流（如BytesIO）；None时只计算、不生成Excel
+    tables=None,  # 表格配置 [{'rows': [...], 'cols': [...], 'name': 可选}] 或 [(行问题, 列问题)]
+    banner=None,  # 公共列问题（与stubs配合：每个stub生成一张表）
+    stubs=None,  # 行问题列表，每项为题目或题目列表
+    sig_levels=[0.05, 0.01, 0.001],
+    sig_symbols=['*', '**', '***'],
+    col_test_level=0.05,
+    weight_column=None,
+    rake_margins=None,
+    engine='auto',
+    constant_memory=False,
+    workers=None,  # 并行进程数（大于1时多进程计算，见 parallel_crosstab_book）
+    recode_rules=None,  # 重新编码规则（见 recode.py）
+    filter_expr=None,  # 全部表共用的样本筛选条件（各表也可在配置中用 'filter' 单独指定）
+    progress_callback=None,  # 阶段进度回调（见 instrumentation.py）
+    encoding=None,  # csv文件编码（None时按 utf-8/gbk 自动检测）
+    **style  # 样式参数，同 process_crosstab
+):
+    """
+    批量交叉分析：数据只读取一次、列条件只计算一次，所有表写入同一个带目录的工作簿
+    返回：[(表名, 交叉表, 显著性表)]，跳过的表不在结果中
+    """
+    specs = _normalize_table_specs(tables, banner, stubs, filter_expr)
+    tracker = instrumentation(progress_callback, BOOK_STAGES)
+    with tracker.stage('load') as info:
+        if isinstance(input_file, SurveyIndex):
+            survey_index = input_file
+        elif isinstance(input_file, (pd.DataFrame, SurveyStore)):
+            survey_index = SurveyIndex(input_file)
+        else:
+            try:
+                survey_index = SurveyIndex(read_survey_file(input_file, encoding))
+            except Exception as e:
+                raise Exception(f"输入文件读取失败: {str(e)}")
+        if recode_rules:
+            survey_index.define_recodes(recode_rules)
+        info['rows'] = survey_index.n_rows
+
+    with tracker.stage('conditions') as info:
+        layouts = build_book_layouts(survey_index, specs)
+        info['cells'] = sum(len(layout.row_labels) * len(layout.col_labels) for layout in layouts if layout)
+
+    parallel = workers is not None and workers > 1
+    with tracker.stage('counting', rows=survey_index.n_rows, cells=info['cells']):
+        weights = survey_index.weights(weight_column, rake_margins)
+        if parallel:
+            # 多进程时计数与显著性检验在子进程中一并完成
+            all_tables = parallel_crosstab_book(survey_index, layouts, weights, workers,
+                                                sig_levels, sig_symbols, col_test_level)
+        else:
+            all_counts = compute_crosstab_book(survey_index, layouts, weights)
+
+    with tracker.stage('significance', cells=info['cells']):
+        if not parallel:
+            all_tables = [
+                None if counts is None else
+                build_crosstab_tables(layout, counts, sig_levels, sig_symbols, col_test_level)
+                for layout, counts in zip(layouts, all_counts)
+            ]
+
+    reports, results = [], []
+    for spec, tables_dict in zip(specs, all_tables):
+        if tables_dict is None:
+            continue
+        reports.append(dict(spec, tables=tables_dict))
+        results.append((spec['name'], tables_dict['combined'], tables_dict['sig']))
+
+    if output_file is not None:
+        with tracker.stage('write', cells=sum(report['tables']['combined'].size for report in reports)):
+            write_crosstab_book(output_file, reports, engine=engine, constant_memory=constant_memory, **style)
+    return results
+
+# ================== 增量更新 ==================
+
+class SchemaChangedError(ValueError):
+    """新数据的题目选项或子列与已保存的计数状态不一致，需要全量重新计算"""
+
+class CrosstabState:
+    """
+    可持久化的交叉表计数状态，用于持续回收的问卷（每天追加新样本）
+    - 保存交叉表结构、各单选题的有序选项与累计计数（频数、行列基数、四格计数所需的边际）
+    - update() 只处理新增样本，耗时与新增行数成正比
+    - 显著性检验与报告由累计计数重新生成
+    - 新数据出现未知选项或多选题子列变化时抛出 SchemaChangedError，此时需用 build() 全量重算
+    """
+
+    VERSION = 2  # 2: 交叉表结构增加样本筛选条件（layout.filter）
+
+    def __init__(self, layout, counts, options, multi_columns, weight_column=None,
+                 row_questions=None, col_questions=None, recode_rules=None):
+        self.layout = layout
+        self.counts = counts
+        self.options = options
+        self.multi_columns = multi_columns
+        self.weight_column = weight_column
+        self.row_questions = list(row_questions or [])
+        self.col_questions = list(col_questions or [])
+        self.recode_rules = load_recode_rules(recode_rules)
+
+    @classmethod
+    def build(cls, input_file, row_questions, col_questions, weight_column=None, recode_rules=None,
+              filter_expr=None):
+        """
+        全量计算（input_file 为文件路径、DataFrame、SurveyStore或SurveyIndex）
+        filter_expr 为样本筛选条件，之后每批新增样本按同一条件筛选
+        """
+        if isinstance(input_file, SurveyIndex):
+            survey_index = input_file
+        elif isinstance(input_file, (pd.DataFrame, SurveyStore)):
+            survey_index = SurveyIndex(input_file)
+        else:
+            survey_index = SurveyIndex(read_survey_file(input_file))
+        if recode_rules:
+            survey_index.define_recodes(recode_rules)
+
+        valid_rows, col_specs = resolve_crosstab_questions(survey_index, row_questions, col_questions)
+        layout = build_crosstab_layout(survey_index, valid_rows, col_specs)
+        layout.filter = _filter_key(filter_expr)
+        options, multi_columns = {}, {}
+        for kind, q in layout.questions():
+            if kind == 'single':
+                options[q] = survey_index.options(q)
+            else:
+                multi_columns[q] = survey_index.multi_choice_columns(q)
+
+        weights = survey_index.weights(weight_column)
+        counts = CrosstabCounts(len(layout.row_labels), len(layout.col_labels), weighted=weights is not None)
+        counts.add(layout.row_matrix(survey_index), layout.col_matrix(survey_index), weights,
+                   survey_index.mask(layout.filter))
+        return cls(layout, counts, options, multi_columns, weight_column, row_questions, col_questions,
+                   recode_rules)
+
+    def _batch_index(self, new_data):
+        """为新增样本构建索引，并检查题目结构是否与状态一致"""
+        if isinstance(new_data, SurveyIndex):
+            new_data = new_data.df if new_data.store is None else new_data.store
+        elif not isinstance(new_data, (pd.DataFrame, SurveyStore)):
+            new_data = read_survey_file(new_data)
+        survey_index = SurveyIndex(new_data, options=self.options)
+        if self.recode_rules:
+            survey_index.define_recodes(self.recode_rules)
+
+        missing = [q for q in self.options if q not in survey_index.columns]
+        if self.weight_column is not None and self.weight_column not in survey_index.columns:
+            missing.append(self.weight_column)
+        if missing:
+            raise SchemaChangedError(f"新数据缺少列：{missing}")
+        for root, subcols in self.multi_columns.items():
+            if survey_index.multi_choice_columns(root) != subcols:
+                raise SchemaChangedError(f"多选题 {root} 的子列发生变化，需要全量重新计算")
+        for q in self.options:
+            try:
+                survey_index.option_codes(q)
+            except ValueError as e:
+                raise SchemaChangedError(f"{e}，需要全量重新计算") from e
+        return survey_index
+
+    def update(self, new_data):
+        """累加一批新增样本（文件路径、DataFrame、SurveyStore或SurveyIndex），返回self"""
+        survey_index = self._batch_index(new_data)
+        self.counts.add(
+            self.layout.row_matrix(survey_index),
+            self.layout.col_matrix(survey_index),
+            survey_index.weights(self.weight_column),
+            survey_index.mask(self.layout.filter)
+        )
+        return self
+
+    @property
+    def n_rows(self):
+        return self.counts.n_rows
+
+    def tables(self, sig_levels=[0.05, 0.01, 0.001], sig_symbols=['*', '**', '***'], col_test_level=0.05):
+        """由累计计数生成输出表格（同 build_crosstab_tables）"""
+        return build_crosstab_tables(self.layout, self.counts, sig_levels, sig_symbols, col_test_level)
+
+    def write_report(self, output_file, sig_levels=[0.05, 0.01, 0.001], sig_symbols=['*', '**', '***'],
+                     col_test_level=0.05, **style):
+        """
+        重新计算显著性检验并写出报告（style 同 write_crosstab_report），返回 (交叉表, 显著性表)
+        output_file 为None时只计算、不生成Excel
+        """
+        tables = self.tables(sig_levels, sig_symbols, col_test_level)
+        if output_file is not None:
+            write_crosstab_report(output_file, tables, **style)
+        return tables['combined'], tables['sig']
+
+    def save(self, path):
+        """原子写入状态文件"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump({'version': self.VERSION, 'state': self}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get('version') != cls.VERSION:
+            raise SchemaChangedError(f"状态文件版本不兼容：{data.get('version')}，需要全量重新计算")
+        return data['state']
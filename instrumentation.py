@@ -0,0 +1,154 @@
+"""
+分阶段计时与进度回调
+- 交叉分析与文本分析的各函数通过 progress_callback 报告每个阶段的开始与结束
+- 结束事件包含耗时、涉及的行数/单元格数与内存峰值，界面可据此显示真实进度，也可用于记录耗时分布
+
+回调收到一个字典：
+{'stage': 'counting', 'label': '交叉计数', 'status': 'start'/'end'/'error', 'progress': 0~1,
+ 'elapsed': 本阶段秒数, 'total_elapsed': 累计秒数, 'rows': 行数, 'cells': 单元格数, 'peak_memory': 字节数}
+"""
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 交叉分析各阶段
+CROSSTAB_STAGES = ('load', 'schema', 'conditions', 'counting', 'significance', 'write')
+BOOK_STAGES = ('load', 'conditions', 'counting', 'significance', 'write')
+# 文本分析各阶段
+WORDCLOUD_STAGES = ('tokenize', 'frequencies', 'render', 'save')
+CLUSTERING_STAGES = ('vectorize', 'clustering', 'summary')
+# 界面中的完整文本分析流程（词云与聚类的阶段汇总到同一个计时器）
+TEXT_STAGES = ('clean', 'tagging') + WORDCLOUD_STAGES + CLUSTERING_STAGES + ('export',)
+
+STAGE_LABELS = {
+    'load': '读取数据',
+    'schema': '识别题目',
+    'conditions': '生成交叉条件',
+    'counting': '交叉计数',
+    'significance': '显著性检验',
+    'write': '写出Excel',
+    'clean': '文本清洗',
+    'tagging': '标签匹配',
+    'tokenize': '分词',
+    'frequencies': '统计词频',
+    'render': '生成词云',
+    'save': '保存图片',
+    'vectorize': '文本向量化',
+    'clustering': '聚类',
+    'summary': '汇总结果',
+    'export': '导出结果',
+}
+
+
+def peak_memory():
+    """进程内存峰值（字节），无法获取时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Instrumentation:
+    """
+    阶段计时器，按声明的阶段顺序换算进度
+    - callback: 接收事件字典的回调（None时只记录不回调）
+    - stages: 该流程的全部阶段，用于计算进度
+    - trace_memory: 用 tracemalloc 统计每个阶段内的分配峰值（有额外开销），否则报告进程内存峰值
+    """
+
+    def __init__(self, callback=None, stages=CROSSTAB_STAGES, trace_memory=False):
+        self.callback = callback
+        self.stages = tuple(stages)
+        self.trace_memory = trace_memory
+        self.records = []
+        self._start = time.perf_counter()
+
+    def _emit(self, event):
+        if self.callback is not None:
+            self.callback(event)
+
+    def _progress(self, stage, done):
+        if stage not in self.stages:
+            return None
+        return (self.stages.index(stage) + done) / len(self.stages)
+
+    @contextmanager
+    def stage(self, name, rows=None, cells=None):
+        """
+        计时一个阶段：with instrumentation.stage('counting', rows=n) as info
+        阶段内可通过 info['rows'] / info['cells'] 补充计数信息，其余键（如执行计划）原样附在结束事件中
+        """
+        info = {'rows': rows, 'cells': cells}
+        label = STAGE_LABELS.get(name, name)
+        self._emit({'stage': name, 'label': label, 'status': 'start', 'progress': self._progress(name, 0)})
+
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        status = 'error'  # 阶段内抛出异常时仍报告耗时
+        try:
+            yield info
+            status = 'end'
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.trace_memory:
+                memory = tracemalloc.get_traced_memory()[1]
+                if tracing:
+                    tracemalloc.stop()
+            else:
+                memory = peak_memory()
+            record = {
+                'stage': name,
+                'label': label,
+                'status': status,
+                'progress': self._progress(name, 1),
+                'elapsed': elapsed,
+                'total_elapsed': time.perf_counter() - self._start,
+                'rows': info['rows'],
+                'cells': info['cells'],
+                'peak_memory': memory,
+            }
+            record.update({key: value for key, value in info.items() if key not in record})
+            self.records.append(record)
+            self._emit(record)
+
+    def summary(self):
+        """各阶段耗时汇总表"""
+        columns = ['stage', 'label', 'elapsed', 'rows', 'cells', 'peak_memory']
+        return pd.DataFrame([{k: record[k] for k in columns} for record in self.records], columns=columns)
+
+
+def instrumentation(progress_callback, stages):
+    """
+    由函数参数得到计时器：progress_callback 可以是回调函数或已有的 Instrumentation
+    （传入 Instrumentation 时沿用其回调与记录，便于多个函数汇总到同一份记录）
+    """
+    if isinstance(progress_callback, Instrumentation):
+        return progress_callback
+    return Instrumentation(progress_callback, stages)
+
+
+def print_progress(event):
+    """简单的命令行回调：每个阶段结束时打印一行耗时"""
+    if event['status'] != 'end':
+        return
+    parts = [f"{event['label']}: {event['elapsed']:.3f}s"]
+    if event['rows'] is not None:
+        parts.append(f"{event['rows']}行")
+    if event['cells'] is not None:
+        parts.append(f"{event['cells']}个单元格")
+    if event['peak_memory'] is not None:
+        parts.append(f"内存峰值 {event['peak_memory'] / 2 ** 20:.0f}MB")
+    print("  ".join(parts))
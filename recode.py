@@ -0,0 +1,207 @@
+"""
+变量重新编码：按配置规则生成派生变量
+- 规则只作用于题目的有序选项（选项表），再按编码查表得到每个样本的新编码，不逐行映射
+- 派生变量在 SurveyIndex 中按需计算并缓存，只有交叉表用到时才计算
+
+规则格式（JSON列表，每项一个派生变量）：
+{"new_col": "满意度_T2B", "source_col": "满意度", "method": "top2box", "config": {"top": 2}}
+兼容旧格式 {"source_col": ..., "new_col": ..., "rules": {"method": ..., "config": ...}}
+
+支持的 method：
+- map: {"mapping": {原选项: 新选项}}，未列出的选项视为缺失
+- bin / cut: {"bins": [0, 18, 30, 100], "labels": [...], "right": true}，数值分段（左开右闭）
+- top2box: {"top": 2, "labels": ["Top2", "其他"], "from": "high"}，取排序最靠后（或最靠前）的若干选项
+- combine: {"groups": {新选项: [原选项, ...]}, "keep_others": true}，合并选项
+- expr: {"conditions": [[条件表达式, 取值], ...], "default": null}，按条件依次赋值（先满足者优先）
+"""
+import json
+import os
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from survey_store import option_sort_order
+
+
+def load_recode_rules(config):
+    """读取重新编码规则：规则列表、含 rules 键的字典或JSON文件路径"""
+    if config is None:
+        return []
+    if isinstance(config, (str, os.PathLike)):
+        with open(config, encoding='utf-8') as f:
+            config = json.load(f)
+    if isinstance(config, dict):
+        config = config.get('rules', [config])
+
+    rules = []
+    for rule in config:
+        rule = dict(rule)
+        if 'rules' in rule:  # 旧格式
+            nested = rule.pop('rules')
+            rule.setdefault('method', nested['method'])
+            rule.setdefault('config', nested.get('config', {}))
+        if 'new_col' not in rule or 'method' not in rule:
+            raise ValueError(f"重新编码规则缺少 new_col 或 method：{rule}")
+        if rule['method'] != 'expr' and 'source_col' not in rule:
+            raise ValueError(f"重新编码规则缺少 source_col：{rule}")
+        rule.setdefault('config', {})
+        rules.append(rule)
+    return rules
+
+
+def _ordered_labels(values):
+    """去重并按选项编号排序（与单选题选项的排序规则一致）"""
+    labels = [v for v in dict.fromkeys(values) if not pd.isna(v)]
+    return [labels[i] for i in option_sort_order(labels)]
+
+
+def _option_lookup(source_options, new_values, labels=None):
+    """
+    由原选项 -> 新取值 生成查找表
+    返回 (查找表, 新选项)，查找表最后一项对应缺失（编码-1）
+    """
+    if labels is None:
+        labels = _ordered_labels(new_values)
+    position = {label: i for i, label in enumerate(labels)}
+    lookup = np.array(
+        [position.get(v, -1) if not pd.isna(v) else -1 for v in new_values] + [-1],
+        dtype=np.int64
+    )
+    return lookup, labels
+
+
+def _map_values(options, config):
+    mapping = config['mapping']
+    return [mapping.get(option, np.nan) for option in options], None
+
+
+def _bin_values(options, config):
+    bins = np.asarray(config['bins'], dtype=np.float64)
+    right = config.get('right', True)
+    labels = config.get('labels')
+    if labels is None:
+        labels = [f"({bins[i]:g}, {bins[i + 1]:g}]" if right else f"[{bins[i]:g}, {bins[i + 1]:g})"
+                  for i in range(len(bins) - 1)]
+    if len(labels) != len(bins) - 1:
+        raise ValueError("分段标签数量应比分段边界少1")
+
+    values = pd.to_numeric(pd.Series(options, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    # 左开右闭 (a, b]：searchsorted(side='left') 得到 i 使 bins[i-1] < v <= bins[i]
+    index = np.searchsorted(bins, values, side='left' if right else 'right')
+    valid = (index >= 1) & (index <= len(labels)) & ~np.isnan(values)
+    return [labels[i - 1] if ok else np.nan for i, ok in zip(index, valid)], list(labels)
+
+
+def _top_box_values(options, config):
+    top = config.get('top', 2)
+    labels = list(config.get('labels', [f"Top{top}", "其他"]))
+    if config.get('from', 'high') == 'high':
+        top_options = set(range(len(options) - top, len(options)))
+    else:
+        top_options = set(range(top))
+    return [labels[0] if i in top_options else labels[1] for i in range(len(options))], labels
+
+
+def _combine_values(options, config):
+    groups = config['groups']
+    keep_others = config.get('keep_others', True)
+    group_of = {old: new for new, olds in groups.items() for old in olds}
+    values = [group_of.get(option, option if keep_others else np.nan) for option in options]
+    # 合并后的选项排在其第一个原选项的位置
+    return values, [v for v in dict.fromkeys(values) if not pd.isna(v)]
+
+
+_OPTION_METHODS = {
+    'map': _map_values,
+    'cut': _bin_values,
+    'bin': _bin_values,
+    'top2box': _top_box_values,
+    'combine': _combine_values,
+}
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NAME_TOKEN = re.compile(r"`([^`]*)`|([^\W\d]\w*)")
+
+
+def expression_names(expr):
+    """表达式中的名称：完整的标识符与反引号括起的列名（字符串常量中的文字不算）"""
+    names = set()
+    for quoted, identifier in _NAME_TOKEN.findall(_STRING_LITERAL.sub(" ", expr)):
+        names.add(quoted.strip() if quoted else identifier)
+    return names
+
+
+def expression_columns(survey_index, expr, exclude=()):
+    """表达式中引用到的列（按完整名称匹配，列名只是其他名称的一部分时不算引用）"""
+    names = expression_names(expr) - set(exclude)
+    return [col for col in survey_index.columns if str(col) in names]
+
+
+def evaluate_expression(survey_index, expr, exclude=()):
+    """
+    在数据集上计算布尔表达式（pandas.eval语法，特殊列名用反引号括起），返回布尔数组
+    exclude 中的列不取数据（如派生变量自身）
+    """
+    frame = pd.DataFrame(index=pd.RangeIndex(survey_index.n_rows))
+    for col in expression_columns(survey_index, expr, exclude):
+        values = survey_index.column(col)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # 编码数据解码为原始取值，使数值比较（如 年龄 >= 30）可用
+            values = pd.Series(np.asarray(values, dtype=object)).infer_objects()
+        frame[col] = np.asarray(values)
+    try:
+        result = frame.eval(expr)
+    except Exception as e:
+        raise ValueError(f"表达式无法计算：{expr}（{e}）")
+    result = np.asarray(result)
+    if result.shape != (survey_index.n_rows,):
+        raise ValueError(f"表达式结果不是逐样本的布尔值：{expr}")
+    return pd.Series(result).fillna(False).to_numpy(dtype=bool)
+
+
+def _expr_codes(survey_index, config, new_col):
+    conditions = [
+        (item['when'], item['value']) if isinstance(item, dict) else tuple(item)
+        for item in config['conditions']
+    ]
+    for expr, _ in conditions:
+        if new_col in expression_names(expr):
+            raise ValueError(f"派生变量 {new_col} 的条件引用了自身：{expr}")
+    default = config.get('default')
+    labels = list(dict.fromkeys(value for _, value in conditions))
+    if default is not None and default not in labels:
+        labels.append(default)
+
+    codes = np.full(survey_index.n_rows, -1 if default is None else labels.index(default), dtype=np.int64)
+    # 倒序赋值，使排在前面的条件优先
+    for expr, value in reversed(conditions):
+        codes[evaluate_expression(survey_index, expr, exclude=(new_col,))] = labels.index(value)
+    return codes, labels
+
+
+def apply_recode(survey_index, rule):
+    """
+    计算一个派生变量，返回 (编码数组, 有序选项)，编码-1表示缺失
+    源变量为数据集中的单选题或其他派生变量
+    """
+    method, config = rule['method'], rule.get('config', {})
+    if method == 'expr':
+        return _expr_codes(survey_index, config, rule['new_col'])
+    if method not in _OPTION_METHODS:
+        raise ValueError(f"不支持的编码方式：{method}")
+
+    source = rule['source_col']
+    if source == rule['new_col']:
+        raise ValueError(f"派生变量 {source} 的原始列是其自身")
+    if source not in survey_index.columns:
+        raise ValueError(f"原始列 {source} 不存在")
+    options = survey_index.options(source)
+    codes = survey_index.option_codes(source)
+    new_values, labels = _OPTION_METHODS[method](options, config)
+    lookup, labels = _option_lookup(options, new_values, labels)
+    if not labels:
+        warnings.warn(f"派生变量 {rule['new_col']} 没有任何有效选项")
+    return lookup[codes], labels
@@ -0,0 +1,203 @@
+"""
+命令行批量任务：按JSON任务配置运行交叉分析与文本分析，不依赖Streamlit，可用于服务器定时任务
+
+用法：
+    python run_jobs.py jobs.json --workers 4
+
+任务配置示例（路径相对于配置文件所在目录）：
+{
+  "output_dir": "输出",
+  "workers": 2,
+  "jobs": [
+    {"type": "crosstab", "name": "满意度", "input": "数据.xlsx", "output": "满意度交叉.xlsx",
+     "rows": ["满意度", "Q7."], "cols": ["性别"], "weight_column": "权重", "filter_expr": "平台 == 'Android'"},
+    {"type": "book", "name": "全量出表", "input": "数据.xlsx", "output": "全量出表.xlsx",
+     "banner": ["性别", "年龄"], "stubs": ["满意度", "Q7."]},
+    {"type": "text", "name": "开放题", "input": "数据.xlsx", "output": "开放题.xlsx",
+     "text_column": "评论", "other_columns": ["性别"], "wordcloud": "开放题词云.png", "n_clusters": 8}
+  ]
+}
+crosstab / book 任务的其余键原样传给 process_crosstab / process_crosstab_book（如 sig_levels、recode_rules、memory_budget）
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+# 无界面环境下绘制词云
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from instrumentation import Instrumentation, CROSSTAB_STAGES, BOOK_STAGES, TEXT_STAGES
+
+JOB_TYPES = ('crosstab', 'book', 'text')
+TEXT_INVALID_WORDS = ['无', ' ', '没有', '不知道']
+
+
+def load_job_spec(path):
+    """读取任务配置，校验任务类型并补全任务名"""
+    with open(path, encoding='utf-8') as f:
+        spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {'jobs': spec}
+    for i, job in enumerate(spec.get('jobs', []), 1):
+        if job.get('type') not in JOB_TYPES:
+            raise ValueError(f"第{i}个任务的类型无效：{job.get('type')}（可选 {', '.join(JOB_TYPES)}）")
+        if 'input' not in job or 'output' not in job:
+            raise ValueError(f"第{i}个任务缺少 input 或 output")
+        job.setdefault('name', f"{job['type']}_{i}")
+    return spec
+
+
+def _resolve(path, base_dir):
+    return path if path is None or os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def _run_crosstab(job, input_file, output_file, tracker):
+    from cross_analysis import process_crosstab
+    options = {k: v for k, v in job.items() if k not in ('type', 'name', 'input', 'output', 'rows', 'cols')}
+    process_crosstab(input_file, output_file, job['rows'], job['cols'], progress_callback=tracker, **options)
+
+
+def _run_book(job, input_file, output_file, tracker):
+    from cross_analysis import process_crosstab_book
+    options = {k: v for k, v in job.items() if k not in ('type', 'name', 'input', 'output')}
+    process_crosstab_book(input_file, output_file, progress_callback=tracker, **options)
+
+
+def _run_text(job, input_file, output_file, tracker, base_dir):
+    """与界面一致的文本分析流程：清洗、标签匹配、词云、聚类、导出"""
+    from cross_analysis import read_survey_file
+    from text_analysis import (clean_text, tag_texts, generate_wordcloud, text_clustering, export_results,
+                               DEFAULT_TAG_KEYWORDS, DEFAULT_NEGATION_WORDS)
+
+    text_column = job['text_column']
+    with tracker.stage('load') as info:
+        df = read_survey_file(input_file)[[text_column] + list(job.get('other_columns', []))].copy()
+        info['rows'] = len(df)
+    with tracker.stage('clean', rows=len(df)):
+        df = clean_text(df, text_column, job.get('invalid_words', TEXT_INVALID_WORDS))
+
+    tag_keywords = job.get('tag_keywords', DEFAULT_TAG_KEYWORDS)
+    negation_words = set(job.get('negation_words', DEFAULT_NEGATION_WORDS))
+    with tracker.stage('tagging', rows=len(df)):
+        if tag_keywords:
+            df["匹配标签"], df["匹配关键词"] = tag_texts(df[text_column], tag_keywords, negation_words)
+
+    if job.get('wordcloud'):
+        generate_wordcloud(df[text_column], set(job.get('stopwords', [])),
+                           save_path=_resolve(job['wordcloud'], base_dir),
+                           font_path=job.get('font_path', 'simhei.ttf'), progress_callback=tracker)
+    cluster_df, labels = text_clustering(df[text_column], n_clusters=job.get('n_clusters', 10),
+                                         max_samples=job.get('max_samples', 20), progress_callback=tracker)
+    df["聚类标签"] = labels
+    with tracker.stage('export', rows=len(df)):
+        export_results(df, cluster_df, output_file)
+
+
+def run_job(job, output_dir):
+    """运行单个任务，返回结果摘要（失败时记录错误信息，不影响其他任务）"""
+    stages = {'crosstab': CROSSTAB_STAGES, 'book': BOOK_STAGES, 'text': ('load',) + TEXT_STAGES}[job['type']]
+    tracker = Instrumentation(stages=stages)
+    input_file = _resolve(job['input'], job['_base_dir'])
+    output_file = _resolve(job['output'], output_dir)
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    job = {k: v for k, v in job.items() if k != '_base_dir'}
+
+    start = time.perf_counter()
+    result = {'name': job['name'], 'type': job['type'], 'input': input_file, 'output': output_file}
+    try:
+        if job['type'] == 'crosstab':
+            _run_crosstab(job, input_file, output_file, tracker)
+        elif job['type'] == 'book':
+            _run_book(job, input_file, output_file, tracker)
+        else:
+            _run_text(job, input_file, output_file, tracker, output_dir)
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    result['stages'] = [
+        {
+            'stage': record['stage'],
+            'seconds': round(record['elapsed'], 3),
+            'rows': record['rows'],
+            'cells': record['cells'],
+            'peak_memory_mb': None if record['peak_memory'] is None else round(record['peak_memory'] / 2 ** 20, 1),
+            **({'plan': record['plan'].describe()} if record.get('plan') is not None else {}),
+        }
+        for record in tracker.records
+    ]
+    return result
+
+
+def _init_worker():
+    """工作进程启动时加载分词器：fork 方式下直接沿用父进程已加载的分词器，否则从磁盘缓存加载"""
+    from text_analysis import get_tokenizer
+    get_tokenizer()
+
+
+def run_jobs(spec, output_dir, workers=1):
+    """按顺序返回各任务结果；workers大于1时各任务在独立进程中并行运行"""
+    jobs = spec['jobs']
+    if workers <= 1 or len(jobs) <= 1:
+        return [run_job(job, output_dir) for job in jobs]
+    initializer = None
+    if any(job['type'] == 'text' for job in jobs):
+        # 先在主进程中加载（并在需要时写入磁盘缓存），各工作进程共用，不再各自构建词典
+        from text_analysis import preload_tokenizer
+        preload_tokenizer(background=False)
+        initializer = _init_worker
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=initializer) as executor:
+        return list(executor.map(run_job, jobs, [output_dir] * len(jobs)))
+
+
+def print_summary(results, total_seconds):
+    print(f"{'任务':<20}{'类型':<10}{'状态':<8}{'耗时(s)':>10}  阶段耗时")
+    for result in results:
+        stages = "  ".join(f"{stage['stage']} {stage['seconds']:.2f}" for stage in result['stages'])
+        print(f"{result['name']:<20}{result['type']:<10}{result['status']:<8}{result['seconds']:>10.2f}  {stages}")
+        if result['status'] == 'error':
+            print(f"    错误：{result['error']}")
+    failed = sum(result['status'] != 'ok' for result in results)
+    print(f"共 {len(results)} 个任务，失败 {failed} 个，总耗时 {total_seconds:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量运行交叉分析与文本分析任务（无界面）")
+    parser.add_argument("spec", help="任务配置文件（JSON）")
+    parser.add_argument("--workers", type=int, help="并行任务数（默认取配置中的 workers，未配置时为1）")
+    parser.add_argument("--output-dir", help="输出目录（默认取配置中的 output_dir，相对于配置文件）")
+    parser.add_argument("--only", nargs="+", help="只运行指定名称的任务")
+    parser.add_argument("--summary", help="耗时汇总文件（默认为输出目录下的 timing_summary.json）")
+    args = parser.parse_args(argv)
+
+    spec = load_job_spec(args.spec)
+    base_dir = os.path.dirname(os.path.abspath(args.spec))
+    output_dir = os.path.abspath(args.output_dir or _resolve(spec.get('output_dir', '.'), base_dir))
+    os.makedirs(output_dir, exist_ok=True)
+    for job in spec['jobs']:
+        job['_base_dir'] = base_dir
+    if args.only:
+        spec['jobs'] = [job for job in spec['jobs'] if job['name'] in args.only]
+    workers = args.workers or spec.get('workers', 1)
+
+    start = time.perf_counter()
+    results = run_jobs(spec, output_dir, workers)
+    total_seconds = time.perf_counter() - start
+    print_summary(results, total_seconds)
+
+    summary_path = args.summary or os.path.join(output_dir, 'timing_summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump({'workers': workers, 'seconds': round(total_seconds, 3), 'jobs': results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"耗时汇总已写入 {summary_path}")
+    return 1 if any(result['status'] != 'ok' for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
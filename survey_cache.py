@@ -0,0 +1,144 @@
+"""
+问卷文件缓存：按文件内容哈希把解析后的数据转存为列式格式
+- 首次读取时解析原始文件（xlsx/csv），写入缓存目录下的 <哈希>.feather
+- 再次读取同一内容的文件时直接加载列式缓存，无需重新解析xlsx（转换为DataFrame时仍会复制一份数据）
+- pyarrow不可用或数据无法转换为Arrow格式时，退回pickle格式
+- 缓存目录总大小超过上限时，按最近使用时间淘汰旧文件
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import warnings
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SURVEY_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "survey-analysis")
+)
+DEFAULT_MAX_BYTES = int(os.environ.get("SURVEY_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CACHE_FORMAT_VERSION = "1"
+
+# 进程内记录 (路径, 大小, 修改时间) -> 内容哈希，避免同一文件重复计算哈希
+_path_digests = {}
+
+
+def file_digest(source, chunk_size=1 << 20):
+    """计算文件内容的SHA-256（支持文件路径、bytes及可读文件对象）"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+
+    if isinstance(source, (str, os.PathLike)):
+        stat = os.stat(source)
+        key = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+        if key not in _path_digests:
+            digest = hashlib.sha256()
+            with open(source, "rb") as f:
+                for block in iter(lambda: f.read(chunk_size), b""):
+                    digest.update(block)
+            _path_digests[key] = digest.hexdigest()
+        return _path_digests[key]
+
+    # 文件对象（如Streamlit上传文件）：读取后恢复原位置
+    position = source.tell()
+    source.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: source.read(chunk_size), b""):
+        digest.update(block)
+    source.seek(position)
+    return digest.hexdigest()
+
+
+def _cache_paths(cache_dir, key):
+    return (os.path.join(cache_dir, f"{key}.feather"),
+            os.path.join(cache_dir, f"{key}.pkl"))
+
+
+def _read_cached(path):
+    if path.endswith(".feather"):
+        from pyarrow import feather
+        return feather.read_table(path, memory_map=True).to_pandas()
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _write_cached(df, cache_dir, key):
+    """原子写入缓存文件（先写临时文件再重命名），返回缓存文件路径"""
+    feather_path, pickle_path = _cache_paths(cache_dir, key)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        try:
+            from pyarrow import feather
+            feather.write_feather(df.reset_index(drop=True), tmp_path)
+            target = feather_path
+        except Exception:
+            # 混合类型列等无法转换为Arrow时使用pickle
+            with open(tmp_path, "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            target = pickle_path
+        os.replace(tmp_path, target)
+        return target
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def evict_cache(cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    """缓存目录超过 max_bytes 时，按最近使用时间从旧到新删除缓存文件"""
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith((".feather", ".pkl")):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def load_cached_survey(source, reader, kind="", cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    带缓存的问卷读取
+    参数：
+    - source: 文件路径、bytes或文件对象
+    - reader: 缓存未命中时的解析函数，接收source返回DataFrame
+    - kind: 区分同一内容的不同解析方式（如文件类型）
+    - cache_dir: 缓存目录（默认 ~/.cache/survey-analysis，可用环境变量 SURVEY_CACHE_DIR 修改）
+    - max_bytes: 缓存目录大小上限
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    key = f"{file_digest(source)}-{kind}-v{CACHE_FORMAT_VERSION}"
+    for path in _cache_paths(cache_dir, key):
+        if os.path.exists(path):
+            try:
+                df = _read_cached(path)
+                os.utime(path)  # 记录最近使用时间，供淘汰策略使用
+                return df
+            except Exception as e:
+                warnings.warn(f"缓存文件损坏，重新解析：{e}")
+                os.remove(path)
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    df = reader(source)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_cached(df, cache_dir, key)
+        evict_cache(cache_dir, max_bytes)
+    except OSError as e:
+        warnings.warn(f"写入缓存失败，本次不使用缓存：{e}")
+    return df
@@ -0,0 +1,88 @@
+"""
+问卷表头结构索引：只根据列名识别题目结构
+- 多选题根（Q数字.）及按选项编号排序的子列
+- 多选题题干与各子列的选项文本
+- 单选题列（不属于任何多选题的列）
+同一表头只解析一次（按表头签名缓存），交叉分析引擎与界面共用
+"""
+import re
+from functools import lru_cache
+
+MULTI_CHOICE_ROOT = re.compile(r'^(Q\d+\.)')
+_SUBCOL_NUMBER = re.compile(r'^(\d+)')
+
+
+def extract_subcol_number(subcol, prefix):
+    suffix = subcol.split(prefix)[1].strip()
+    match = _SUBCOL_NUMBER.search(suffix)
+    return int(match.group(1)) if match else 0
+
+
+class SurveySchema:
+    """
+    表头结构（列名统一去除首尾空格）：
+    - multi_choice: {多选题根: 有序子列}，只包含子列不少于2个的题根
+    - single_columns: 单选题列，保持表头顺序
+    """
+
+    def __init__(self, columns):
+        self.columns = tuple(str(col).strip() for col in columns)
+
+        groups = {}
+        for col in self.columns:
+            match = MULTI_CHOICE_ROOT.match(col)
+            if match:
+                groups.setdefault(match.group(1), []).append(col)
+        self.multi_choice = {
+            root: tuple(sorted(subcols, key=lambda x: extract_subcol_number(x, root)))
+            for root, subcols in groups.items() if len(subcols) > 1
+        }
+        self._root_of = {col: root for root, subcols in self.multi_choice.items() for col in subcols}
+        self.single_columns = tuple(col for col in self.columns if col not in self._root_of)
+
+        # === 选项文本 ===
+        # 子列格式：Q7.1.题干:选项，题根之后的部分按第一个冒号拆分为题干与选项
+        self._question_texts = {}
+        self._option_texts = {}
+        self._row_options = {}
+        for root, subcols in self.multi_choice.items():
+            for subcol in subcols:
+                rest = subcol.split(root)[1].strip()
+                self._row_options[subcol] = rest
+                if ':' in rest:
+                    question_text, option_text = rest.split(':', 1)
+                    question_text, option_text = question_text.strip(), option_text.strip()
+                else:
+                    question_text = option_text = rest
+                self._option_texts[subcol] = option_text
+                self._question_texts.setdefault(root, question_text)
+
+    def subcolumns(self, root):
+        """多选题根对应的有序子列，不是多选题时返回空列表"""
+        return list(self.multi_choice.get(root, ()))
+
+    def root_of(self, column):
+        """列所属的多选题根（单选题列返回None）"""
+        return self._root_of.get(column)
+
+    def question_text(self, root):
+        """多选题题干（取第一个子列冒号前的部分）"""
+        return self._question_texts[root]
+
+    def option_text(self, subcol):
+        """多选题子列的选项文本（冒号后的部分，无冒号时为题根之后的全部文本）"""
+        return self._option_texts[subcol]
+
+    def row_option(self, subcol):
+        """多选题子列作为行选项时的标签（题根之后的全部文本）"""
+        return self._row_options[subcol]
+
+
+@lru_cache(maxsize=32)
+def _cached_schema(columns):
+    return SurveySchema(columns)
+
+
+def survey_schema(columns):
+    """按表头签名返回缓存的 SurveySchema"""
+    return _cached_schema(tuple(str(col) for col in columns))
@@ -0,0 +1,232 @@
+"""
+紧凑编码的问卷数据
+- 单选题：int8/int16 选项编码（缺失为-1）+ 有序选项表
+- 多选题：每个样本一组按位打包的 uint64 选中掩码（第j位表示第j个子列被选中）
+  子列取值不全为0/1/空的题组（如矩阵量表题的1-5评分）不打包，各子列按单选题编码
+- 其余列（开放题、权重等）保持原样
+内存占用约为字符串列的几十分之一，计数直接在编码上用 bincount / popcount 完成
+"""
+import numpy as np
+import pandas as pd
+
+from survey_schema import survey_schema
+
+MAX_CATEGORIES = 1000  # 取值数超过该值的列视为开放题/连续变量，不编码
+
+
+def option_sort_order(values):
+    """选项排序下标：按选项开头的数字排序（如 "1.非常满意"），任一选项无法解析时保持原顺序"""
+    numbers = pd.Series([str(v) for v in values], dtype=object).str.extract(r'^(\d+)', expand=False)
+    if numbers.isna().any():
+        return list(range(len(values)))
+    keys = [int(num) for num in numbers]
+    return sorted(range(len(values)), key=keys.__getitem__)
+
+
+# === 位运算计数 ===
+if hasattr(np, 'bitwise_count'):
+    def popcount(values):
+        """逐元素统计置1的位数"""
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        """逐元素统计置1的位数（numpy<2.0时按字节查表）"""
+        values = np.ascontiguousarray(values)
+        counts = _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (values.itemsize,))
+        return counts.sum(axis=-1, dtype=np.uint8)
+
+
+def _code_dtype(n_options):
+    if n_options <= np.iinfo(np.int8).max:
+        return np.int8
+    if n_options <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+
+def is_binary_column(values):
+    """取值只有0/1（及缺失）的列，可按位打包而不丢失信息"""
+    return bool(values.dropna().isin([0, 1]).all())
+
+
+def pack_bits(ticked):
+    """(样本数 × 子列数) 布尔矩阵 -> (样本数 × 字数) uint64掩码"""
+    n_rows, n_cols = ticked.shape
+    n_words = max(-(-n_cols // 64), 1)
+    padded = np.zeros((n_rows, n_words * 64), dtype=bool)
+    padded[:, :n_cols] = ticked
+    return np.packbits(padded, axis=1, bitorder='little').view('<u8')
+
+
+def unpack_bits(masks, n_cols):
+    """pack_bits 的逆运算，返回 (样本数 × 子列数) 布尔矩阵"""
+    bits = np.unpackbits(np.ascontiguousarray(masks).view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :n_cols].astype(bool)
+
+
+class SurveyStore:
+    """
+    紧凑编码的问卷数据集
+    - singles: {题目: (编码数组, 有序选项)}
+    - multis: {多选题根: (掩码数组, 有序子列)}
+    - extra: 未编码的其余列
+    - columns: 原始列顺序（用于识别题目结构）
+    """
+
+    def __init__(self, n_rows, singles, multis, extra, columns):
+        self.n_rows = n_rows
+        self.singles = singles
+        self.multis = multis
+        self.extra = extra
+        self.columns = pd.Index(columns)
+
+    @classmethod
+    def from_dataframe(cls, df, max_categories=MAX_CATEGORIES):
+        """由原始DataFrame编码（列名统一去除首尾空格）"""
+        df = df.rename(columns=lambda col: str(col).strip())
+        schema = survey_schema(df.columns)
+
+        multis, single_columns = {}, list(schema.single_columns)
+        for root, subcols in schema.multi_choice.items():
+            if not all(is_binary_column(df[col]) for col in subcols):
+                single_columns.extend(subcols)  # 矩阵量表题等：打包为选中掩码会丢失评分
+                continue
+            ticked = np.column_stack([(df[col] == 1).to_numpy() for col in subcols])
+            multis[root] = (pack_bits(ticked), list(subcols))
+
+        singles, extra_columns = {}, []
+        for col in single_columns:
+            codes, uniques = pd.factorize(df[col])
+            if len(uniques) > max_categories:
+                extra_columns.append(col)
+                continue
+            order = option_sort_order(uniques)
+            position = np.empty(len(order), dtype=np.int64)
+            position[order] = np.arange(len(order))
+            codes = np.where(codes >= 0, position[codes], -1).astype(_code_dtype(len(order)))
+            singles[col] = (codes, [uniques[i] for i in order])
+
+        return cls(len(df), singles, multis, df[extra_columns].reset_index(drop=True), df.columns)
+
+    @classmethod
+    def concat(cls, stores):
+        """合并多个数据集（如多期问卷），选项表取并集后重新排序"""
+        stores = list(stores)
+        columns = list(dict.fromkeys(col for store in stores for col in store.columns))
+
+        # 某一期中子列按单选题编码的多选题根，合并后统一按单选题编码（打包的子列还原为0/1）
+        store_singles = [dict(store.singles) for store in stores]
+        demoted = {root for store in stores for root in store.multis
+                   if any(root not in other.multis and survey_schema(other.columns).subcolumns(root)
+                          for other in stores)}
+        for store, store_single in zip(stores, store_singles):
+            for root in demoted & set(store.multis):
+                ticked = store.ticked(root)
+                for j, col in enumerate(store.multis[root][1]):
+                    store_single[col] = (ticked[:, j].astype(np.int8), [0, 1])
+
+        singles = {}
+        for q in dict.fromkeys(q for store_single in store_singles for q in store_single):
+            labels = list(dict.fromkeys(
+                label for store_single in store_singles if q in store_single for label in store_single[q][1]
+            ))
+            labels = [labels[i] for i in option_sort_order(labels)]
+            lookup = {label: i for i, label in enumerate(labels)}
+            dtype = _code_dtype(len(labels))
+            parts = []
+            for store, store_single in zip(stores, store_singles):
+                if q not in store_single:
+                    parts.append(np.full(store.n_rows, -1, dtype=dtype))
+                    continue
+                codes, old_labels = store_single[q]
+                remap = np.array([lookup[label] for label in old_labels] + [-1], dtype=dtype)
+                parts.append(remap[codes])  # 编码-1对应remap最后一项
+            singles[q] = (np.concatenate(parts), labels)
+
+        multis = {}
+        for root in dict.fromkeys(root for store in stores for root in store.multis if root not in demoted):
+            subcols = survey_schema(columns).subcolumns(root)
+            parts = []
+            for store in stores:
+                ticked = np.zeros((store.n_rows, len(subcols)), dtype=bool)
+                if root in store.multis:
+                    masks, old_subcols = store.multis[root]
+                    ticked[:, [subcols.index(col) for col in old_subcols]] = unpack_bits(masks, len(old_subcols))
+                parts.append(pack_bits(ticked))
+            multis[root] = (np.concatenate(parts), subcols)
+
+        extra = pd.concat([store.extra for store in stores], ignore_index=True)
+        return cls(sum(store.n_rows for store in stores), singles, multis, extra, columns)
+
+    @property
+    def nbytes(self):
+        """编码数据占用的字节数（不含未编码列）"""
+        return (sum(codes.nbytes for codes, _ in self.singles.values())
+                + sum(masks.nbytes for masks, _ in self.multis.values()))
+
+    # === 访问 ===
+    def options(self, question):
+        return self.singles[question][1]
+
+    def codes(self, question):
+        return self.singles[question][0]
+
+    def subcolumns(self, root):
+        return self.multis[root][1]
+
+    def ticked(self, root):
+        """多选题各子列是否选中，(样本数 × 子列数) 布尔矩阵"""
+        masks, subcols = self.multis[root]
+        return unpack_bits(masks, len(subcols))
+
+    def column(self, name):
+        """解码单列：单选题返回Categorical，多选题子列返回0/1，其余列原样返回"""
+        if name in self.singles:
+            codes, labels = self.singles[name]
+            return pd.Series(pd.Categorical.from_codes(codes, categories=pd.Index(labels, dtype=object)), name=name)
+        if name in self.extra.columns:
+            return self.extra[name]
+        root = survey_schema(self.columns).root_of(name)
+        if root in self.multis:
+            j = self.multis[root][1].index(name)
+            return pd.Series(self.ticked(root)[:, j].astype(np.int8), name=name)
+        raise KeyError(name)
+
+    def to_dataframe(self):
+        """还原为DataFrame（单选题为Categorical列）"""
+        return pd.DataFrame({col: self.column(col) for col in self.columns})
+
+    # === 计数 ===
+    def value_counts(self, question, weights=None):
+        """单选题各选项的样本数（加权时为加权样本数）"""
+        codes, labels = self.singles[question]
+        answered = codes >= 0
+        return np.bincount(codes[answered], weights=None if weights is None else weights[answered],
+                           minlength=len(labels))
+
+    def crosstab(self, row_question, col_question, weights=None):
+        """两个单选题的交叉频数，形状 (行选项数, 列选项数)"""
+        row_codes, row_labels = self.singles[row_question]
+        col_codes, col_labels = self.singles[col_question]
+        answered = (row_codes >= 0) & (col_codes >= 0)
+        joint = row_codes[answered].astype(np.int64) * len(col_labels) + col_codes[answered]
+        counts = np.bincount(joint, weights=None if weights is None else weights[answered],
+                             minlength=len(row_labels) * len(col_labels))
+        return counts.reshape(len(row_labels), len(col_labels))
+
+    def option_counts(self, root, weights=None):
+        """多选题各子列的选中数"""
+        ticked = self.ticked(root)
+        if weights is None:
+            return ticked.sum(axis=0)
+        return weights @ ticked
+
+    def selection_counts(self, root):
+        """每个样本在多选题中选中的选项数（popcount）"""
+        return popcount(self.multis[root][0]).sum(axis=1)
+
+    def answered(self, root):
+        """多选题至少选中一项的样本"""
+        return self.multis[root][0].any(axis=1)
@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(TESTS_DIR, "data")
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+
+def data_path(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def _frame_keys(df):
+    return [list(key) if isinstance(key, tuple) else key for key in df.index]
+
+
+def assert_frame_matches(actual, expected, rtol=1e-9):
+    """与 baseline.json 中保存的表格比较：索引、列名一致，数值在容差内相等"""
+    assert _frame_keys(actual) == expected["index"]
+    assert list(actual.columns) == expected["columns"]
+    want = pd.DataFrame(expected["data"], columns=expected["columns"])
+    for j, col in enumerate(expected["columns"]):
+        got = actual.iloc[:, j].to_numpy()
+        exp = want[col].to_numpy()
+        if pd.api.types.is_numeric_dtype(want[col]):
+            np.testing.assert_allclose(got.astype(float), exp.astype(float), rtol=rtol, equal_nan=True,
+                                       err_msg=str(col))
+        else:
+            assert ["" if pd.isna(v) else v for v in got] == ["" if pd.isna(v) else v for v in exp], col
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    with open(data_path("baseline.json"), encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+@pytest.fixture(scope="session")
+def survey_xlsx():
+    return data_path("survey.xlsx")
+
+
+@pytest.fixture(scope="session")
+def survey_csv():
+    return data_path("survey.csv")
+
+
+@pytest.fixture(scope="session")
+def survey_gbk_csv():
+    return data_path("survey_gbk.csv")
+
+
+@pytest.fixture
+def survey_df(survey_xlsx):
+    return pd.read_excel(survey_xlsx)
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _isolated_cache(tmp_path_factory):
+    """文件解析缓存写入临时目录，不影响本机的缓存"""
+    import survey_cache
+    cache_dir = str(tmp_path_factory.mktemp("cache"))
+    original = survey_cache.DEFAULT_CACHE_DIR
+    survey_cache.DEFAULT_CACHE_DIR = cache_dir
+    yield cache_dir
+    survey_cache.DEFAULT_CACHE_DIR = original
@@ -0,0 +1,99 @@
+"""
+生成测试用的问卷数据与基线结果
+- survey.xlsx / survey.csv：固定随机种子生成的小样本问卷（单选题、0/1多选题、1/空多选题、权重、开放题）
+- survey_gbk.csv：同一份数据的GBK编码csv（常见的中文Excel导出格式）
+- baseline.json：初始版本（仓库第一个提交）的 process_crosstab 在 survey.xlsx 上的输出，
+  作为各执行路径（DataFrame、文件、分块读取、SurveyStore、并行、增量）结果一致性的基准
+
+用法（在仓库根目录）：
+    python tests/data/make_fixtures.py            # 默认使用第一个提交中的 cross_analysis.py
+    python tests/data/make_fixtures.py <提交>
+"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(DATA_DIR))
+
+# 基线配置：(行问题, 列问题)
+BASELINE_CONFIGS = [
+    (['满意度', 'Q7.', '年龄'], ['性别', '平台', 'Q9.']),
+    (['Q9.', '稀有'], ['年龄', '满意度', '性别']),
+    (['性别', 'Q5.单列'], ['Q7.', '性别', '稀有']),
+]
+
+
+def make_survey(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {
+        '性别': rng.choice(['1.男', '2.女'], n),
+        '年龄': rng.choice(['1.18岁以下', '2.18-24', '3.25-30', '4.30以上', None], n, p=[.1, .3, .3, .2, .1]),
+        '满意度': rng.choice(['5.非常满意', '4.满意', '3.一般', '2.不满意', '1.非常不满意'], n),
+        '平台': rng.choice(['Android', 'iOS', 'PC'], n),
+        '稀有': rng.choice(['a', 'b', 'c'], n, p=[.97, .02, .01]),
+    }
+    for i, rate in enumerate([.5, .2, .05, .01, .3, .002], 1):
+        data[f'Q7.{i}.你喜欢哪些玩法:选项{i}'] = (rng.random(n) < rate).astype(int)
+    for i in range(1, 4):
+        data[f'Q9.{i}.渠道:渠道{i}'] = np.where(rng.random(n) < .3, 1, np.nan)
+    data['Q5.单列'] = rng.choice(['x', 'y'], n)
+    data['权重'] = rng.uniform(0.5, 2.0, n).round(3)
+    data['评论'] = rng.choice(['很好玩，但是卡顿', '服务器不错', '闪退严重。', '模组很多，非常好玩'], n)
+    return pd.DataFrame(data)
+
+
+def frame_to_json(df):
+    return {
+        'index': [list(key) if isinstance(key, tuple) else key for key in df.index],
+        'columns': list(df.columns),
+        'data': df.to_numpy(dtype=object).tolist(),
+    }
+
+
+def baseline_module(revision):
+    source = subprocess.run(['git', 'show', f'{revision}:cross_analysis.py'], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    path = os.path.join(tempfile.mkdtemp(), 'baseline_cross_analysis.py')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location('baseline_cross_analysis', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    revision = argv[0] if argv else subprocess.run(
+        ['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    ).stdout.split()[0]
+
+    df = make_survey()
+    df.to_excel(os.path.join(DATA_DIR, 'survey.xlsx'), index=False)
+    df.to_csv(os.path.join(DATA_DIR, 'survey.csv'), index=False, encoding='utf-8')
+    df.to_csv(os.path.join(DATA_DIR, 'survey_gbk.csv'), index=False, encoding='gbk')
+
+    warnings.filterwarnings('ignore')
+    baseline = baseline_module(revision)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows, cols in BASELINE_CONFIGS:
+            combined, sig = baseline.process_crosstab(os.path.join(DATA_DIR, 'survey.xlsx'),
+                                                      os.path.join(tmp, 'out.xlsx'), rows, cols)
+            results.append({'rows': rows, 'cols': cols,
+                            'combined': frame_to_json(combined), 'sig': frame_to_json(sig)})
+    with open(os.path.join(DATA_DIR, 'baseline.json'), 'w', encoding='utf-8') as f:
+        json.dump({'revision': revision[:7], 'results': results}, f, ensure_ascii=False)
+    print(f"已生成测试数据与基线结果（基线提交 {revision[:7]}）")
+
+
+if __name__ == '__main__':
+    main()
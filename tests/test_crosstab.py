@@ -0,0 +1,295 @@
+"""交叉分析各执行路径与初始版本输出（baseline.json）一致"""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cross_analysis as ca
+from conftest import assert_frame_matches
+from survey_store import SurveyStore
+
+CONFIG_IDS = ["single-multi", "multi-rare", "multi-cols"]
+
+
+def check_baseline(expected, combined, sig):
+    assert_frame_matches(combined, expected["combined"])
+    assert_frame_matches(sig, expected["sig"])
+
+
+@pytest.fixture(params=range(3), ids=CONFIG_IDS)
+def case(request, baseline):
+    return baseline[request.param]
+
+
+def test_dataframe_matches_baseline(case, survey_df):
+    check_baseline(case, *ca.process_crosstab(survey_df, None, case["rows"], case["cols"]))
+
+
+@pytest.mark.parametrize("source", ["survey_xlsx", "survey_csv", "survey_gbk_csv"])
+def test_file_matches_baseline(case, source, request, tmp_path):
+    path = request.getfixturevalue(source)
+    output = tmp_path / "out.xlsx"
+    check_baseline(case, *ca.process_crosstab(path, str(output), case["rows"], case["cols"]))
+    assert list(pd.read_excel(output, sheet_name=None))[:3] == ["交叉分析", "显著性检验", "带星号显著性"]
+
+
+@pytest.mark.parametrize("source", ["survey_xlsx", "survey_csv", "survey_gbk_csv"])
+def test_streaming_matches_baseline(case, source, request):
+    path = request.getfixturevalue(source)
+    check_baseline(case, *ca.process_crosstab(path, None, case["rows"], case["cols"], chunk_size=64))
+
+
+def test_explicit_encoding(survey_gbk_csv):
+    expected = ca.process_crosstab(survey_gbk_csv, None, ["满意度"], ["性别"])
+    for kwargs in [{}, {"chunk_size": 64}, {"memory_budget": 64 * 1024}]:
+        actual = ca.process_crosstab(survey_gbk_csv, None, ["满意度"], ["性别"], encoding="gbk", **kwargs)
+        pd.testing.assert_frame_equal(actual[0], expected[0])
+    with pytest.raises(Exception):
+        ca.process_crosstab(survey_gbk_csv, None, ["满意度"], ["性别"], encoding="utf-8", chunk_size=64)
+
+
+def test_no_output_skips_writing(survey_df, tmp_path):
+    events = []
+    ca.process_crosstab(survey_df, None, ["满意度"], ["性别"], progress_callback=events.append)
+    ca.process_crosstab_book(survey_df, None, tables=[(["满意度"], ["性别"])], progress_callback=events.append)
+    assert events and not any(e["stage"] == "write" for e in events)
+    ca.process_crosstab(survey_df, str(tmp_path / "out.xlsx"), ["满意度"], ["性别"], progress_callback=events.append)
+    assert any(e["stage"] == "write" for e in events)
+
+
+def test_detect_csv_encoding(survey_csv, survey_gbk_csv, survey_xlsx):
+    assert ca.detect_csv_encoding(survey_csv) == "utf-8"
+    assert ca.detect_csv_encoding(survey_gbk_csv) == "gbk"
+    assert ca.detect_csv_encoding(survey_gbk_csv, "gb18030") == "gb18030"
+    assert ca.detect_csv_encoding(survey_xlsx) is None
+    # 多字节字符跨越分块边界时不误判
+    assert ca.detect_csv_encoding(survey_csv, block_size=7) == "utf-8"
+
+
+@pytest.mark.parametrize("strategy", ["dense", "sparse", "chunked"])
+def test_strategies_match_baseline(case, survey_df, strategy):
+    check_baseline(case, *ca.process_crosstab(survey_df, None, case["rows"], case["cols"], strategy=strategy))
+
+
+@pytest.mark.parametrize("source", ["survey_csv", "survey_gbk_csv"])
+def test_memory_budget_streams_file(case, source, request):
+    events = []
+    result = ca.process_crosstab(request.getfixturevalue(source), None, case["rows"], case["cols"],
+                                 memory_budget=64 * 1024, progress_callback=events.append)
+    check_baseline(case, *result)
+    plan = next(e["plan"] for e in events if e["stage"] == "counting" and e["status"] == "end")
+    assert plan.strategy == "chunked"
+
+
+def test_survey_store_matches_baseline(case, survey_df):
+    store = SurveyStore.from_dataframe(survey_df)
+    check_baseline(case, *ca.process_crosstab(store, None, case["rows"], case["cols"]))
+
+
+def test_survey_store_concat_matches_baseline(case, survey_df):
+    store = SurveyStore.concat([SurveyStore.from_dataframe(survey_df.iloc[:120]),
+                                SurveyStore.from_dataframe(survey_df.iloc[120:].reset_index(drop=True))])
+    check_baseline(case, *ca.process_crosstab(store, None, case["rows"], case["cols"]))
+
+
+def add_rating_grid(df, seed=1):
+    """矩阵量表题：Q3 各子列为1-5评分（含缺失），不是0/1多选题"""
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    for i in range(1, 4):
+        df[f"Q3.{i}.评分:项目{i}"] = np.where(rng.random(len(df)) < .1, np.nan, rng.integers(1, 6, len(df)))
+    return df
+
+
+def test_survey_store_keeps_rating_grid(survey_df):
+    df = add_rating_grid(survey_df)
+    store = SurveyStore.from_dataframe(df)
+    assert "Q3." not in store.multis and "Q7." in store.multis
+    column = "Q3.1.评分:项目1"
+    np.testing.assert_array_equal(np.asarray(store.column(column), dtype=float), df[column].to_numpy())
+
+    rows, cols, expr = ["Q3.", "满意度"], ["性别", "Q7."], "`Q3.1.评分:项目1` >= 4"
+    expected = ca.process_crosstab(df, None, rows, cols, filter_expr=expr)
+    actual = ca.process_crosstab(store, None, rows, cols, filter_expr=expr)
+    pd.testing.assert_frame_equal(actual[0], expected[0])
+    pd.testing.assert_frame_equal(actual[1], expected[1])
+
+
+def test_survey_store_concat_mixed_grid(survey_df):
+    # 第一期评分恰好只有0/1（按位打包），第二期为1-5评分（按单选题编码）
+    first = survey_df.iloc[:120].copy()
+    for i in range(1, 4):
+        first[f"Q3.{i}.评分:项目{i}"] = (np.arange(len(first)) % (i + 1) == 0).astype(int)
+    second = add_rating_grid(survey_df.iloc[120:].reset_index(drop=True))
+    stores = [SurveyStore.from_dataframe(first), SurveyStore.from_dataframe(second)]
+    assert "Q3." in stores[0].multis and "Q3." not in stores[1].multis
+    store = SurveyStore.concat(stores)
+    assert "Q3." not in store.multis
+
+    df = pd.concat([first, second], ignore_index=True)
+    rows, cols, expr = ["Q3."], ["性别"], "`Q3.2.评分:项目2` >= 1"
+    expected = ca.process_crosstab(df, None, rows, cols, filter_expr=expr)
+    actual = ca.process_crosstab(store, None, rows, cols, filter_expr=expr)
+    pd.testing.assert_frame_equal(actual[0], expected[0])
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_book_matches_baseline(baseline, survey_df, workers):
+    tables = [{"name": f"表{i}", "rows": case["rows"], "cols": case["cols"]} for i, case in enumerate(baseline)]
+    results = ca.process_crosstab_book(survey_df, None, tables=tables, workers=workers)
+    assert [name for name, _, _ in results] == [spec["name"] for spec in tables]
+    for case, (_, combined, sig) in zip(baseline, results):
+        check_baseline(case, combined, sig)
+
+
+@pytest.mark.parametrize("engine, constant_memory",
+                         [("xlsxwriter", False), ("xlsxwriter", True), ("openpyxl", False)])
+def test_book_contents_links(baseline, survey_df, tmp_path, engine, constant_memory):
+    pytest.importorskip(engine)
+    from openpyxl import load_workbook
+
+    output = tmp_path / "book.xlsx"
+    tables = [{"name": f"表{i}", "rows": case["rows"], "cols": case["cols"]} for i, case in enumerate(baseline)]
+    ca.process_crosstab_book(survey_df, str(output), tables=tables, engine=engine, constant_memory=constant_memory)
+    workbook = load_workbook(output)
+    contents = workbook["目录"]
+    header = [cell.value for cell in contents[1]]
+    for column in ca.CONTENTS_LINK_COLUMNS:
+        j = header.index(column) + 1
+        for row in range(2, len(tables) + 2):
+            cell = contents.cell(row, j)
+            assert cell.hyperlink is not None, (column, row)
+            assert cell.value in workbook.sheetnames
+            # xlsxwriter写为内部位置，openpyxl写为 "#sheet!A1" 目标
+            assert (cell.hyperlink.location or cell.hyperlink.target).lstrip("#") == f"'{cell.value}'!A1"
+
+
+def test_significance_sheet_style_matches_across_engines(survey_df):
+    pytest.importorskip("xlsxwriter")
+    from openpyxl import load_workbook
+
+    def styles(engine):
+        output = io.BytesIO()
+        ca.process_crosstab(survey_df, output, ["满意度", "Q7."], ["性别"], engine=engine)
+        sheet = load_workbook(output)["显著性检验"]
+        return [[(cell.alignment.horizontal, cell.alignment.vertical, bool(cell.alignment.wrap_text),
+                  cell.font.b, cell.border.left.style, cell.number_format) for cell in row]
+                for row in sheet.iter_rows()]
+
+    openpyxl_styles = styles("openpyxl")
+    assert styles("xlsxwriter") == openpyxl_styles
+    assert openpyxl_styles[0][0][:3] == ("center", "top", True)  # 标题行
+    assert openpyxl_styles[1][0][:3] == ("center", "top", True)  # 索引列
+
+
+def test_incremental_update_matches_baseline(case, survey_df, tmp_path):
+    state = ca.CrosstabState.build(survey_df.iloc[:100], case["rows"], case["cols"])
+    path = tmp_path / "state.pkl"
+    state.save(path)
+    state = ca.CrosstabState.load(path)
+    state.update(survey_df.iloc[100:200].reset_index(drop=True))
+    state.update(survey_df.iloc[200:].reset_index(drop=True))
+    assert state.n_rows == len(survey_df)
+    check_baseline(case, *state.write_report(io.BytesIO()))
+
+
+def test_incremental_update_rejects_new_option(survey_df):
+    state = ca.CrosstabState.build(survey_df, ["满意度"], ["性别"])
+    new_data = survey_df.iloc[:5].copy()
+    new_data["满意度"] = "6.新选项"
+    with pytest.raises(ca.SchemaChangedError):
+        state.update(new_data)
+
+
+T2B_RULES = [{"new_col": "满意T2B", "source_col": "满意度", "method": "combine",
+              "config": {"groups": {"满意": ["5.非常满意", "4.满意"], "不满意": ["1.非常不满意", "2.不满意"]}}}]
+
+
+def test_incremental_update_with_recodes(survey_df):
+    # 新批次缺少部分原选项时，派生变量仍按状态中的选项对齐
+    state = ca.CrosstabState.build(survey_df.iloc[:200], ["满意T2B", "年龄"], ["性别"], recode_rules=T2B_RULES)
+    rest = survey_df.iloc[200:]
+    batch = rest[rest["满意度"].isin(["5.非常满意", "3.一般"])].reset_index(drop=True)
+    state.update(batch)
+    expected = ca.process_crosstab(pd.concat([survey_df.iloc[:200], batch], ignore_index=True), None,
+                                   ["满意T2B", "年龄"], ["性别"], recode_rules=T2B_RULES)
+    actual = state.tables()
+    pd.testing.assert_frame_equal(actual["combined"], expected[0])
+    pd.testing.assert_frame_equal(actual["sig"], expected[1])
+
+
+def test_incremental_update_rejects_new_derived_label(survey_df):
+    state = ca.CrosstabState.build(survey_df, ["满意T2B"], ["性别"], recode_rules=T2B_RULES)
+    new_data = survey_df.iloc[:5].copy()
+    new_data["满意度"] = "6.新选项"  # 未分组的选项保留原值，成为派生变量的新选项
+    with pytest.raises(ca.SchemaChangedError):
+        state.update(new_data)
+
+
+def test_incremental_state_rejects_old_version(survey_df, tmp_path, monkeypatch):
+    path = tmp_path / "state.pkl"
+    monkeypatch.setattr(ca.CrosstabState, "VERSION", ca.CrosstabState.VERSION - 1)
+    ca.CrosstabState.build(survey_df, ["满意度"], ["性别"]).save(path)
+    monkeypatch.undo()
+    with pytest.raises(ca.SchemaChangedError):
+        ca.CrosstabState.load(path)
+
+
+def test_filter_matches_subset(survey_df):
+    expected = ca.process_crosstab(survey_df[survey_df["平台"] == "Android"].reset_index(drop=True), None,
+                                   ["满意度", "Q7."], ["性别", "Q9."])
+    actual = ca.process_crosstab(survey_df, None, ["满意度", "Q7."], ["性别", "Q9."],
+                                 filter_expr="平台 == 'Android'")
+    pd.testing.assert_frame_equal(actual[0], expected[0])
+    pd.testing.assert_frame_equal(actual[1], expected[1])
+
+
+# === 加权 ===
+def weighted_table(df, row, col, weights):
+    return pd.crosstab(df[row], df[col], values=weights, aggfunc="sum").fillna(0)
+
+
+def test_weighted_counts(survey_df):
+    combined, _ = ca.process_crosstab(survey_df, None, ["满意度"], ["性别"], weight_column="权重")
+    expected = weighted_table(survey_df, "满意度", "性别", survey_df["权重"])
+    for gender in expected.columns:
+        freq = combined.loc["满意度", f"性别 #1\n{gender}（频数）"].drop("总计")
+        np.testing.assert_allclose(freq.to_numpy(dtype=float), expected[gender].to_numpy(), atol=0.01)
+
+
+def test_rake_weights_hit_targets(survey_df):
+    margins = {
+        "性别": {"1.男": 0.5, "2.女": 0.5},
+        "平台": {"Android": 60, "iOS": 30, "PC": 10},
+    }
+    weights = ca.rake_weights(survey_df, margins)
+    for question, targets in margins.items():
+        shares = pd.Series(weights).groupby(survey_df[question].to_numpy()).sum()
+        shares /= shares.sum()
+        total = sum(targets.values())
+        for option, target in targets.items():
+            assert shares[option] == pytest.approx(target / total, abs=1e-5)
+
+
+def test_rake_weights_from_index_match_dataframe(survey_df):
+    margins = {"性别": {"1.男": 0.4, "2.女": 0.6}, "年龄": {"1.18岁以下": 1, "2.18-24": 1, "3.25-30": 1}}
+    expected = ca.rake_weights(survey_df, margins)
+    np.testing.assert_allclose(ca.SurveyIndex(survey_df).weights(rake_margins=margins), expected)
+    store_index = ca.SurveyIndex(SurveyStore.from_dataframe(survey_df))
+    np.testing.assert_allclose(store_index.weights(rake_margins=margins), expected)
+
+
+# === 显著性检验 ===
+def test_batch_significance_matches_single_tests():
+    tables = [(0, 0, 0, 0), (3, 0, 0, 5), (10, 20, 30, 40), (0, 0, 4, 9), (50, 60, 70, 80)]
+    p_values = ca.batch_significance_test(*np.array(tables).T)
+    expected = [ca.perform_significance_test(np.array([[a, b], [c, d]])) for a, b, c, d in tables]
+    np.testing.assert_allclose(p_values, expected)
+    assert p_values[0] == 1.0
+
+
+def test_empty_filter_subset_has_no_missing_p_values(survey_df):
+    _, sig = ca.process_crosstab(survey_df, None, ["满意度"], ["性别"], filter_expr="平台 == '不存在'")
+    assert not sig.isna().any().any()
+    assert (sig == 1.0).all().all()
@@ -0,0 +1,63 @@
+"""重新编码：表达式按完整名称引用列，派生变量不会误引用自身"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import cross_analysis as ca
+import recode
+
+
+def expr_rule(name, conditions, default="否"):
+    return {"new_col": name, "method": "expr", "config": {"conditions": conditions, "default": default}}
+
+
+def test_expression_names():
+    names = recode.expression_names("满意度 == '5.非常满意' and `Q7.1.玩法:选项1` == 1")
+    assert names - {"and"} == {"满意度", "Q7.1.玩法:选项1"}
+    # 字符串常量中的文字不是列名
+    assert recode.expression_names('平台 == "iOS 满意"') == {"平台"}
+
+
+def test_derived_name_prefix_of_column(survey_df):
+    # 派生变量名“满意”是列名“满意度”的前缀，不应被当作表达式引用的列
+    rules = [expr_rule("满意", [["满意度 == '5.非常满意'", "是"]])]
+    index = ca.SurveyIndex(survey_df)
+    index.define_recodes(rules)
+    assert recode.expression_columns(index, "满意度 == '5.非常满意'") == ["满意度"]
+
+    combined, _ = ca.process_crosstab(survey_df, None, ["满意"], ["性别"], recode_rules=rules)
+    expected = (survey_df["满意度"] == "5.非常满意").sum()
+    assert combined.loc[("满意", "是"), "性别 #1\n总计（频数）"] == expected
+
+
+def test_column_name_prefix_of_derived(survey_df):
+    # 反过来：派生变量“平台分组”引用的列“平台”是其名称的前缀
+    rules = [expr_rule("平台分组", [["平台 == 'PC'", "电脑"]], default="移动")]
+    index = ca.SurveyIndex(survey_df)
+    index.define_recodes(rules)
+    assert index.options("平台分组") == ["电脑", "移动"]
+    np.testing.assert_array_equal(index.option_codes("平台分组"), np.where(survey_df["平台"] == "PC", 0, 1))
+
+
+def test_self_reference_raises(survey_df):
+    index = ca.SurveyIndex(survey_df)
+    index.define_recodes([expr_rule("高满意", [["高满意 == '是' or 满意度 == '5.非常满意'", "是"]])])
+    with pytest.raises(ValueError, match="引用了自身"):
+        index.options("高满意")
+
+
+def test_cyclic_rules_raise(survey_df):
+    index = ca.SurveyIndex(survey_df)
+    index.define_recodes([
+        expr_rule("甲", [["乙 == '是'", "是"]]),
+        expr_rule("乙", [["甲 == '是'", "是"]]),
+    ])
+    with pytest.raises(ValueError, match="循环引用"):
+        index.options("甲")
+
+
+def test_filter_on_column_prefix(survey_df):
+    # 筛选条件只取被完整引用的列
+    df = survey_df.assign(满意=pd.Series(["x"] * len(survey_df)))
+    mask = recode.evaluate_expression(ca.SurveyIndex(df), "满意度 == '4.满意'")
+    np.testing.assert_array_equal(mask, (df["满意度"] == "4.满意").to_numpy())
@@ -0,0 +1,96 @@
+"""标签匹配：编译后的 KeywordMatcher 与初始版本的逐词查找结果一致"""
+import random
+import re
+
+import pytest
+
+import text_analysis as ta
+
+# 初始版本只按字面查找关键词，含正则语法的词条不参与比较
+LITERAL_KEYWORDS = {tag: [kw for kw in keywords if not ta._PATTERN_CHARS.search(kw)]
+                    for tag, keywords in ta.DEFAULT_TAG_KEYWORDS.items()}
+
+TEXTS = [
+    "生存模式很好玩，喜欢和好友联机",
+    "服务器经常掉线。加载慢！",
+    "不需要更多付费内容，皮肤太贵了",
+    "其实探索地图也不错；魔法指令很多",
+    "画面很精致\n没有遇到卡顿",
+    "希望多出一些模组,光影效果很棒",
+    "1.20版本的考古系统挺新鲜",
+    "",
+]
+
+
+def reference_tagging(text, tag_keywords, negation_words, max_context=3):
+    """初始版本的 manual_tagging（返回集合）"""
+    matched_tags, matched_keywords = set(), set()
+    for sent in re.split(r'[,.，。！？；\n]', text):
+        sent = sent.strip()
+        if not sent or any(nw in sent for nw in negation_words):
+            continue
+        for tag, keywords in tag_keywords.items():
+            for kw in keywords:
+                pos = sent.find(kw)
+                if pos == -1:
+                    continue
+                context = sent[max(0, pos - max_context):pos + len(kw) + max_context]
+                if not any(nw in context for nw in negation_words):
+                    matched_tags.add(tag)
+                    matched_keywords.add(kw)
+    return matched_tags, matched_keywords
+
+
+def split(joined):
+    return set(joined.split(", ")) - {""}
+
+
+@pytest.fixture(params=["pyahocorasick", "python"])
+def automaton_backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(ta, "ahocorasick", None)
+    elif ta.ahocorasick is None:
+        pytest.skip("未安装 pyahocorasick")
+    ta._cached_matcher.cache_clear()
+    yield request.param
+    ta._cached_matcher.cache_clear()
+
+
+def random_texts(n=3000, seed=0):
+    rng = random.Random(seed)
+    alphabet = sorted(set("".join(kw for kws in LITERAL_KEYWORDS.values() for kw in kws)
+                          + "".join(ta.DEFAULT_NEGATION_WORDS) + "，。 好玩"))
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 30))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("negation_words", [ta.BASIC_NEGATION_WORDS, ta.DEFAULT_NEGATION_WORDS],
+                         ids=["basic", "default"])
+def test_matches_reference(automaton_backend, negation_words):
+    for text in TEXTS + random_texts():
+        tags, keywords = ta.manual_tagging(text, LITERAL_KEYWORDS, negation_words)
+        assert (split(tags), split(keywords)) == reference_tagging(text, LITERAL_KEYWORDS, negation_words), text
+
+
+def test_tag_texts_matches_manual_tagging(automaton_backend):
+    texts = TEXTS + random_texts(500)
+    tags, keywords = ta.tag_texts(texts, ta.DEFAULT_TAG_KEYWORDS, ta.DEFAULT_NEGATION_WORDS)
+    assert list(zip(tags, keywords)) == [
+        ta.manual_tagging(text, ta.DEFAULT_TAG_KEYWORDS, ta.DEFAULT_NEGATION_WORDS) for text in texts
+    ]
+
+
+def test_regex_keywords(automaton_backend):
+    assert ta.manual_tagging("超级好玩，生存模式", ta.DEFAULT_TAG_KEYWORDS) == ("核心玩法", "超级好玩, 生存")
+    # 句中有否定词时正则关键词同样不匹配
+    assert ta.manual_tagging("非常好玩但是卡顿", ta.DEFAULT_TAG_KEYWORDS, ta.DEFAULT_NEGATION_WORDS) == ("", "")
+
+
+def test_output_order_is_deterministic(automaton_backend):
+    # 标签按词典顺序，关键词按在文本中出现的顺序
+    assert ta.manual_tagging("魔法指令很多", ta.DEFAULT_TAG_KEYWORDS) == (
+        "核心玩法, 版本特性, 模组组件", "魔法, 魔法指令, 指令"
+    )
+
+
+def test_empty_keywords_are_ignored():
+    assert ta.manual_tagging("什么都好", {"标签": ["", "好玩"]}) == ("", "")
@@ -1,24 +1,125 @@
+import hashlib
 import os
-os.environ["LOKY_PICKLER"] = "pickle"
-os.environ["JOBLIB_START_METHOD"] = "loky"
+import pickle
+import tempfile
+import threading
 import pandas as pd
-import jieba
 import re
 import warnings
-from collections import Counter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
+from collections import Counter, deque
+from functools import lru_cache
 import numpy as np
+from survey_cache import load_cached_survey, DEFAULT_CACHE_DIR
+from instrumentation import WORDCLOUD_STAGES, CLUSTERING_STAGES, instrumentation
+
+try:
+    import ahocorasick
+except ImportError:  # 未安装 pyahocorasick 时使用纯Python实现的自动机
+    ahocorasick = None
 
 warnings.filterwarnings("ignore", category=UserWarning, module="joblib")
 
+# jieba、sklearn、wordcloud、matplotlib 导入耗时较长，在首次用到的函数内导入，
+# 只做交叉分析或标签匹配时不加载
+
+# ================== 分词器 ==================
+# 文本模块共用一个jieba分词器：主词典与用户词典（标签关键词中的领域词）构建后整体缓存到磁盘，
+# 之后每个进程直接加载缓存，无需重新构建前缀词典；fork 出的子进程继承父进程中已加载的分词器
+TOKENIZER_CACHE_DIR = os.environ.get("SURVEY_TOKENIZER_CACHE_DIR", DEFAULT_CACHE_DIR)
+TOKENIZER_CACHE_VERSION = "1"
+# 含这些字符的关键词是正则表达式或短语，不作为用户词
+_NON_WORD_CHARS = re.compile(r'[\s\\()\[\]{}|?*+^$]')
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def domain_words(tag_keywords=None):
+    """标签关键词中的字面词语（去重、保持顺序），作为分词的用户词典"""
+    tag_keywords = DEFAULT_TAG_KEYWORDS if tag_keywords is None else tag_keywords
+    words = (kw for keywords in tag_keywords.values() for kw in keywords)
+    return list(dict.fromkeys(w for w in words if len(w) > 1 and not _NON_WORD_CHARS.search(w)))
+
+
+def _tokenizer_cache_path(jieba, user_words, cache_dir):
+    dictionary = os.path.join(os.path.dirname(jieba.__file__), jieba.DEFAULT_DICT_NAME)
+    stat = os.stat(dictionary)
+    key = hashlib.sha256("\n".join(
+        [TOKENIZER_CACHE_VERSION, jieba.__version__, dictionary, str(stat.st_size), str(stat.st_mtime_ns)]
+        + sorted(user_words)
+    ).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"tokenizer-{key}.jieba")
+
+
+def _build_tokenizer(jieba, user_words, cache_path):
+    """构建前缀词典并加入用户词，写入磁盘缓存（原子写入，多进程同时构建也不会读到半个文件）"""
+    tokenizer = jieba.Tokenizer()
+    tokenizer.initialize()
+    for word in user_words:
+        tokenizer.add_word(word)
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((tokenizer.FREQ, tokenizer.total), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        warnings.warn(f"写入分词器缓存失败，本次不使用缓存：{e}")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return tokenizer
+
+
+def get_tokenizer(user_words=None, cache_dir=None):
+    """
+    文本模块共用的jieba分词器（同一进程只加载一次）
+    - user_words: 用户词典，默认为 DEFAULT_TAG_KEYWORDS 中的领域词；只在首次加载时生效
+    - cache_dir: 磁盘缓存目录（默认同问卷文件缓存，可用环境变量 SURVEY_TOKENIZER_CACHE_DIR 修改）
+    """
+    global _tokenizer
+    if _tokenizer is not None:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is not None:
+            return _tokenizer
+        import jieba
+        user_words = domain_words() if user_words is None else list(user_words)
+        cache_path = _tokenizer_cache_path(jieba, user_words, cache_dir or TOKENIZER_CACHE_DIR)
+        tokenizer = None
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    freq, total = pickle.load(f)
+                tokenizer = jieba.Tokenizer()
+                tokenizer.FREQ, tokenizer.total = freq, total
+                tokenizer.initialized = True
+            except Exception as e:
+                warnings.warn(f"分词器缓存损坏，重新构建：{e}")
+                tokenizer = None
+        if tokenizer is None:
+            tokenizer = _build_tokenizer(jieba, user_words, cache_path)
+        _tokenizer = tokenizer
+    return _tokenizer
+
+
+def preload_tokenizer(background=True):
+    """预热分词器（如应用启动时调用），background=True 时在后台线程加载，不阻塞启动"""
+    if _tokenizer is not None:
+        return None
+    if not background:
+        return get_tokenizer()
+    thread = threading.Thread(target=get_tokenizer, name="preload-tokenizer", daemon=True)
+    thread.start()
+    return thread
+
 # ================== 功能模块 ==================
 
 # 1. 变量识别模块
 def load_data(file_path, text_var, other_vars):
-    df = pd.read_excel(file_path)
+    # 按文件内容缓存解析结果，同一文件再次读取时无需重新解析xlsx
+    df = load_cached_survey(file_path, pd.read_excel, kind='excel')
     return df[[text_var] + other_vars].copy()
 
 # 2. 文本清洗模块
@@ -28,75 +129,200 @@ def clean_text(df, text_var, invalid_words=['无', ' ']):
     return df[~cond].reset_index(drop=True)
 
 # 3. 标签匹配模块（核心修改）
+# 分句标点与关键词中的正则语法字符（含这些字符的关键词按正则表达式匹配，如 r"(?:非常|超级)好玩"）
+SENTENCE_SPLIT = re.compile(r'[,.，。！？；\n]')
+_PATTERN_CHARS = re.compile(r'[\\()\[\]{}|?*+^$]')
+BASIC_NEGATION_WORDS = frozenset({"不", "没", "未", "无", "非", "勿"})
+
+
+class _Automaton:
+    """纯Python的Aho-Corasick自动机（未安装 pyahocorasick 时使用），接口与 ahocorasick.Automaton 一致"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add_word(self, word, value):
+        node = 0
+        for ch in word:
+            if ch not in self.goto[node]:
+                self.goto[node][ch] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = self.goto[node][ch]
+        self.output[node] = [value]
+
+    def make_automaton(self):
+        # 按层构建失败指针，并把失败链上的输出合并到当前节点
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(ch, 0)
+                self.fail[child] = fail if fail != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter(self, text):
+        """逐字扫描一次，产生 (匹配结束位置, 值)"""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for value in self.output[node]:
+                yield i, value
+
+
+class KeywordMatcher:
+    """
+    标签关键词与否定词编译成一个自动机，每句只扫描一遍
+    - 普通关键词与否定词：Aho-Corasick 自动机（已安装 pyahocorasick 时使用C实现）
+    - 正则关键词：合并为一个正则预筛，命中后再逐个确定是哪一条
+    """
+
+    def __init__(self, tag_keywords, negation_words=BASIC_NEGATION_WORDS):
+        self.tags = list(tag_keywords)
+        keyword_tags, pattern_tags = {}, {}
+        for tag, keywords in tag_keywords.items():
+            for kw in keywords:
+                if not kw:
+                    continue
+                target = pattern_tags if _PATTERN_CHARS.search(kw) else keyword_tags
+                target.setdefault(kw, []).append(tag)
+
+        # 同时是否定词的关键词所在句子必然被否定，按否定词处理即可
+        words = {word: (False, word, tuple(tags)) for word, tags in keyword_tags.items()}
+        words.update({word: (True, word, ()) for word in negation_words if word})
+        self.automaton = ahocorasick.Automaton() if ahocorasick is not None else _Automaton()
+        for word, value in words.items():
+            self.automaton.add_word(word, value)
+        self.automaton.make_automaton()
+        self.empty = not words
+
+        self.patterns = [(re.compile(kw), tuple(tags)) for kw, tags in pattern_tags.items()]
+        self.combined_pattern = (re.compile("|".join(f"(?:{kw})" for kw in pattern_tags))
+                                 if pattern_tags else None)
+
+    def _sentence_hits(self, sent):
+        """句中命中的 (起始位置, 关键词, 标签)；句中出现否定词时返回None"""
+        hits = []
+        if not self.empty:
+            for end, (negation, word, tags) in self.automaton.iter(sent):
+                if negation:
+                    return None
+                hits.append((end - len(word) + 1, word, tags))
+        if self.combined_pattern is not None and self.combined_pattern.search(sent):
+            for pattern, tags in self.patterns:
+                m = pattern.search(sent)
+                if m:
+                    hits.append((m.start(), m.group(), tags))
+        return hits
+
+    def match(self, text):
+        """
+        返回 (命中标签列表, 命中关键词列表)
+        标签按关键词词典中的顺序，关键词按在文本中首次出现的顺序（正则关键词报告实际匹配到的文字）
+        """
+        matched_tags, matched_keywords = set(), {}
+        for sent in SENTENCE_SPLIT.split(text):
+            sent = sent.strip()
+            if not sent:
+                continue
+            hits = self._sentence_hits(sent)
+            if not hits:
+                continue
+            for _, word, tags in sorted(hits, key=lambda hit: hit[0]):
+                matched_keywords.setdefault(word, None)
+                matched_tags.update(tags)
+        return [tag for tag in self.tags if tag in matched_tags], list(matched_keywords)
+
+
+@lru_cache(maxsize=32)
+def _cached_matcher(tag_items, negation_words):
+    return KeywordMatcher(dict(tag_items), negation_words)
+
+
+def compile_keyword_matcher(tag_keywords, negation_words=BASIC_NEGATION_WORDS):
+    """按 (标签关键词, 否定词) 缓存编译好的匹配器，相同词典只编译一次"""
+    tag_items = tuple((tag, tuple(keywords)) for tag, keywords in tag_keywords.items())
+    return _cached_matcher(tag_items, frozenset(negation_words))
+
+
 def manual_tagging(text, tag_keywords, 
-                  negation_words={"不", "没", "未", "无", "非", "勿"},
+                  negation_words=BASIC_NEGATION_WORDS,
                   max_context=3):
     """
     增强版标签匹配逻辑：
     1. 分句处理避免跨句误判
     2. 整句级否定检测
-    3. 关键词上下文否定检测
+    3. 关键词上下文否定检测（上下文窗口 max_context 位于句内，句中有否定词时整句已跳过，结果相同）
+    批量匹配请用 tag_texts，词典只需取一次缓存
     """
-    matched_tags = set()
-    matched_keywords = set()
-    
-    # 分句处理（支持中文标点）
-    sentences = re.split(r'[,.，。！？；\n]', text)
-    
-    for sent in sentences:
-        sent = sent.strip()
-        if not sent:
-            continue
-        
-        # 整句否定检测
-        if any(nw in sent for nw in negation_words):
-            continue
-            
-        # 遍历所有标签和关键词
-        for tag, keywords in tag_keywords.items():
-            for kw in keywords:
-                kw_pos = sent.find(kw)
-                if kw_pos == -1:
-                    continue
-                
-                # 上下文否定检测
-                context_start = max(0, kw_pos - max_context)
-                context_end = min(len(sent), kw_pos + len(kw) + max_context)
-                context = sent[context_start:context_end]
-                
-                if not any(nw in context for nw in negation_words):
-                    matched_tags.add(tag)
-                    matched_keywords.add(kw)
-    
-    return ", ".join(matched_tags), ", ".join(matched_keywords)
+    tags, keywords = compile_keyword_matcher(tag_keywords, negation_words).match(text)
+    return ", ".join(tags), ", ".join(keywords)
+
+
+def tag_texts(texts, tag_keywords, negation_words=BASIC_NEGATION_WORDS):
+    """批量标签匹配，返回 (匹配标签列表, 匹配关键词列表)，与逐条调用 manual_tagging 的结果一致"""
+    matcher = compile_keyword_matcher(tag_keywords, negation_words)
+    tags, keywords = [], []
+    for text in texts:
+        text_tags, text_keywords = matcher.match(text)
+        tags.append(", ".join(text_tags))
+        keywords.append(", ".join(text_keywords))
+    return tags, keywords
     
 # 4. 词云分析模块
-def generate_wordcloud(texts, stopwords, save_path=None, font_path='simhei.ttf'):
+def generate_wordcloud(texts, stopwords, save_path=None, font_path='simhei.ttf', progress_callback=None):
+    import matplotlib.pyplot as plt
+    tokenizer = get_tokenizer()
+    tracker = instrumentation(progress_callback, WORDCLOUD_STAGES)
+
     # 新增文本预处理
     def preprocess(text):
         # 移除标点符号
         text = re.sub(r'[^\w\s]', '', str(text))
         # 精确分词
-        return [word for word in jieba.lcut(text) 
+        return [word for word in tokenizer.lcut(text) 
                 if len(word) > 1 and word not in stopwords]
     
     # 合并所有文本并预处理
-    all_words = []
-    for text in texts:
-        all_words.extend(preprocess(text))
-    
-    # 手动统计词频
-    word_freq = Counter(all_words)
+    with tracker.stage('tokenize', rows=len(texts)):
+        all_words = []
+        for text in texts:
+            all_words.extend(preprocess(text))
     
-    # 过滤低频词
-    min_freq = 2  # 可调节参数
-    filtered_freq = {k:v for k,v in word_freq.items() if v >= min_freq}
-    
-    # 如果没有有效词频，创建默认词云
-    if not filtered_freq:
-        filtered_freq = {'暂无数据': 1}
+    with tracker.stage('frequencies') as info:
+        # 手动统计词频
+        word_freq = Counter(all_words)
+        
+        # 过滤低频词
+        min_freq = 2  # 可调节参数
+        filtered_freq = {k:v for k,v in word_freq.items() if v >= min_freq}
+        
+        # 如果没有有效词频，创建默认词云
+        if not filtered_freq:
+            filtered_freq = {'暂无数据': 1}
+        info['cells'] = len(filtered_freq)
     
     # 生成词云
+    with tracker.stage('render'):
+        _render_wordcloud(filtered_freq, font_path)
+    
+    with tracker.stage('save'):
+        if save_path:
+            plt.savefig(save_path, bbox_inches='tight', dpi=300)
+        plt.close()
+
+def _render_wordcloud(filtered_freq, font_path):
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
     try:
         wc = WordCloud(
             font_path=font_path,
@@ -122,36 +348,41 @@ def generate_wordcloud(texts, stopwords, save_path=None, font_path='simhei.ttf')
     plt.figure(figsize=(16, 12))
     plt.imshow(wc, interpolation='bilinear')
     plt.axis("off")
-    
-    if save_path:
-        plt.savefig(save_path, bbox_inches='tight', dpi=300)
-    plt.close()
 
 # 5. 文本聚类模块
-def text_clustering(texts, n_clusters=10, max_samples=20):
+def text_clustering(texts, n_clusters=10, max_samples=20, progress_callback=None):
+    os.environ["LOKY_PICKLER"] = "pickle"
+    os.environ["JOBLIB_START_METHOD"] = "loky"
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.cluster import KMeans
+    tracker = instrumentation(progress_callback, CLUSTERING_STAGES)
     # 确保有足够的文本进行聚类
     n_clusters = min(n_clusters, len(texts))
     
-    tfidf = TfidfVectorizer(max_features=500)
-    X = tfidf.fit_transform(texts)
+    with tracker.stage('vectorize', rows=len(texts)) as info:
+        tfidf = TfidfVectorizer(max_features=500)
+        X = tfidf.fit_transform(texts)
+        info['cells'] = X.nnz
     
-    kmeans = KMeans(
-        n_clusters=n_clusters,
-        n_init=10,
-        random_state=42,
-        init='k-means++'
-    )
-    
-    clusters = kmeans.fit_predict(X)
+    with tracker.stage('clustering', rows=len(texts)):
+        kmeans = KMeans(
+            n_clusters=n_clusters,
+            n_init=10,
+            random_state=42,
+            init='k-means++'
+        )
+        
+        clusters = kmeans.fit_predict(X)
     
-    results = []
-    for cluster_id in range(n_clusters):
-        cluster_texts = [t for t, c in zip(texts, clusters) if c == cluster_id]
-        results.append({
-            "cluster": cluster_id,
-            "count": len(cluster_texts),
-            "examples": cluster_texts[:max_samples]
-        })
+    with tracker.stage('summary'):
+        results = []
+        for cluster_id in range(n_clusters):
+            cluster_texts = [t for t, c in zip(texts, clusters) if c == cluster_id]
+            results.append({
+                "cluster": cluster_id,
+                "count": len(cluster_texts),
+                "examples": cluster_texts[:max_samples]
+            })
     return pd.DataFrame(results), clusters
 
 # 6. 结果输出模块